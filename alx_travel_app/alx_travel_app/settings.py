@@ -64,6 +64,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'listings.middleware.PerformanceMiddleware',  # request timings
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -101,6 +102,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLite has no row locks: take the write lock at BEGIN so that
+        # concurrent booking transactions queue instead of failing
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 # DATABASES = {
@@ -117,8 +124,49 @@ DATABASES = {
 #     }
 # }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# local memory by default; set REDIS_CACHE_URL to share it across workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'alx-travel-app',
+    }
+}
+if env('REDIS_CACHE_URL', default=None):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env('REDIS_CACHE_URL'),
+    }
+
+# seconds a cached listing response lives (0 disables response caching)
+LISTING_CACHE_TIMEOUT = env.int('LISTING_CACHE_TIMEOUT', default=300)
+
 # integrate a payment platform
 CHAPA_SECRET_KEY = os.getenv('CHAPA_SECRET_KEY')
+CHAPA_BASE_URL = env('CHAPA_BASE_URL', default='https://api.chapa.co/v1')
+# (connect, read) timeouts in seconds
+CHAPA_TIMEOUT = (
+    env.float('CHAPA_CONNECT_TIMEOUT', default=3.05),
+    env.float('CHAPA_READ_TIMEOUT', default=10),
+)
+CHAPA_MAX_RETRIES = env.int('CHAPA_MAX_RETRIES', default=3)
+CHAPA_BACKOFF_FACTOR = env.float('CHAPA_BACKOFF_FACTOR', default=0.5)
+CHAPA_POOL_SIZE = env.int('CHAPA_POOL_SIZE', default=10)
+# webhook signing secret (HMAC-SHA256 of the request body)
+CHAPA_WEBHOOK_SECRET = env('CHAPA_WEBHOOK_SECRET', default=None)
+# webhook events are applied this many per transaction, starting this
+# many seconds after the first delivery of a burst
+PAYMENT_EVENT_BATCH_SIZE = env.int('PAYMENT_EVENT_BATCH_SIZE', default=500)
+PAYMENT_EVENT_DEBOUNCE = env.int('PAYMENT_EVENT_DEBOUNCE', default=2)
+# reconciliation re-checks payments still Pending after this many seconds,
+# this many per transaction, with at most this many gateway calls in flight
+PAYMENT_RECONCILE_AFTER = env.int('PAYMENT_RECONCILE_AFTER', default=900)
+PAYMENT_RECONCILE_BATCH_SIZE = env.int(
+    'PAYMENT_RECONCILE_BATCH_SIZE', default=200)
+PAYMENT_RECONCILE_CONCURRENCY = env.int(
+    'PAYMENT_RECONCILE_CONCURRENCY', default=CHAPA_POOL_SIZE)
 
 
 # Password validation
@@ -162,12 +210,75 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# rows fetched per round trip by the streaming exports
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=2000)
+# bulk listing imports: rows validated and inserted per batch, and the
+# most rows a single API request may carry
+LISTING_IMPORT_BATCH_SIZE = env.int('LISTING_IMPORT_BATCH_SIZE', default=1000)
+LISTING_IMPORT_MAX_ROWS = env.int('LISTING_IMPORT_MAX_ROWS', default=10000)
+# amenity filters start from an amenity's listings (rather than probing
+# every listing) when it is linked to at most this many
+AMENITY_FILTER_DRIVE_LIMIT = env.int('AMENITY_FILTER_DRIVE_LIMIT', default=5000)
+# stay quotes: calendar years of nightly prices precomputed per listing
+# (from January 1st of the current year), how long a calendar is cached,
+# and the most stays a single batch quote may price
+PRICE_CALENDAR_YEARS = env.int('PRICE_CALENDAR_YEARS', default=2)
+PRICE_CALENDAR_TIMEOUT = env.int('PRICE_CALENDAR_TIMEOUT', default=86400)
+QUOTE_MAX_STAYS = env.int('QUOTE_MAX_STAYS', default=500)
+# booking lifecycle sweeps: unpaid Pending bookings expire after this many
+# seconds (or on their check-in day); bookings updated per transaction
+BOOKING_PENDING_TTL = env.int('BOOKING_PENDING_TTL', default=86400)
+BOOKING_LIFECYCLE_BATCH_SIZE = env.int(
+    'BOOKING_LIFECYCLE_BATCH_SIZE', default=2000)
+# notification emails: sender address; queued messages are sent this many
+# per SMTP batch, starting this many seconds after the first of a burst,
+# at most this many per second; failing ones are retried this many times
+DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='no-reply@yourdomain.com')
+EMAIL_OUTBOX_BATCH_SIZE = env.int('EMAIL_OUTBOX_BATCH_SIZE', default=100)
+EMAIL_OUTBOX_FLUSH_INTERVAL = env.int('EMAIL_OUTBOX_FLUSH_INTERVAL', default=10)
+EMAIL_OUTBOX_RATE_LIMIT = env.float('EMAIL_OUTBOX_RATE_LIMIT', default=50)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5)
+
+# request instrumentation: share of requests timed (0 disables, 1 times
+# all), and the bearer token that unlocks the metrics endpoint and the
+# Server-Timing header (otherwise staff only, or anyone under DEBUG)
+PERF_SAMPLE_RATE = env.float('PERF_SAMPLE_RATE', default=0.01)
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
-} # this is to allow all users to access the API
+    ],  # this is to allow all users to access the API
+    # keyset pagination on (created_at, id); ?page_size= is capped at 100
+    'DEFAULT_PAGINATION_CLASS': 'listings.pagination.KeysetPagination',
+    'PAGE_SIZE': env.int('API_PAGE_SIZE', default=20),
+}
 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# run tasks inline (no broker), e.g. for local development and tests
+CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=False)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_BEAT_SCHEDULE = {
+    # safety net for webhook events whose scheduled run was lost
+    'process-payment-events': {
+        'task': 'listings.tasks.process_payment_events',
+        'schedule': 60.0,
+    },
+    # settles Pending payments that never got a verify call or webhook
+    'reconcile-payments': {
+        'task': 'listings.tasks.reconcile_payments',
+        'schedule': 900.0,
+    },
+    # safety net for queued emails whose scheduled flush was lost
+    'flush-emails': {
+        'task': 'listings.tasks.flush_emails',
+        'schedule': 60.0,
+    },
+    # expires unpaid Pending bookings and completes past stays
+    'update-booking-statuses': {
+        'task': 'listings.tasks.update_booking_statuses',
+        'schedule': 3600.0,
+    },
+}
@@ -0,0 +1,89 @@
+"""
+Amenity filters through the link table against scanning the JSON column.
+
+Fills a throwaway database with listings whose amenities follow a skewed
+distribution (from almost every listing down to a handful), links them
+as the bulk paths do, then times the first keyset page of results for
+common, mixed and rare combinations through `filter_amenities` and
+through LIKE matching on the JSON text.
+
+    python -m benchmarks.amenities --listings 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from benchmarks.common import setup, timer
+
+# amenity -> share of listings that have it
+FREQUENCIES = {
+    'WiFi': 0.9, 'Kitchen': 0.6, 'Parking': 0.3, 'Pool': 0.1,
+    'Sauna': 0.01, 'Helipad': 0.001,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from django.db.models import Q
+    from listings.amenities import filter_amenities, sync_amenities
+    from listings.models import Listing
+
+    rng = random.Random(0)
+    host = User.objects.create_user(username='host', password='x')
+
+    with timer('listings', args.listings), transaction.atomic():
+        for start in range(0, args.listings, args.batch_size):
+            listings = Listing.objects.bulk_create([
+                Listing(
+                    title=f'Listing {i}', description='Benchmark listing',
+                    location=f'City {i % 500}',
+                    price_per_night=Decimal(100), property_type='house',
+                    max_guests=4, host=host,
+                    amenities=[name for name, share in FREQUENCIES.items()
+                               if rng.random() < share],
+                )
+                for i in range(start, min(start + args.batch_size,
+                                          args.listings))
+            ])
+            sync_amenities(listings, created=True)
+
+    def linked(names):
+        return filter_amenities(Listing.objects.all(), names)
+
+    def scanned(names):
+        return Listing.objects.filter(*[
+            Q(amenities__icontains=f'"{name}"') for name in names])
+
+    combinations = {
+        'two common': ['WiFi', 'Kitchen'],
+        'three common': ['Kitchen', 'Parking', 'Pool'],
+        'common + rare': ['WiFi', 'Sauna'],
+        'two rare': ['Sauna', 'Helipad'],
+        'rarest': ['Helipad'],
+    }
+    for label, names in combinations.items():
+        for name, query in (('links', linked), ('JSON', scanned)):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                rows = list(
+                    query(names).order_by('-created_at', '-id')[:20])
+                timings.append(time.perf_counter() - started)
+            print(f'{label:>14} {name:>5}: '
+                  f'{statistics.median(timings) * 1000:9.1f}ms '
+                  f'({len(rows)} rows)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Availability search benchmark: anti-join vs. per-listing overlap checks.
+
+    python -m benchmarks.availability --listings 100000 --bookings 1000000
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import populate, setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=100_000)
+    parser.add_argument('--bookings', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.db import connection
+    from listings.models import Booking, Listing
+
+    populate(listings=args.listings, bookings=args.bookings)
+    with timer('analyze'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    rng = random.Random(1)
+    today = date.today()
+    windows = []
+    for _ in range(args.queries):
+        check_in = today + timedelta(days=rng.randint(0, 300))
+        windows.append(
+            (check_in, check_in + timedelta(days=rng.randint(1, 14)),
+             rng.randint(1, 6)))
+
+    queryset = Listing.objects.available_between(*windows[0])
+    print('plan:')
+    with connection.cursor() as cursor:
+        sql, params = queryset.values('id').query.sql_with_params()
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        for row in cursor.fetchall():
+            print('   ', row[-1])
+
+    first_page, counts = [], []
+    for check_in, check_out, guests in windows:
+        queryset = Listing.objects.available_between(
+            check_in, check_out, guests)
+        start = time.perf_counter()
+        list(queryset.values_list('id', flat=True)[:args.page_size])
+        first_page.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        queryset.count()
+        counts.append(time.perf_counter() - start)
+
+    print(f'anti-join first page: {1000 * sum(first_page) / len(first_page):.2f} ms avg')
+    print(f'anti-join full count: {1000 * sum(counts) / len(counts):.2f} ms avg')
+
+    # the pre-existing approach: one overlap query per candidate listing
+    check_in, check_out, guests = windows[0]
+    sample = list(Listing.objects.filter(
+        available=True, max_guests__gte=guests
+    ).values_list('id', flat=True)[:1000])
+    start = time.perf_counter()
+    for listing_id in sample:
+        Booking.objects.filter(
+            listing_id=listing_id
+        ).overlapping(check_in, check_out).exists()
+    elapsed = time.perf_counter() - start
+    print(f'per-listing checks: {1000 * elapsed / len(sample):.3f} ms/listing '
+          f'(~{elapsed * args.listings / len(sample):.1f}s for all listings)')
+
+
+if __name__ == '__main__':
+    main()
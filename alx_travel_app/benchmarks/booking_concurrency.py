@@ -0,0 +1,86 @@
+"""
+Concurrent booking stress test.
+
+Fires overlapping booking requests at a handful of listings from many
+threads through BookingSerializer, then asserts that no two active
+bookings share a night and reports throughput.
+
+    python -m benchmarks.booking_concurrency --requests 500 --workers 32
+"""
+import argparse
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from benchmarks.common import populate, setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--listings', type=int, default=5)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.contrib.auth.models import User
+    from django.db import OperationalError, connection
+    from django.db.models import Exists, OuterRef
+    from rest_framework.exceptions import ValidationError
+    from listings.models import Booking
+    from listings.serializers import BookingSerializer
+
+    listing_ids = populate(users=50, listings=args.listings)
+    user_id = User.objects.values_list('id', flat=True).first()
+    rng = random.Random(0)
+    start_day = date.today() + timedelta(days=1)
+    payloads = []
+    for _ in range(args.requests):
+        check_in = start_day + timedelta(days=rng.randint(0, 30))
+        payloads.append({
+            'listing_id': rng.choice(listing_ids),
+            'user_id': user_id,
+            'check_in_date': check_in.isoformat(),
+            'check_out_date': (
+                check_in + timedelta(days=rng.randint(1, 5))).isoformat(),
+            'guests': 1,
+        })
+
+    def book(payload):
+        try:
+            serializer = BookingSerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return 'created'
+        except ValidationError:
+            return 'conflict'
+        except OperationalError:
+            return 'error'
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        outcomes = list(pool.map(book, payloads))
+    elapsed = time.perf_counter() - started
+
+    overlap_count = Booking.objects.active().filter(Exists(
+        Booking.objects.filter(
+            listing=OuterRef('listing'), id__gt=OuterRef('id')
+        ).overlapping(OuterRef('check_in_date'), OuterRef('check_out_date'))
+    )).count()
+
+    for outcome in ('created', 'conflict', 'error'):
+        print(f'{outcome}: {outcomes.count(outcome)}')
+    print(f'throughput: {len(payloads) / elapsed:,.0f} requests/s '
+          f'({elapsed:.2f}s, {args.workers} workers)')
+    print(f'overlapping bookings: {overlap_count}')
+    if overlap_count:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks never touch the configured database: `setup()` points Django at
+a throwaway SQLite file, migrates it and returns once the app registry is
+ready. Run them from the project directory, e.g.
+
+    python -m benchmarks.availability --listings 100000 --bookings 1000000
+"""
+import atexit
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+
+def setup(db_path=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_travel_app.settings')
+    from django.conf import settings
+
+    if db_path is None:
+        handle, db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        atexit.register(os.remove, db_path)
+    settings.DATABASES['default']['NAME'] = db_path
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+@contextmanager
+def timer(label, rows=None):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    line = f'{label}: {elapsed:.3f}s'
+    if rows:
+        line += f' ({rows / elapsed:,.0f} rows/s)'
+    print(line)
+
+
+def populate(users=1000, listings=1000, bookings=0, seed=0, batch_size=5000):
+    """Bulk insert a synthetic dataset and return the listing ids."""
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from listings.models import Booking, Listing
+
+    rng = random.Random(seed)
+    password = make_password('password123')
+    property_types = [choice for choice, _ in Listing.PROPERTY_TYPES]
+    statuses = [choice for choice, _ in Booking.STATUS_CHOICES]
+    today = date.today()
+
+    with timer('users', users), transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f'bench{i}', password=password)
+             for i in range(users)],
+            batch_size=batch_size)
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    with timer('listings', listings), transaction.atomic():
+        for start in range(0, listings, batch_size):
+            Listing.objects.bulk_create([
+                Listing(
+                    title=f'Listing {i}',
+                    description='Benchmark listing',
+                    price_per_night=Decimal(rng.randint(50, 500)),
+                    location=f'City {i % 500}',
+                    property_type=rng.choice(property_types),
+                    max_guests=rng.randint(1, 8),
+                    host_id=rng.choice(user_ids),
+                )
+                for i in range(start, min(start + batch_size, listings))
+            ])
+    listing_ids = list(Listing.objects.values_list('id', flat=True))
+
+    if not bookings:
+        return listing_ids
+
+    with timer('bookings', bookings), transaction.atomic():
+        for start in range(0, bookings, batch_size):
+            rows = []
+            for _ in range(min(batch_size, bookings - start)):
+                check_in = today + timedelta(days=rng.randint(-60, 300))
+                nights = rng.randint(1, 14)
+                rows.append(Booking(
+                    listing_id=rng.choice(listing_ids),
+                    user_id=rng.choice(user_ids),
+                    check_in_date=check_in,
+                    check_out_date=check_in + timedelta(days=nights),
+                    guests=1,
+                    total_price=Decimal(100 * nights),
+                    status=rng.choice(statuses),
+                ))
+            Booking.objects.bulk_create(rows)
+
+    return listing_ids
@@ -0,0 +1,63 @@
+"""
+Streaming export: time to first byte, throughput and memory.
+
+Fills a throwaway database, then streams the bookings export through the
+Django test client in each format and reports the time to the first
+chunk, the total time, and how far the resident set grew while streaming
+(sampled from /proc/self/statm on every chunk).
+
+    python -m benchmarks.export --bookings 1000000
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import populate, setup
+
+
+def rss_mb():
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    populate(users=1000, listings=args.listings, bookings=args.bookings)
+    staff = User.objects.create_user(
+        username='ops', password='x', is_staff=True)
+    client = Client()
+    client.force_login(staff)
+
+    for fmt, query in (('csv', {}), ('ndjson', {}), ('csv', {'gzip': 1})):
+        label = fmt + (' gzip' if query else '')
+        baseline = peak = rss_mb()
+        started = time.perf_counter()
+        response = client.get(f'/api/export/bookings.{fmt}', query)
+        first_byte = None
+        size = 0
+        for chunk in response.streaming_content:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+            peak = max(peak, rss_mb())
+        elapsed = time.perf_counter() - started
+        print(f'{label}: first byte {first_byte * 1000:.1f}ms, '
+              f'{elapsed:.1f}s total ({args.bookings / elapsed:,.0f} rows/s), '
+              f'{size / 2 ** 20:,.0f} MB, '
+              f'RSS +{peak - baseline:.1f} MB (peak {peak:.0f} MB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Proximity search through geohash cells against a coordinate range scan.
+
+Fills a throwaway database with listings clustered around a few cities
+(plus a uniform sprinkling over the globe), then times the first page of
+radius and box searches through the geohash index and through a plain
+latitude/longitude range filter, which SQLite can only answer by scanning
+the table. Finally times `backfill_geo` recomputing every geohash.
+
+    python -m benchmarks.geo --listings 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+from decimal import Decimal
+from io import StringIO
+
+from benchmarks.common import setup, timer
+
+CITIES = [
+    (40.7128, -74.0060), (34.0522, -118.2437), (41.8781, -87.6298),
+    (51.5074, -0.1278), (48.8566, 2.3522), (35.6762, 139.6503),
+    (-33.8688, 151.2093), (-23.5505, -46.6333), (19.4326, -99.1332),
+    (52.5200, 13.4050),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import transaction
+    from listings.geo import bounding_box, distance_sq, near
+    from listings.models import Listing
+
+    rng = random.Random(0)
+    host = User.objects.create_user(username='host', password='x')
+
+    def point():
+        if rng.random() < 0.3:
+            return rng.uniform(-60, 70), rng.uniform(-180, 180)
+        latitude, longitude = rng.choice(CITIES)
+        return (latitude + rng.gauss(0, 0.15),
+                longitude + rng.gauss(0, 0.15))
+
+    with timer('listings', args.listings), transaction.atomic():
+        for start in range(0, args.listings, args.batch_size):
+            rows = []
+            for i in range(start, min(start + args.batch_size,
+                                      args.listings)):
+                latitude, longitude = point()
+                rows.append(Listing(
+                    title=f'Listing {i}', description='Benchmark listing',
+                    location=f'City {i % 500}',
+                    price_per_night=Decimal(100), property_type='house',
+                    max_guests=4, host=host,
+                    latitude=latitude, longitude=longitude,
+                ))
+            Listing.objects.bulk_create(rows)
+
+    def indexed(latitude, longitude, radius):
+        return near(Listing.objects.all(), latitude, longitude, radius)
+
+    def scanned(latitude, longitude, radius):
+        min_lat, min_lng, max_lat, max_lng = bounding_box(
+            latitude, longitude, radius)
+        return Listing.objects.filter(
+            latitude__range=(min_lat, max_lat),
+            longitude__range=(min_lng, max_lng),
+        ).annotate(
+            distance_sq=distance_sq(latitude, longitude)
+        ).filter(distance_sq__lte=radius * radius).order_by('distance_sq')
+
+    searches = {
+        'city centre 2km': (40.7128, -74.0060, 2),
+        'city centre 10km': (40.7128, -74.0060, 10),
+        'city edge 50km': (51.2, 0.3, 50),
+        'sparse 200km': (10.0, 20.0, 200),
+    }
+    for label, (latitude, longitude, radius) in searches.items():
+        for name, query in (('geohash', indexed), ('scan', scanned)):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                rows = list(query(latitude, longitude, radius)[:20])
+                timings.append(time.perf_counter() - started)
+            matches = query(latitude, longitude, radius).count()
+            print(f'{label:>17} {name:>7}: '
+                  f'{statistics.median(timings) * 1000:9.1f}ms '
+                  f'({len(rows)} rows of {matches})')
+
+    Listing.objects.update(geohash='')
+    with timer('backfill_geo', args.listings):
+        call_command('backfill_geo', stdout=StringIO())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Overhead of the request instrumentation.
+
+Serves the same API requests through the full middleware stack without
+PerformanceMiddleware, with it at PERF_SAMPLE_RATE=0 and with every
+request sampled, interleaving the rounds so drift hits all three alike,
+and compares the sums of the per-request medians. Response caching is
+turned off so every request runs its serializers. Exits non-zero when
+sampling every request costs more than --max-overhead percent.
+
+    python -m benchmarks.instrumentation --listings 1000 --rounds 20
+"""
+import argparse
+import statistics
+import sys
+import time
+
+from benchmarks.common import populate, setup
+
+MIDDLEWARE = 'listings.middleware.PerformanceMiddleware'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--max-overhead', type=float, default=5,
+                        help='percent of the uninstrumented median')
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.conf import settings
+    from django.test import Client
+    from listings.metrics import render_metrics
+
+    listing_ids = populate(
+        users=100, listings=args.listings, bookings=args.bookings)
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+    # serialize every response rather than serving cached ones
+    settings.LISTING_CACHE_TIMEOUT = 0
+    paths = [
+        '/api/listings/',
+        '/api/listings/?page_size=100',
+        f'/api/listings/{listing_ids[0]}/',
+        f'/api/listings/{listing_ids[0]}/calendar/',
+    ]
+
+    def client(instrumented, rate):
+        settings.MIDDLEWARE = [
+            name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+        if instrumented:
+            settings.MIDDLEWARE.insert(0, MIDDLEWARE)
+        http = Client()
+        http.handler.load_middleware()
+        return http, rate
+
+    configs = {
+        'off': client(False, 0),
+        'rate 0': client(True, 0),
+        'rate 1': client(True, 1),
+    }
+    timings = {label: {path: [] for path in paths} for label in configs}
+    labels = list(configs)
+    for round_ in range(args.rounds + 1):
+        # rotate the order so none always runs first
+        for label in labels[round_ % 3:] + labels[:round_ % 3]:
+            http, rate = configs[label]
+            settings.PERF_SAMPLE_RATE = rate
+            for path in paths:
+                started = time.perf_counter()
+                response = http.get(path)
+                elapsed = time.perf_counter() - started
+                assert response.status_code == 200, (path, response)
+                if round_:  # the first round warms caches
+                    timings[label][path].append(elapsed)
+
+    def total(label):
+        return sum(statistics.median(values)
+                   for values in timings[label].values())
+
+    base = total('off')
+    overhead = 0
+    for label in configs:
+        overhead = (total(label) - base) / base * 100
+        print(f'{label:>6}: {total(label) * 1000:7.3f}ms for the '
+              f'{len(paths)} requests (medians), {overhead:+5.1f}%')
+    print(f'metrics: {len(render_metrics())} bytes')
+    if overhead > args.max_overhead:
+        print(f'overhead above {args.max_overhead}%')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Booking lifecycle sweeps: chunked UPDATEs against per-booking saves.
+
+Bulk inserts bookings spread around today (see `populate`), backdates
+them so every Pending one is stale, then times `run_booking_lifecycle`
+expiring and completing them, including the occupancy refreshes, and the
+average chunk transaction. For comparison, a sample of the same
+transitions is replayed with one save() per booking, as a naive task
+would do, and extrapolated.
+
+    python -m benchmarks.lifecycle --listings 10000 --bookings 1000000
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from benchmarks.common import populate, setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--sample', type=int, default=2000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.utils import timezone
+    from listings import tasks
+    from listings.models import Booking, Listing
+    from listings.occupancy import rebuild_occupancy
+
+    populate(users=1000, listings=args.listings, bookings=args.bookings)
+    rebuild_occupancy(Listing.objects.all())
+    Booking.objects.update(created_at=timezone.now() - timedelta(days=30))
+    today = timezone.localdate()
+    due = Booking.objects.filter(status='pending').count() + \
+        Booking.objects.filter(
+            status='confirmed', check_out_date__lte=today).count()
+
+    totals = tasks.run_booking_lifecycle(args.batch_size)
+    chunks = -(-totals['expired'] // args.batch_size) - (
+        -totals['completed'] // args.batch_size)
+    print(f"sweep: {totals['expired']} expired, {totals['completed']} "
+          f"completed of {due} due in {totals['seconds']:.3f}s "
+          f"({chunks} chunks, "
+          f"{totals['seconds'] / max(chunks, 1) * 1000:.1f}ms each)")
+
+    # naive: the same transitions, one save() per booking
+    Booking.objects.filter(pk__in=list(
+        Booking.objects.filter(status='completed')
+        .values_list('pk', flat=True)[:args.sample])
+    ).update(status='confirmed')
+    sample = list(
+        Booking.objects.filter(status='confirmed', check_out_date__lte=today)
+        [:args.sample])
+    started = time.perf_counter()
+    for booking in sample:
+        booking.status = 'completed'
+        booking.save()
+    elapsed = time.perf_counter() - started
+    print(f'saves: {len(sample)} in {elapsed:.3f}s, '
+          f'~{elapsed / len(sample) * due:.0f}s for all {due}')
+
+
+if __name__ == '__main__':
+    main()
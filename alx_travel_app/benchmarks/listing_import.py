@@ -0,0 +1,59 @@
+"""
+Bulk listing import throughput.
+
+Posts --rows listings (a few of them invalid) to /api/listings/bulk/ in a
+single request and reports the wall time and rows/s.
+
+    python -m benchmarks.listing_import --rows 10000
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import populate, setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    settings.LISTING_IMPORT_MAX_ROWS = max(
+        settings.LISTING_IMPORT_MAX_ROWS, args.rows)
+    populate(users=1000, listings=0)
+    host_ids = list(User.objects.values_list('id', flat=True))
+    rng = random.Random(0)
+    rows = [{
+        'title': f'Imported {i}',
+        'description': 'Bulk imported listing',
+        'location': f'City {i % 500}',
+        'price_per_night': str(rng.randint(50, 500)),
+        'property_type': 'apartment',
+        'max_guests': rng.randint(1, 8),
+        'amenities': ['WiFi', 'Kitchen'],
+        # one row in a thousand names a host that does not exist
+        'host_id': rng.choice(host_ids) if i % 1000 else 0,
+    } for i in range(args.rows)]
+    body = json.dumps(rows)
+
+    started = time.perf_counter()
+    response = Client().post(
+        '/api/listings/bulk/', body, content_type='application/json')
+    elapsed = time.perf_counter() - started
+    result = response.json()
+    print(f'status {response.status_code}: created {result["created"]}, '
+          f'rejected {len(result["errors"])}')
+    print(f'{elapsed:.2f}s ({args.rows / elapsed:,.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Notification emails through the outbox against one connection each.
+
+Starts a minimal local SMTP sink (optionally adding latency to every
+reply, as a remote relay would), then delivers the same messages with
+send_mail, which opens a connection per message as the old per-message
+task did, and by queueing them in the outbox and flushing it over one
+reused connection.
+
+    python -m benchmarks.notifications --messages 2000 --latency 2
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+from benchmarks.common import setup, timer
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+    """Accepts every message and discards it"""
+
+    def reply(self, line):
+        time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO' or command == b'HELO':
+                self.reply('250 sink')
+            elif command == b'DATA':
+                self.reply('354 end with .')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.received += 1
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=2,
+                        help='milliseconds added to every SMTP reply')
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPSink)
+    server.daemon_threads = True
+    server.latency = args.latency / 1000
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    setup(args.db)
+    from django.conf import settings
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = server.server_address
+    from django.core.mail import send_mail
+    from listings.tasks import queue_emails, send_queued_emails
+
+    messages = [
+        (f'guest{n}@example.com', {'booking_reference': f'BK-{n}'})
+        for n in range(args.messages)
+    ]
+
+    with timer('send_mail per message', args.messages):
+        for recipient, context in messages:
+            send_mail('Payment confirmation',
+                      f"Your payment for booking "
+                      f"{context['booking_reference']} was successful!",
+                      None, [recipient])
+
+    with timer('queue', args.messages):
+        queue_emails('payment_confirmed', messages)
+    with timer('outbox flush', args.messages):
+        totals = send_queued_emails(rate_limit=1e9)
+    print(f"sent {totals['sent']}, sink received {server.received} "
+          f"of {2 * args.messages}")
+
+
+if __name__ == '__main__':
+    main()
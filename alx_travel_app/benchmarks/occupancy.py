@@ -0,0 +1,84 @@
+"""
+Availability calendars from occupancy bitmaps against booking scans.
+
+Bulk inserts listings and bookings, times `rebuild_occupancy` building
+every bitmap, then reads 365-night calendars of random listings from the
+bitmaps and by fetching the listing's overlapping bookings and marking
+their nights. Finally times booking status changes, which refresh the
+bitmaps from the signals.
+
+    python -m benchmarks.occupancy --listings 10000 --bookings 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import populate, setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--reads', type=int, default=1000)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from listings.models import Booking, Listing
+    from listings.occupancy import booked_nights, rebuild_occupancy
+
+    listing_ids = populate(
+        users=1000, listings=args.listings, bookings=args.bookings)
+    with timer('rebuild_occupancy', args.listings):
+        rebuild_occupancy(Listing.objects.all())
+
+    start = date.today()
+    end = start + timedelta(days=365)
+
+    def scanned(listing_id):
+        if not Listing.objects.filter(pk=listing_id).exists():
+            return None
+        nights = ['0'] * 365
+        stays = Booking.objects.filter(listing_id=listing_id) \
+            .overlapping(start, end) \
+            .values_list('check_in_date', 'check_out_date')
+        for check_in, check_out in stays:
+            lo = max((check_in - start).days, 0)
+            hi = min((check_out - start).days, 365)
+            nights[lo:hi] = '1' * (hi - lo)
+        return ''.join(nights)
+
+    rng = random.Random(0)
+    sample = [rng.choice(listing_ids) for _ in range(args.reads)]
+    for label, read in (
+            ('bitmap', lambda listing_id: booked_nights(
+                listing_id, start, end)),
+            ('scan', scanned)):
+        timings = []
+        for listing_id in sample:
+            started = time.perf_counter()
+            read(listing_id)
+            timings.append(time.perf_counter() - started)
+        print(f'{label:>6}: {statistics.median(timings) * 1000:7.3f}ms '
+              f'median, {max(timings) * 1000:7.3f}ms max per calendar')
+    mismatches = sum(
+        booked_nights(listing_id, start, end) != scanned(listing_id)
+        for listing_id in sample[:100])
+    print(f'mismatches: {mismatches}')
+
+    bookings = list(
+        Booking.objects.filter(status__in=['pending', 'confirmed'])
+        .order_by('?')[:args.updates])
+    for label, status in (('confirm', 'confirmed'), ('cancel', 'cancelled')):
+        with timer(f'{label} saves', len(bookings)):
+            for booking in bookings:
+                booking.status = status
+                booking.save(update_fields=['status'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Batch stay quotes through cached price calendars.
+
+Gives every listing a weekend rate and a seasonal rate with a minimum
+stay, then prices batches of stays over random listings: cold (calendars
+built from one query), warm (calendars from the cache), and per stay
+with a rules query and a night-by-night loop, as a naive engine would.
+
+    python -m benchmarks.quotes --listings 10000 --stays 500
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from benchmarks.common import populate, setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--stays', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.conf import settings
+    # room for every calendar in the default local memory cache
+    settings.CACHES['default'].setdefault('OPTIONS', {})['MAX_ENTRIES'] = \
+        4 * args.listings
+    from django.core.cache import cache
+    from django.db import connection, reset_queries
+    from django.test.utils import CaptureQueriesContext
+    from listings.models import Listing, RateRule
+    from listings.pricing import quote_stays
+
+    listing_ids = populate(users=100, listings=args.listings)
+    year = date.today().year
+    with timer('rules', 2 * args.listings):
+        RateRule.objects.bulk_create([
+            rule
+            for listing_id in listing_ids
+            for rule in (
+                RateRule(listing_id=listing_id,
+                         weekdays=RateRule.WEEKEND,
+                         price_per_night=Decimal('150')),
+                RateRule(listing_id=listing_id, priority=1,
+                         start_date=date(year, 6, 1),
+                         end_date=date(year, 8, 31),
+                         price_per_night=Decimal('220'), min_nights=3),
+            )
+        ], batch_size=5000)
+
+    rng = random.Random(0)
+    start = date(year, 1, 1)
+
+    def batch():
+        stays = []
+        for _ in range(args.stays):
+            check_in = start + timedelta(days=rng.randint(0, 300))
+            stays.append((rng.choice(listing_ids), check_in,
+                          check_in + timedelta(days=rng.randint(1, 14))))
+        return stays
+
+    def naive(stays):
+        quotes = []
+        for listing_id, check_in, check_out in stays:
+            listing = Listing.objects.get(id=listing_id)
+            rules = list(
+                RateRule.objects.filter(listing_id=listing_id)
+                .order_by('priority', 'id'))
+            total = Decimal(0)
+            day = check_in
+            while day < check_out:
+                price = listing.price_per_night
+                for rule in rules:
+                    if (rule.start_date is None or rule.start_date <= day) \
+                            and (rule.end_date is None
+                                 or day <= rule.end_date) \
+                            and rule.weekdays >> day.weekday() & 1 \
+                            and rule.price_per_night is not None:
+                        price = rule.price_per_night
+                total += price
+                day += timedelta(days=1)
+            quotes.append(total)
+        return quotes
+
+    for label in ('cold', 'warm', 'naive'):
+        timings, queries = [], 0
+        for _ in range(args.repeat):
+            stays = batch()
+            if label == 'cold':
+                cache.clear()
+            elif label == 'warm':
+                quote_stays(stays)
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                if label == 'naive':
+                    naive(stays)
+                else:
+                    quote_stays(stays)
+                timings.append(time.perf_counter() - started)
+            queries = len(captured)
+        print(f'{label:>5}: {statistics.median(timings) * 1000:8.1f}ms '
+              f'per {args.stays} stays ({queries} queries)')
+
+
+if __name__ == '__main__':
+    main()
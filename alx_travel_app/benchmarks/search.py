@@ -0,0 +1,86 @@
+"""
+Full-text search against substring scans.
+
+Fills a throwaway database with listings whose text is drawn from a
+synthetic vocabulary, builds the search index, then times the first page
+of results for rare, common and prefix queries through the configured
+backend and through unindexed LIKE matching.
+
+    python -m benchmarks.search --listings 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from benchmarks.common import setup, timer
+
+WORDS = [
+    'beach', 'cabin', 'loft', 'villa', 'garden', 'quiet', 'cozy', 'modern',
+    'ocean', 'mountain', 'lake', 'downtown', 'historic', 'family', 'pool',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from listings.models import Listing
+    from listings.search import BasicSearchBackend, get_search_backend
+
+    rng = random.Random(0)
+    # a long tail of made-up words so that some queries are selective
+    vocabulary = WORDS + [f'w{n:05d}' for n in range(50000)]
+    host = User.objects.create_user(username='host', password='x')
+
+    def text(words):
+        return ' '.join(
+            rng.choice(WORDS) if rng.random() < 0.3 else rng.choice(vocabulary)
+            for _ in range(words))
+
+    with timer('listings', args.listings), transaction.atomic():
+        for start in range(0, args.listings, args.batch_size):
+            Listing.objects.bulk_create([
+                Listing(
+                    title=text(3), description=text(25),
+                    location=f'City {i % 500}',
+                    price_per_night=Decimal(100), property_type='house',
+                    max_guests=4, host=host,
+                )
+                for i in range(start, min(start + args.batch_size,
+                                          args.listings))
+            ])
+
+    backend = get_search_backend()
+    with timer('index', args.listings), transaction.atomic():
+        backend.rebuild(Listing.objects.all(), args.batch_size)
+
+    queries = {
+        'rare word': 'w01234',
+        'two rare words': 'w01234 w04321',
+        'common word': 'beach',
+        'prefix': 'w0123',
+    }
+    for label, text in queries.items():
+        for name, engine in (('index', backend),
+                             ('LIKE', BasicSearchBackend())):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                rows = list(engine.search(Listing.objects.all(), text)[:20])
+                timings.append(time.perf_counter() - started)
+            print(f'{label:>15} {name:>5}: '
+                  f'{statistics.median(timings) * 1000:9.1f}ms '
+                  f'({len(rows)} rows)')
+
+
+if __name__ == '__main__':
+    main()
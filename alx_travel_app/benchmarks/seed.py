@@ -0,0 +1,56 @@
+"""
+Bulk seeding throughput and memory.
+
+Runs `seed --bulk` against a throwaway database and reports the command's
+rows/s output along with the peak RSS, which should stay flat as
+--bookings grows. --workers splits generation over processes; the same
+--seed yields the same rows whatever the worker count.
+
+    python -m benchmarks.seed --bookings 1000000
+    python -m benchmarks.seed --bookings 9000000 --workers 8 --seed 1
+"""
+import argparse
+import resource
+import time
+
+from benchmarks.common import setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.core.management import call_command
+
+    started = time.perf_counter()
+    call_command(
+        'seed', '--bulk',
+        '--users', str(args.users),
+        '--listings', str(args.listings),
+        '--bookings', str(args.bookings),
+        '--reviews', str(args.reviews),
+        '--batch-size', str(args.batch_size),
+        '--workers', str(args.workers),
+        '--seed', str(args.seed),
+    )
+    elapsed = time.perf_counter() - started
+    rows = args.users + args.listings + args.bookings + args.reviews
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) / 1024
+    print(f'total: {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)')
+    print(f'peak RSS per process: {peak:,.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
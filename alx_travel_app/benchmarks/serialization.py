@@ -0,0 +1,70 @@
+"""
+Serializer throughput benchmark: full ListingSerializer vs. the flat
+ListingListSerializer used by list endpoints.
+
+    python -m benchmarks.serialization --listings 10000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import populate, setup
+
+
+def measure(label, queryset, serializer_class, repeat):
+    start = time.perf_counter()
+    rows = list(queryset)
+    fetched = time.perf_counter() - start
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serializer_class(rows, many=True).data
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    per_item = 1e6 * best / len(rows)
+    print(f'{label}: fetch {fetched:.3f}s, serialize {best:.3f}s '
+          f'({per_item:.1f} us/item, {len(rows) / best:,.0f} items/s)')
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=10_000)
+    parser.add_argument('--reviews', type=int, default=3,
+                        help='reviews per listing for the full serializer')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    setup(args.db)
+    from django.contrib.auth.models import User
+    from listings.models import Listing, Review
+    from listings.serializers import ListingListSerializer, ListingSerializer
+
+    listing_ids = populate(users=max(args.reviews, 10), listings=args.listings)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    rng = random.Random(0)
+    Review.objects.bulk_create([
+        Review(listing_id=listing_id, user_id=user_id,
+               rating=rng.randint(1, 5), comment='Benchmark review')
+        for listing_id in listing_ids
+        for user_id in user_ids[:args.reviews]
+    ], batch_size=5000)
+    Listing.objects.rebuild_rating_stats()
+
+    queryset = Listing.objects.all()
+    old = measure(
+        'ListingSerializer (old list path)',
+        queryset.for_api(ListingSerializer.Meta.fields),
+        ListingSerializer, args.repeat)
+    new = measure(
+        'ListingListSerializer',
+        queryset.for_api(ListingListSerializer.Meta.fields),
+        ListingListSerializer, args.repeat)
+    print(f'speedup: {old / new:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Webhook load test: replays Chapa events from an NDJSON fixture through the
+webhook endpoint, then drains them with the batch consumer.
+
+    python -m benchmarks.webhook_replay --events 50000
+
+The fixture is generated (with ~10% redeliveries) when --fixture does not
+exist yet, so the same file can be replayed across runs.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import tempfile
+import time
+from unittest import mock
+
+from benchmarks.common import setup, timer
+
+SECRET = 'benchmark-secret'
+
+
+def write_fixture(path, events, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w') as fixture:
+        for i in range(events):
+            # roughly one delivery in ten repeats an earlier transaction
+            ref = f'tx-{rng.randrange(i)}' if i and rng.random() < 0.1 \
+                else f'tx-{i}'
+            status = 'success' if rng.random() < 0.9 else 'failed'
+            fixture.write(json.dumps({
+                'event': f'charge.{status}', 'tx_ref': ref,
+                'status': status, 'email': f'guest{i}@example.com',
+            }) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=50_000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--fixture', default=os.path.join(
+        tempfile.gettempdir(), 'chapa_webhooks.ndjson'))
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.fixture):
+        with timer('fixture'):
+            write_fixture(args.fixture, args.events)
+
+    setup(args.db)
+    from django.db import transaction
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment
+    from listings.models import Payment, PaymentEvent
+    from alx_travel_app.celery import app as celery_app
+    from listings.tasks import process_payment_events
+
+    # locmem email and inline Celery: confirmation emails stay in-process
+    setup_test_environment()
+    celery_app.conf.CELERY_TASK_ALWAYS_EAGER = True
+    with open(args.fixture) as fixture:
+        bodies = [line.strip().encode() for line in fixture if line.strip()]
+    refs = {json.loads(body)['tx_ref'] for body in bodies}
+
+    with timer('payments', len(refs)), transaction.atomic():
+        Payment.objects.bulk_create([
+            Payment(booking_reference=ref, amount=100,
+                    transaction_id=ref, status='Pending')
+            for ref in refs
+        ], batch_size=5000)
+
+    client = Client()
+    with override_settings(CHAPA_WEBHOOK_SECRET=SECRET), \
+            mock.patch('listings.views.schedule_payment_event_processing'):
+        start = time.perf_counter()
+        for body in bodies:
+            signature = hmac.new(
+                SECRET.encode(), body, hashlib.sha256).hexdigest()
+            response = client.post(
+                '/api/chapa-webhook/', body, content_type='application/json',
+                HTTP_X_CHAPA_SIGNATURE=signature)
+            assert response.status_code == 200, response.content
+        elapsed = time.perf_counter() - start
+    print(f'ingest: {elapsed:.2f}s ({len(bodies) / elapsed:,.0f} events/s, '
+          f'{1000 * elapsed / len(bodies):.2f} ms/request)')
+    stored = PaymentEvent.objects.count()
+    print(f'stored events: {stored} ({len(bodies) - stored} duplicates)')
+
+    with timer('apply', stored):
+        applied = process_payment_events(batch_size=args.batch_size)
+    assert applied == stored, (applied, stored)
+    with timer('replay (no-op)'):
+        assert process_payment_events(batch_size=args.batch_size) == 0
+
+    pending = Payment.objects.filter(status='Pending').count()
+    print(f'pending payments left: {pending}')
+    assert pending == 0
+
+
+if __name__ == '__main__':
+    main()
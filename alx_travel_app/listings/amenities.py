@@ -0,0 +1,139 @@
+# amenities.py
+"""
+Indexed amenity filtering.
+
+`Listing.amenities` stays the JSON list that the API reads and writes, but
+JSON can't be indexed, so every distinct name also gets an `Amenity` row
+and each listing one `ListingAmenity` link per amenity. The links are kept
+in sync from the Listing signals and, since `bulk_create` sends none, by
+the bulk write paths (imports, seeding).
+
+Filtering on several amenities ANDs one indexed probe per amenity. Common
+amenities are checked per listing with EXISTS, which stops as soon as a
+page is full. A rare amenity would make that scan most of the table, so
+the rarest amenity drives the query instead when it is linked to at most
+AMENITY_FILTER_DRIVE_LIMIT listings.
+"""
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from .models import Amenity, Listing, ListingAmenity
+
+
+def amenity_key(name):
+    """'  Air  conditioning' and 'air conditioning' are the same amenity"""
+    return ' '.join(str(name).split()).casefold()[:100]
+
+
+def amenity_names(values):
+    """key -> display name for a listing's `amenities` list"""
+    names = {}
+    for value in values if isinstance(values, list) else []:
+        key = amenity_key(value)
+        if key:
+            names.setdefault(key, ' '.join(str(value).split())[:100])
+    return names
+
+
+def resolve_amenities(names):
+    """key -> Amenity id for `names` (key -> name), creating missing rows"""
+    ids = dict(
+        Amenity.objects.filter(key__in=names).values_list('key', 'id'))
+    missing = [key for key in names if key not in ids]
+    if missing:
+        # a concurrent writer may create the same amenity: skip conflicts
+        # and read the ids back
+        Amenity.objects.bulk_create(
+            [Amenity(key=key, name=names[key]) for key in missing],
+            ignore_conflicts=True)
+        ids.update(
+            Amenity.objects.filter(key__in=missing).values_list('key', 'id'))
+    return ids
+
+
+def adjust_listing_counts(deltas):
+    """Apply amenity id -> listing count deltas in a single UPDATE"""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        Amenity.objects.filter(id__in=deltas).update(
+            listing_count=F('listing_count') + Case(
+                *[When(id=pk, then=Value(delta))
+                  for pk, delta in deltas.items()],
+                default=Value(0)))
+
+
+def sync_amenities(listings, created=False):
+    """
+    Bring the amenity links of saved `listings` in line with their
+    `amenities` lists; `created` when none of them has links yet.
+    """
+    wanted = {
+        listing.pk: amenity_names(listing.amenities) for listing in listings
+    }
+    ids = resolve_amenities(
+        {key: name for names in wanted.values() for key, name in names.items()})
+    # no savepoint: callers inside a transaction roll back as a whole
+    with transaction.atomic(savepoint=False):
+        current = defaultdict(set)
+        if not created:
+            # concurrent saves of a listing would both add its new links;
+            # under its row lock the second one sees the first one's
+            list(Listing.objects.select_for_update().filter(pk__in=wanted)
+                 .order_by('pk').values_list('pk'))
+            links = ListingAmenity.objects.filter(listing_id__in=wanted)
+            for listing_id, amenity_id in links.values_list(
+                    'listing_id', 'amenity_id'):
+                current[listing_id].add(amenity_id)
+
+        added, removed, deltas = [], [], Counter()
+        for listing_id, names in wanted.items():
+            amenity_ids = {ids[key] for key in names}
+            for amenity_id in amenity_ids - current[listing_id]:
+                added.append(ListingAmenity(
+                    listing_id=listing_id, amenity_id=amenity_id))
+                deltas[amenity_id] += 1
+            stale = current[listing_id] - amenity_ids
+            if stale:
+                removed.append(Q(listing_id=listing_id, amenity_id__in=stale))
+                for amenity_id in stale:
+                    deltas[amenity_id] -= 1
+
+        if not added and not removed:
+            return
+        ListingAmenity.objects.bulk_create(added)
+        if removed:
+            ListingAmenity.objects.filter(reduce(or_, removed)).delete()
+        adjust_listing_counts(deltas)
+
+
+def release_amenities(listing_ids):
+    """Uncount the amenities of listings about to be deleted"""
+    adjust_listing_counts({
+        amenity_id: -count for amenity_id, count in Counter(
+            ListingAmenity.objects.filter(listing_id__in=listing_ids)
+            .values_list('amenity_id', flat=True)
+        ).items()
+    })
+
+
+def filter_amenities(queryset, names):
+    """Listings of `queryset` that have every amenity in `names`"""
+    keys = {amenity_key(name) for name in names} - {''}
+    amenities = list(
+        Amenity.objects.filter(key__in=keys).order_by('listing_count', 'id')
+        .values_list('id', 'listing_count'))
+    if len(amenities) < len(keys):
+        # nothing has an amenity nobody listed
+        return queryset.none()
+
+    probes = [amenity_id for amenity_id, _ in amenities]
+    if amenities and amenities[0][1] <= settings.AMENITY_FILTER_DRIVE_LIMIT:
+        queryset = queryset.filter(id__in=ListingAmenity.objects.filter(
+            amenity_id=probes.pop(0)).values('listing_id'))
+    for amenity_id in probes:
+        queryset = queryset.filter(Exists(ListingAmenity.objects.filter(
+            listing=OuterRef('pk'), amenity_id=amenity_id)))
+    return queryset
@@ -0,0 +1,121 @@
+# cache.py
+"""
+Response cache for listing reads.
+
+Cached entries are keyed on the request's query signature plus the current
+generation of every scope the response depends on:
+
+* ``listing:<id>``  - one listing's detail representation
+* ``collection``    - list pages (any listing or rating change)
+* ``availability``  - availability search results (booking changes)
+
+Invalidating a scope replaces its generation, so every entry built under
+the old one becomes unreachable and ages out, without having to enumerate
+keys (which neither locmem nor Redis can do cheaply).
+"""
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+KEY_PREFIX = 'listings'
+
+
+def listing_scope(listing_id):
+    return f'listing:{listing_id}'
+
+
+def _generation_key(scope):
+    return f'{KEY_PREFIX}:gen:{scope}'
+
+
+def get_generations(scopes):
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # add() keeps whichever generation a concurrent request set first
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [str(found[key]) for key in keys]
+
+
+def invalidate(*scopes):
+    """
+    Drop every cached response depending on `scopes`. The bump is repeated
+    once the surrounding transaction commits so that a response rebuilt from
+    pre-commit data in the meantime is not served afterwards.
+    """
+    def bump():
+        cache.set_many(
+            {_generation_key(scope): time.time_ns() for scope in scopes},
+            None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def response_key(request, action, scopes):
+    query = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+    )
+    # pagination links are absolute, so the host is part of the key
+    signature = hashlib.sha1(json.dumps(
+        [request.scheme, request.get_host(), request.path, query]
+    ).encode()).hexdigest()
+    generations = '.'.join(get_generations(scopes))
+    return f'{KEY_PREFIX}:resp:{action}:{generations}:{signature}'
+
+
+def cached_response(request, action, scopes, build):
+    """
+    Serve `build()` through the cache with ETag/Last-Modified validators.
+
+    `build` returns `(data, last_modified)`; exceptions propagate and are
+    never cached. A matching If-None-Match (or, without one, a recent enough
+    If-Modified-Since) short-circuits to 304.
+    """
+    key = response_key(request, action, scopes)
+    entry = cache.get(key)
+    if entry is None:
+        data, last_modified = build()
+        payload = json.dumps(data, cls=DjangoJSONEncoder).encode()
+        entry = {
+            'data': data,
+            'etag': quote_etag(hashlib.md5(payload).hexdigest()),
+            'last_modified': (
+                int(last_modified.timestamp()) if last_modified else None),
+        }
+        cache.set(key, entry, settings.LISTING_CACHE_TIMEOUT)
+
+    if not_modified(request, entry):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry['data'])
+    response['ETag'] = entry['etag']
+    if entry['last_modified'] is not None:
+        response['Last-Modified'] = http_date(entry['last_modified'])
+    return response
+
+
+def not_modified(request, entry):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or entry['etag'] in etags
+    if_modified_since = parse_http_date_safe(
+        request.headers.get('If-Modified-Since', ''))
+    return (
+        if_modified_since is not None
+        and entry['last_modified'] is not None
+        and entry['last_modified'] <= if_modified_since
+    )
@@ -0,0 +1,110 @@
+# export.py
+"""
+Streaming table dumps for analytics.
+
+Rows are read with `values_list(...).iterator(chunk_size)`, so no model
+instances are built and at most one chunk is held in memory, and they are
+encoded incrementally as CSV or NDJSON (optionally gzipped). The resulting
+byte generators feed both `StreamingHttpResponse` and the `export_data`
+command, so memory stays flat however large the table is.
+"""
+import csv
+import json
+import zlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Booking, Listing, Payment
+
+EXPORTS = {
+    'listings': Listing,
+    'bookings': Booking,
+    'payments': Payment,
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# encoded output is flushed in blocks of about this many bytes
+BLOCK_SIZE = 64 * 1024
+
+
+def export_fields(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def export_rows(model, chunk_size=None):
+    """Every row of `model` as a tuple of `export_fields`, in pk order"""
+    return (
+        model.objects.order_by('pk')
+        .values_list(*export_fields(model))
+        .iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+    )
+
+
+class _Line:
+    """File-like sink handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(fields, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([
+            json.dumps(value) if isinstance(value, (list, dict)) else value
+            for value in row
+        ])
+
+
+def ndjson_lines(fields, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+def blocks(lines, size=BLOCK_SIZE):
+    """
+    Join encoded lines into blocks of about `size` bytes. The first line
+    (the CSV header, or the first record) goes out on its own so that the
+    client gets a byte before the first chunk of rows is read.
+    """
+    lines = iter(lines)
+    for line in lines:
+        yield line.encode()
+        break
+    buffer, buffered = [], 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    """
+    Gzip `chunks`, flushing the compressor after each one so output keeps
+    pace with the input instead of waiting on zlib's internal buffer.
+    """
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream_export(kind, fmt, gzip=False, chunk_size=None):
+    """Byte chunks of the `kind` table encoded as `fmt`"""
+    model = EXPORTS[kind]
+    fields = export_fields(model)
+    encode = csv_lines if fmt == 'csv' else ndjson_lines
+    stream = blocks(encode(fields, export_rows(model, chunk_size)))
+    return gzipped(stream) if gzip else stream
+
+
+def export_filename(kind, fmt, gzip=False):
+    return f'{kind}.{fmt}' + ('.gz' if gzip else '')
@@ -0,0 +1,39 @@
+# filters.py
+from rest_framework.filters import BaseFilterBackend
+from .amenities import filter_amenities
+from .serializers import ListingFilterSerializer
+
+
+class ListingFilterBackend(BaseFilterBackend):
+    """
+    Translate listing query parameters into indexed lookups.
+
+    `location` is an exact match so it can use the location index;
+    `property_type` accepts a comma-separated list, and so does
+    `amenities`, which matches listings having all of them through the
+    amenity link table (see `listings.amenities`).
+    """
+
+    lookups = {
+        'location': 'location',
+        'property_type': 'property_type__in',
+        'min_price': 'price_per_night__gte',
+        'max_price': 'price_per_night__lte',
+        'guests': 'max_guests__gte',
+        'available': 'available',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        params = ListingFilterSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        values = dict(params.validated_data)
+        amenities = values.pop('amenities', None)
+        filters = {
+            self.lookups[name]: value
+            for name, value in values.items()
+            if value is not None
+        }
+        queryset = queryset.filter(**filters)
+        if amenities:
+            queryset = filter_amenities(queryset, amenities)
+        return queryset
@@ -0,0 +1,130 @@
+# gateway.py
+"""
+Chapa payment gateway client.
+
+One pooled `requests.Session` is shared per process, so calls reuse
+keep-alive TLS connections instead of handshaking on every request. Every
+call has a connect/read timeout, and idempotent calls are retried with
+exponential backoff on connection errors and 429/5xx responses.
+`AsyncChapaClient` exposes the same calls to async views running under
+ASGI by running them on a worker thread.
+"""
+import threading
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ChapaError(Exception):
+    """Raised when the gateway cannot be reached or rejects a call"""
+
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload
+
+
+class ChapaClient:
+    """Synchronous Chapa API client with a persistent connection pool"""
+
+    def __init__(self, secret_key=None, base_url=None, timeout=None,
+                 max_retries=None, backoff_factor=None, pool_size=None):
+        self.secret_key = secret_key or settings.CHAPA_SECRET_KEY
+        self.base_url = (base_url or settings.CHAPA_BASE_URL).rstrip('/')
+        self.timeout = timeout or settings.CHAPA_TIMEOUT
+        retries = Retry(
+            total=settings.CHAPA_MAX_RETRIES
+            if max_retries is None else max_retries,
+            backoff_factor=settings.CHAPA_BACKOFF_FACTOR
+            if backoff_factor is None else backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            # initialize creates a transaction: only retry it when the
+            # request never reached the server (connect errors)
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        pool_size = pool_size or settings.CHAPA_POOL_SIZE
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {self.secret_key}'
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method, path, **kwargs):
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        try:
+            response = self.session.request(
+                method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as exc:
+            raise ChapaError(f'Chapa request failed: {exc}') from exc
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        if response.status_code != 200:
+            raise ChapaError(
+                f'Chapa returned {response.status_code}',
+                status_code=response.status_code, payload=payload)
+        if not isinstance(payload, dict):
+            raise ChapaError('Chapa returned an invalid response',
+                             status_code=response.status_code)
+        return payload.get('data') or {}
+
+    def initialize(self, payload):
+        """Create a transaction and return its data (`checkout_url`...)"""
+        return self._request('POST', 'transaction/initialize', json=payload)
+
+    def verify(self, tx_ref):
+        """Return the transaction data (`status`...) for `tx_ref`"""
+        return self._request('GET', f'transaction/verify/{tx_ref}')
+
+
+class AsyncChapaClient:
+    """
+    Awaitable facade over `ChapaClient` for async views.
+
+    Calls run on a worker thread (not the sync_to_async main thread), so
+    concurrent requests overlap while still sharing the pooled session.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+
+    async def initialize(self, payload):
+        return await sync_to_async(
+            self.client.initialize, thread_sensitive=False)(payload)
+
+    async def verify(self, tx_ref):
+        return await sync_to_async(
+            self.client.verify, thread_sensitive=False)(tx_ref)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide pooled client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ChapaClient()
+    return _client
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _client
+    if setting.startswith('CHAPA_') and _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,183 @@
+# geo.py
+"""
+Proximity search on plain SQL, without a spatial extension.
+
+Each listing with coordinates stores its geohash: the interleaved bits of
+its latitude and longitude, base32 encoded. A geohash prefix names a
+rectangular cell and every point inside it shares the prefix, so "points
+in this cell" is a range scan on the B-tree index of the column.
+
+A radius or box query is covered with at most MAX_CELLS cells of the
+finest precision that allows it, the cells are read as index ranges, and
+only those candidates get a distance check and sort. Distances use the
+equirectangular approximation: pure arithmetic in SQL, and within 1% of
+the great circle distance for points up to 100 km apart at 45 degrees
+(the error grows towards the poles), which is plenty to rank stays.
+"""
+import math
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Q, When
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 12
+# most geohash cells a single proximity query reads
+MAX_CELLS = 32
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_LENGTH):
+    """The geohash of a point, '' when either coordinate is missing"""
+    if latitude is None or longitude is None:
+        return ''
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # even bits split longitude, odd bits latitude
+        span, coordinate = (
+            (lng_range, longitude) if even else (lat_range, latitude))
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of the cells of a geohash precision"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng):
+    """
+    Geohash prefixes of at most MAX_CELLS cells covering the box, at the
+    finest precision that covers it with that many. Longitudes may run
+    past +-180 (boxes crossing the antimeridian), and wrap.
+    """
+    for precision in range(GEOHASH_LENGTH, 0, -1):
+        height, width = cell_size(precision)
+        rows = range(
+            math.floor((max(min_lat, -90) + 90) / height),
+            min(math.floor((min(max_lat, 90) + 90) / height),
+                round(180 / height) - 1) + 1)
+        columns = range(
+            math.floor((min_lng + 180) / width),
+            math.floor((max_lng + 180) / width) + 1)
+        per_turn = round(360 / width)
+        if len(columns) >= per_turn:
+            columns = range(per_turn)
+        if len(rows) * len(columns) <= MAX_CELLS:
+            break
+    return sorted({
+        encode_geohash(
+            -90 + (row + 0.5) * height,
+            (-180 + (column % per_turn + 0.5) * width),
+            precision)
+        for row in rows for column in columns
+    })
+
+
+def bounding_box(latitude, longitude, radius):
+    """(min_lat, min_lng, max_lat, max_lng) around a circle of `radius` km"""
+    lat_delta = radius / KM_PER_DEGREE
+    if abs(latitude) + lat_delta >= 90:
+        # the circle contains a pole: every longitude is in range
+        return (max(latitude - lat_delta, -90), -180,
+                min(latitude + lat_delta, 90), 180)
+    lng_delta = lat_delta / math.cos(math.radians(abs(latitude) + lat_delta))
+    if lng_delta >= 180:
+        # close to a pole the circle can still reach every longitude
+        return latitude - lat_delta, -180, latitude + lat_delta, 180
+    return (latitude - lat_delta, longitude - lng_delta,
+            latitude + lat_delta, longitude + lng_delta)
+
+
+def distance_sq(latitude, longitude, min_lng=-180, max_lng=180):
+    """
+    Expression for the squared distance in km^2 from a point, for rows
+    inside a box spanning [min_lng, max_lng]: when that runs past the
+    antimeridian, longitudes on the far side are shifted next to it, and
+    when it spans every longitude, each row is reached the shorter way
+    around.
+    """
+    lng = F('longitude')
+    if max_lng - min_lng >= 360:
+        lng = Case(When(longitude__gt=longitude + 180, then=lng - 360),
+                   When(longitude__lt=longitude - 180, then=lng + 360),
+                   default=lng)
+    elif max_lng > 180:
+        lng = Case(When(longitude__lt=max_lng - 360, then=lng + 360),
+                   default=lng)
+    elif min_lng < -180:
+        lng = Case(When(longitude__gt=min_lng + 360, then=lng - 360),
+                   default=lng)
+    scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    dy = (F('latitude') - latitude) * KM_PER_DEGREE
+    dx = (lng - longitude) * scale
+    return ExpressionWrapper(dx * dx + dy * dy, output_field=FloatField())
+
+
+def cell_ranges(cells):
+    """
+    Sorted cells of one precision as (first, last) runs of consecutive
+    geohashes, e.g. dr5r, dr5s, dr5t -> (dr5r, dr5t)
+    """
+    ranges = []
+    for cell in sorted(cells):
+        if ranges:
+            first, last = ranges[-1]
+            if last[:-1] == cell[:-1] and \
+                    BASE32.index(last[-1]) + 1 == BASE32.index(cell[-1]):
+                ranges[-1] = (first, cell)
+                continue
+        ranges.append((cell, cell))
+    return ranges
+
+
+def within_cells(cells):
+    """Q matching geohashes inside any of `cells`, as index ranges"""
+    query = Q()
+    for first, last in cell_ranges(cells):
+        # 'z' is the last base32 digit, so '{' sorts after every extension
+        query |= Q(geohash__gte=first, geohash__lt=last + '{')
+    return query
+
+
+def near(queryset, latitude, longitude, radius=None, box=None):
+    """
+    Listings of `queryset` within `radius` km of the point and/or inside
+    `box` (min_lat, min_lng, max_lat, max_lng), annotated with their
+    `distance_sq` from the point and ordered nearest first.
+    """
+    if box is not None:
+        min_lat, min_lng, max_lat, max_lng = box
+        queryset = queryset.filter(
+            latitude__gte=min_lat, latitude__lte=max_lat,
+            longitude__gte=min_lng, longitude__lte=max_lng)
+    if radius is not None:
+        circle = bounding_box(latitude, longitude, radius)
+        if box is None or _area(circle) < _area(box):
+            box = circle
+    min_lat, min_lng, max_lat, max_lng = box
+    queryset = queryset.filter(
+        within_cells(covering_cells(*box))
+    ).annotate(
+        distance_sq=distance_sq(latitude, longitude, min_lng, max_lng)
+    )
+    if radius is not None:
+        queryset = queryset.filter(distance_sq__lte=radius * radius)
+    return queryset.order_by('distance_sq', 'id')
+
+
+def _area(box):
+    min_lat, min_lng, max_lat, max_lng = box
+    return (max_lat - min_lat) * (max_lng - min_lng)
@@ -0,0 +1,85 @@
+# imports.py
+"""
+Bulk listing import.
+
+Rows are validated in batches: each row goes through one shared
+`ListingImportSerializer`, the hosts of the whole batch are resolved with a
+single query, and the valid rows are inserted with one `bulk_create` per
+batch. Invalid rows are reported with their position and never abort the
+rest of the import.
+
+Backends that do not return primary keys from bulk inserts (MySQL) insert
+the rows one by one instead, so that each gets its id before it is
+indexed and linked to its amenities.
+"""
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from rest_framework import serializers
+from .amenities import sync_amenities
+from .cache import invalidate
+from .models import Listing
+from .search import get_search_backend
+from .serializers import ListingImportSerializer
+
+
+def import_listings(rows, batch_size=None, start=0):
+    """
+    Create listings from an iterable of dicts.
+
+    Returns `{'created': n, 'errors': [{'row': i, 'errors': {...}}]}`,
+    with rows numbered from `start` in input order.
+    """
+    batch_size = batch_size or settings.LISTING_IMPORT_BATCH_SIZE
+    serializer = ListingImportSerializer()
+    rows = enumerate(rows, start)
+    created, errors = 0, []
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        created += import_batch(serializer, batch, errors)
+    errors.sort(key=lambda error: error['row'])
+
+    if created:
+        # bulk_create bypasses the signals that evict cached pages (the
+        # search index and amenity links are fed batch by batch instead)
+        invalidate('collection')
+    return {'created': created, 'errors': errors}
+
+
+def import_batch(serializer, batch, errors):
+    valid = []
+    for index, row in batch:
+        if not isinstance(row, dict):
+            errors.append({'row': index, 'errors': {
+                'non_field_errors': ['Expected a JSON object.']}})
+            continue
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except serializers.ValidationError as exc:
+            errors.append({'row': index, 'errors': exc.detail})
+
+    host_ids = set(
+        User.objects.filter(id__in={data['host_id'] for _, data in valid})
+        .values_list('id', flat=True)
+    )
+    listings = []
+    for index, data in valid:
+        if data['host_id'] not in host_ids:
+            errors.append({'row': index, 'errors': {
+                'host_id': ['User does not exist.']}})
+            continue
+        listings.append(Listing(**data))
+
+    with transaction.atomic():
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # save() fills in the id; the signals index and link the row
+            for listing in listings:
+                listing.save(force_insert=True)
+            return len(listings)
+        Listing.objects.bulk_create(listings)
+        get_search_backend().index(listings, created=True)
+        sync_amenities(listings, created=True)
+    return len(listings)
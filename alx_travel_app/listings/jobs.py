@@ -0,0 +1,69 @@
+# jobs.py
+"""
+Database locks and checkpoints for periodic jobs.
+
+The default cache is per process, so a lock or resume position kept there
+is invisible to the other workers and to management commands. Each job has
+one `JobLock` row instead. A run takes the lock by setting a lease on it
+with a conditional UPDATE, which is atomic on every backend, and renews the
+lease as it makes progress; the lease of a run that died lapses, and the
+next run takes over. The checkpoint is written in the transaction of the
+batch it records, so it never runs ahead of the committed work.
+"""
+import uuid
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+from .models import JobLock
+
+
+class Lease:
+    """A job lock held by this run until `release()` or `timeout` lapses"""
+
+    def __init__(self, name, timeout, owner):
+        self.name = name
+        self.timeout = timeout
+        self.owner = owner
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _held(self):
+        return JobLock.objects.filter(name=self.name, owner=self.owner)
+
+    def refresh(self):
+        """Extend the lease; False when it lapsed and another run took it"""
+        return bool(self._held().update(
+            locked_until=timezone.now() + timedelta(seconds=self.timeout)))
+
+    def release(self):
+        self._held().update(owner='', locked_until=None)
+
+
+def acquire_lock(name, timeout):
+    """
+    Take the lock of job `name` for `timeout` seconds. Returns a `Lease`,
+    or None while another run holds it.
+    """
+    JobLock.objects.get_or_create(name=name)
+    now = timezone.now()
+    owner = uuid.uuid4().hex
+    taken = JobLock.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lte=now), name=name,
+    ).update(owner=owner, locked_until=now + timedelta(seconds=timeout))
+    return Lease(name, timeout, owner) if taken else None
+
+
+def get_checkpoint(name):
+    return JobLock.objects.filter(name=name) \
+        .values_list('checkpoint', flat=True).first()
+
+
+def set_checkpoint(name, value):
+    """Record (or with None, clear) the resume position of job `name`"""
+    if not JobLock.objects.filter(name=name).update(checkpoint=value):
+        JobLock.objects.get_or_create(
+            name=name, defaults={'checkpoint': value})
@@ -0,0 +1,134 @@
+# pylint: disable=no-member
+import csv
+import math
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from listings.cache import invalidate, listing_scope
+from listings.geo import encode_geohash
+from listings.models import Listing
+
+
+class Command(BaseCommand):
+    """
+    Command to backfill listing coordinates and geohash cells, from a
+    geocoded CSV file or after rows were written without save()."""
+    help = ('Recompute listing geohashes, optionally loading coordinates '
+            'from a CSV file with id,latitude,longitude columns')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--coordinates',
+            metavar='PATH',
+            help='CSV file of id,latitude,longitude to load first'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of listings updated per transaction (default: 2000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        loaded = 0
+        if options['coordinates']:
+            try:
+                with open(options['coordinates'], newline='') as handle:
+                    loaded = self.load(csv.DictReader(handle), batch_size)
+            except OSError as exc:
+                raise CommandError(exc)
+        updated = self.rehash(batch_size)
+        if loaded or updated:
+            invalidate('collection')
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded coordinates for {loaded} listings, '
+            f'updated {updated} geohashes'))
+
+    def load(self, rows, batch_size):
+        """Apply CSV coordinates batch by batch, reporting bad lines"""
+        rows = enumerate(rows, 2)  # line 1 is the header
+        loaded = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return loaded
+            coordinates = {}
+            for line, row in batch:
+                try:
+                    listing_id = int(row['id'])
+                    latitude = float(row['latitude'])
+                    longitude = float(row['longitude'])
+                except (KeyError, TypeError, ValueError):
+                    self.stderr.write(f'Line {line}: expected id,latitude,'
+                                      'longitude')
+                    continue
+                if not (math.isfinite(latitude) and math.isfinite(longitude)
+                        and -90 <= latitude <= 90
+                        and -180 <= longitude <= 180):
+                    self.stderr.write(f'Line {line}: coordinates out of range')
+                    continue
+                coordinates[listing_id] = latitude, longitude
+            listings = list(Listing.objects.filter(
+                id__in=coordinates).only('id'))
+            for listing in listings:
+                listing.latitude, listing.longitude = coordinates[listing.id]
+            self.update(listings, ['latitude', 'longitude'])
+            loaded += len(listings)
+
+    def rehash(self, batch_size):
+        """Bring every stored geohash in line with its coordinates"""
+        updated = Listing.objects.filter(
+            Q(latitude__isnull=True) | Q(longitude__isnull=True)
+        ).exclude(geohash='').update(geohash='', updated_at=timezone.now())
+        last_id = 0
+        while True:
+            listings = list(
+                Listing.objects.filter(
+                    id__gt=last_id, latitude__isnull=False,
+                    longitude__isnull=False)
+                .order_by('id')
+                .only('id', 'latitude', 'longitude', 'geohash')[:batch_size]
+            )
+            if not listings:
+                return updated
+            last_id = listings[-1].id
+            stale = [
+                listing for listing in listings
+                if listing.geohash != encode_geohash(
+                    listing.latitude, listing.longitude)
+            ]
+            self.update(stale, [])
+            updated += len(stale)
+
+    def update(self, listings, fields):
+        """
+        Write `fields` (plus the derived geohash and updated_at) with one
+        prepared UPDATE per row: for single-row changes this is an order of
+        magnitude faster than the CASE expressions of bulk_update.
+        """
+        if not listings:
+            return
+        fields = [*fields, 'geohash', 'updated_at']
+        now = timezone.now()
+        for listing in listings:
+            listing.geohash = encode_geohash(
+                listing.latitude, listing.longitude)
+            listing.updated_at = now
+        model_fields = [Listing._meta.get_field(name) for name in fields]
+        quote = connection.ops.quote_name
+        sql = 'UPDATE {} SET {} WHERE id = %s'.format(
+            quote(Listing._meta.db_table),
+            ', '.join(f'{quote(field.column)} = %s' for field in model_fields))
+        rows = [
+            [field.get_db_prep_save(getattr(listing, field.attname),
+                                    connection)
+             for field in model_fields] + [listing.id]
+            for listing in listings
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+            # no save() and no signals: evict the detail entries here
+            invalidate(*[listing_scope(listing.id) for listing in listings])
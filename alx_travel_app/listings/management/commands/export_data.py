@@ -0,0 +1,57 @@
+# pylint: disable=no-member
+import sys
+from django.core.management.base import BaseCommand
+from listings.export import EXPORTS, FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    """
+    Command to dump listings, bookings or payments
+    as CSV or NDJSON without loading them into memory."""
+    help = 'Stream a full dump of listings, bookings or payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument(
+            '--format',
+            choices=sorted(FORMATS),
+            default='csv',
+            help='Output format (default: csv)'
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Gzip the output'
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File to write to (default: stdout)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Rows fetched per query (default: EXPORT_CHUNK_SIZE)'
+        )
+
+    def handle(self, *args, **options):
+        chunks = stream_export(
+            options['kind'], options['format'], gzip=options['gzip'],
+            chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+            return
+
+        with open(options['output'], 'wb') as output:
+            written = self.write(chunks, output)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} bytes to {options['output']}"
+        ))
+
+    def write(self, chunks, output):
+        written = 0
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+        return written
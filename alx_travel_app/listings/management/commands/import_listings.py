@@ -0,0 +1,81 @@
+# pylint: disable=no-member
+import csv
+import gzip
+import io
+import json
+from django.core.management.base import BaseCommand, CommandError
+from listings.imports import import_listings
+
+
+def csv_rows(stream):
+    for row in csv.DictReader(stream):
+        # empty cells fall back to the field defaults
+        row = {name: value for name, value in row.items() if value != ''}
+        amenities = row.get('amenities')
+        if amenities is not None and not amenities.startswith('['):
+            row['amenities'] = [name.strip() for name in amenities.split(',')]
+        elif amenities is not None:
+            try:
+                row['amenities'] = json.loads(amenities)
+            except ValueError:
+                pass  # rejected by the serializer as not a list
+        yield row
+
+
+def ndjson_rows(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None  # reported as an invalid row
+
+
+class Command(BaseCommand):
+    """
+    Command to create listings in bulk from a CSV
+    or NDJSON file, such as one written by export_data."""
+    help = 'Import listings from a CSV or NDJSON file (optionally gzipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ndjson'],
+            default=None,
+            help='Input format (default: from the file extension)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Rows validated and inserted per batch '
+                 '(default: LISTING_IMPORT_BATCH_SIZE)'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        name = path[:-3] if path.endswith('.gz') else path
+        fmt = options['format'] or name.rsplit('.', 1)[-1]
+        if fmt not in ('csv', 'ndjson'):
+            raise CommandError(f'Cannot tell the format of {path}; use --format')
+
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rb') as raw:
+                stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+                rows = (
+                    csv_rows(stream) if fmt == 'csv' else ndjson_rows(stream))
+                # rows are numbered like lines: the first data row is 1
+                result = import_listings(
+                    rows, batch_size=options['batch_size'], start=1)
+        except (OSError, UnicodeDecodeError, csv.Error) as exc:
+            raise CommandError(f'Could not read {path}: {exc}')
+
+        for error in result['errors']:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} listings, "
+            f"{len(result['errors'])} rows rejected"
+        ))
@@ -0,0 +1,34 @@
+# pylint: disable=no-member
+from django.core.management.base import BaseCommand
+from listings.models import Listing
+from listings.occupancy import rebuild_occupancy
+
+
+class Command(BaseCommand):
+    """
+    Command to rebuild the booked-night bitmaps of listings,
+    e.g. after bookings were written without signals."""
+    help = 'Rebuild listing availability calendars from their bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'listing_ids',
+            nargs='*',
+            type=int,
+            help='Listings to rebuild (default: all)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of listings rebuilt per transaction (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        listings = Listing.objects.all()
+        if options['listing_ids']:
+            listings = listings.filter(id__in=options['listing_ids'])
+        written = rebuild_occupancy(listings, options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Wrote {written} occupancy bitmaps')
+        )
@@ -0,0 +1,42 @@
+# pylint: disable=no-member
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from listings.models import Listing
+
+
+class Command(BaseCommand):
+    """
+    Command to recompute the denormalized review
+    aggregates stored on every listing."""
+    help = 'Rebuild review_count, rating_sum and rating_avg for all listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of listings updated per transaction (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+
+        while True:
+            ids = list(
+                Listing.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += Listing.objects.filter(
+                    id__gte=ids[0], id__lte=ids[-1]
+                ).rebuild_rating_stats()
+            last_id = ids[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt rating stats for {updated} listings')
+        )
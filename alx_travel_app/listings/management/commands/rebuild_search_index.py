@@ -0,0 +1,28 @@
+# pylint: disable=no-member
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from listings.models import Listing
+from listings.search import get_search_backend
+
+
+class Command(BaseCommand):
+    """
+    Command to rebuild the listing full-text index,
+    e.g. after rows were written without signals."""
+    help = 'Rebuild the full-text search index for all listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of listings indexed per batch (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = get_search_backend().rebuild(
+                Listing.objects.all(), options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {indexed} listings')
+        )
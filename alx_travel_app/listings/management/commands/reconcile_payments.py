@@ -0,0 +1,66 @@
+# pylint: disable=no-member
+from django.core.management.base import BaseCommand, CommandError
+from listings.jobs import acquire_lock
+from listings.tasks import (
+    RECONCILE_JOB, RECONCILE_LOCK_TIMEOUT, run_reconciliation)
+
+
+class Command(BaseCommand):
+    """
+    Command to check stale Pending payments against
+    Chapa and settle the ones it reports as finished."""
+    help = 'Reconcile stale Pending payments with the payment gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Payments checked per transaction '
+                 '(default: PAYMENT_RECONCILE_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Gateway calls in flight '
+                 '(default: PAYMENT_RECONCILE_CONCURRENCY)'
+        )
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=None,
+            help='Only payments pending for this many seconds '
+                 '(default: PAYMENT_RECONCILE_AFTER)'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the checkpoint of an interrupted run'
+        )
+
+    def handle(self, *args, **options):
+        lease = acquire_lock(RECONCILE_JOB, RECONCILE_LOCK_TIMEOUT)
+        if lease is None:
+            raise CommandError('A reconciliation run is already in progress')
+
+        def progress(totals):
+            self.stdout.write(
+                f"checked {totals['checked']}, settled {totals['settled']}, "
+                f"errors {totals['errors']}"
+            )
+
+        with lease:
+            totals = run_reconciliation(
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                older_than=options['older_than'],
+                restart=options['restart'],
+                progress=progress if options['verbosity'] > 1 else None,
+                lease=lease,
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} payments: "
+            f"{totals['settled']} settled, {totals['errors']} gateway errors"
+        ))
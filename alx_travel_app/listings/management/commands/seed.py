@@ -1,10 +1,335 @@
 # pylint: disable=no-member
+import multiprocessing
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from listings.amenities import sync_amenities
+from listings.cache import invalidate
 from listings.models import Listing, Booking, Review
+from listings.occupancy import rebuild_occupancy
+from listings.search import get_search_backend
+
+FIRST_NAMES = [
+    'John', 'Jane', 'Michael', 'Sarah', 'David', 'Emily',
+    'Robert', 'Lisa', 'Christopher', 'Jessica', 'Matthew', 'Amanda',
+    'Daniel', 'Ashley', 'James', 'Melissa', 'Joseph', 'Michelle'
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia',
+    'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez',
+    'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore'
+]
+SAMPLE_LISTINGS = [
+    {
+        'title': 'Cozy Downtown Apartment',
+        'description': 'A beautiful and cozy apartment in the heart of downtown. Perfect for business travelers and tourists alike.',
+        'location': 'New York, NY',
+        'property_type': 'apartment',
+        'amenities': ['WiFi', 'Kitchen', 'Air Conditioning', 'TV']
+    },
+    {
+        'title': 'Spacious Family House',
+        'description': 'Large family house with garden, perfect for families with children. Quiet neighborhood with great schools nearby.',
+        'location': 'Los Angeles, CA',
+        'property_type': 'house',
+        'amenities': ['WiFi', 'Kitchen', 'Garden', 'Parking', 'Pet Friendly']
+    },
+    {
+        'title': 'Luxury Villa with Pool',
+        'description': 'Stunning luxury villa with private pool and ocean view. Perfect for romantic getaways and special occasions.',
+        'location': 'Miami, FL',
+        'property_type': 'villa',
+        'amenities': ['WiFi', 'Pool', 'Ocean View', 'Kitchen', 'Air Conditioning']
+    },
+    {
+        'title': 'Modern City Loft',
+        'description': 'Contemporary loft in trendy neighborhood. High ceilings, exposed brick, and modern amenities.',
+        'location': 'Chicago, IL',
+        'property_type': 'loft',
+        'amenities': ['WiFi', 'Kitchen', 'Workspace', 'Gym Access']
+    },
+    {
+        'title': 'Mountain Cabin Retreat',
+        'description': 'Rustic cabin in the mountains. Perfect for hiking enthusiasts and nature lovers.',
+        'location': 'Denver, CO',
+        'property_type': 'cabin',
+        'amenities': ['WiFi', 'Fireplace', 'Kitchen', 'Hiking Trails']
+    },
+    {
+        'title': 'Beachfront Condo',
+        'description': 'Beautiful condominium right on the beach. Wake up to ocean views every morning.',
+        'location': 'San Diego, CA',
+        'property_type': 'condo',
+        'amenities': ['WiFi', 'Beach Access', 'Pool', 'Kitchen', 'Balcony']
+    }
+]
+CITIES = [
+    'New York, NY', 'Los Angeles, CA', 'Chicago, IL', 'Houston, TX',
+    'Phoenix, AZ', 'Philadelphia, PA', 'San Antonio, TX', 'San Diego, CA',
+    'Dallas, TX', 'San Jose, CA', 'Austin, TX', 'Jacksonville, FL',
+    'San Francisco, CA', 'Columbus, OH', 'Charlotte, NC', 'Indianapolis, IN',
+    'Seattle, WA', 'Denver, CO', 'Boston, MA', 'Nashville, TN'
+]
+# city centres; sample listings are scattered up to ~20 km around them
+CITY_COORDINATES = {
+    'New York, NY': (40.7128, -74.0060),
+    'Los Angeles, CA': (34.0522, -118.2437),
+    'Chicago, IL': (41.8781, -87.6298),
+    'Houston, TX': (29.7604, -95.3698),
+    'Phoenix, AZ': (33.4484, -112.0740),
+    'Philadelphia, PA': (39.9526, -75.1652),
+    'San Antonio, TX': (29.4241, -98.4936),
+    'San Diego, CA': (32.7157, -117.1611),
+    'Dallas, TX': (32.7767, -96.7970),
+    'San Jose, CA': (37.3382, -121.8863),
+    'Austin, TX': (30.2672, -97.7431),
+    'Jacksonville, FL': (30.3322, -81.6557),
+    'San Francisco, CA': (37.7749, -122.4194),
+    'Columbus, OH': (39.9612, -82.9988),
+    'Charlotte, NC': (35.2271, -80.8431),
+    'Indianapolis, IN': (39.7684, -86.1581),
+    'Seattle, WA': (47.6062, -122.3321),
+    'Denver, CO': (39.7392, -104.9903),
+    'Boston, MA': (42.3601, -71.0589),
+    'Nashville, TN': (36.1627, -86.7816),
+    'Miami, FL': (25.7617, -80.1918),
+}
+PROPERTY_TYPES = ['apartment', 'house', 'villa', 'condo', 'cabin', 'loft']
+AMENITIES = [
+    'WiFi', 'Kitchen', 'Air Conditioning', 'Pool', 'Parking',
+    'Pet Friendly', 'Garden', 'Balcony', 'Fireplace', 'Gym Access'
+]
+SPECIAL_REQUESTS = [
+    'Late check-in requested',
+    'Need extra towels',
+    'Celebrating anniversary',
+    'Early check-out needed',
+    'Require parking space'
+]
+SAMPLE_COMMENTS = [
+    "Great place to stay! The host was very accommodating and the location was perfect.",
+    "Clean, comfortable, and exactly as described. Would definitely book again.",
+    "Amazing property with beautiful views. Highly recommended!",
+    "Good value for money. The amenities were exactly what we needed.",
+    "Perfect for our family vacation. Kids loved the pool!",
+    "Cozy and well-equipped. Great communication from the host.",
+    "Excellent location, walking distance to everything we wanted to see.",
+    "Beautiful property, but the WiFi was a bit slow.",
+    "Fantastic stay! The kitchen was well-stocked and the bed was comfortable.",
+    "Great experience overall. Would recommend to friends and family."
+]
+
+
+def random_user(rng, i):
+    """Field values for the i-th sample user (password excluded)"""
+    first_name = rng.choice(FIRST_NAMES)
+    last_name = rng.choice(LAST_NAMES)
+    username = f"{first_name.lower()}{last_name.lower()}{i+1}"
+    return {
+        'username': username,
+        'email': f"{username}@example.com",
+        'first_name': first_name,
+        'last_name': last_name,
+    }
+
+
+def random_listing(rng, i):
+    """Field values for the i-th sample listing (host excluded)"""
+    if i < len(SAMPLE_LISTINGS):
+        # Use predefined data for first few listings
+        data = dict(SAMPLE_LISTINGS[i])
+    else:
+        # Generate random data for remaining listings
+        data = {
+            'title': f"{rng.choice(['Cozy', 'Spacious', 'Modern', 'Luxury', 'Charming'])} {rng.choice(['Apartment', 'House', 'Villa', 'Condo', 'Loft'])}",
+            'description': f"A wonderful {rng.choice(['and comfortable', 'and stylish', 'and elegant'])} place to stay during your visit.",
+            'location': rng.choice(CITIES),
+            'property_type': rng.choice(PROPERTY_TYPES),
+            'amenities': rng.sample(AMENITIES, k=rng.randint(2, 5)),
+        }
+    latitude, longitude = CITY_COORDINATES[data['location']]
+    data.update(
+        latitude=round(latitude + rng.uniform(-0.18, 0.18), 6),
+        longitude=round(longitude + rng.uniform(-0.18, 0.18), 6),
+        price_per_night=Decimal(str(rng.randint(50, 500))),
+        max_guests=rng.randint(1, 8),
+        bedrooms=rng.randint(1, 4),
+        bathrooms=rng.randint(1, 3),
+        available=rng.choice([True, True, True, False]),  # 75% available
+    )
+    return data
+
+
+def listing_stays(rng, price_per_night, max_guests, count, today):
+    """
+    Field values for `count` bookings of one listing (listing and user
+    excluded). Stays are laid end to end on a single timeline, so every
+    check-out is after its check-in and no two bookings overlap.
+    """
+    check_in = today - timedelta(days=rng.randint(0, 7 * count + 30))
+    for _ in range(count):
+        check_in += timedelta(days=rng.randint(0, 7))
+        duration = rng.randint(1, 14)
+        check_out = check_in + timedelta(days=duration)
+        if check_out <= today:
+            status = rng.choice(['completed', 'completed', 'cancelled'])
+        elif check_in <= today:
+            status = 'confirmed'
+        else:
+            status = rng.choice(['pending', 'confirmed', 'confirmed', 'cancelled'])
+
+        # Generate special requests occasionally
+        special_requests = None
+        if rng.random() < 0.3:  # 30% chance of special requests
+            special_requests = rng.choice(SPECIAL_REQUESTS)
+
+        yield {
+            'check_in_date': check_in,
+            'check_out_date': check_out,
+            'guests': rng.randint(1, min(max_guests, 6)),
+            'total_price': price_per_night * duration,
+            'status': status,
+            'special_requests': special_requests,
+        }
+        check_in = check_out
+
+
+def random_review(rng):
+    return {
+        'rating': rng.randint(3, 5),  # Mostly positive reviews
+        'comment': rng.choice(SAMPLE_COMMENTS),
+    }
+
+
+def share(total, parts, index):
+    """`(offset, count)` of the index-th of `parts` near-equal slices"""
+    size, extra = divmod(total, parts)
+    return index * size + min(index, extra), size + (index < extra)
+
+
+def unit_rng(seed, kind, start):
+    # one stream per unit of work, so the data does not depend on how
+    # the units are spread over workers
+    return random.Random(f'{seed}:{kind}:{start}')
+
+
+def seed_users(plan, start, stop):
+    """Insert users [start, stop) of a bulk plan"""
+    rng = unit_rng(plan['seed'], 'users', start)
+    base = plan['user_base']
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(id=base + i, password=plan['password'],
+                 **random_user(rng, base + i - 1))
+            for i in range(start, stop)
+        ])
+    return {'users': stop - start}
+
+
+def seed_listings(plan, start, stop):
+    """
+    Insert listings [start, stop) of a bulk plan together with their
+    bookings and reviews, in one transaction.
+
+    Every id is derived from the plan (bookings and reviews are spread
+    evenly over the listings), so units need no coordination and the
+    same seed yields the same rows however the units are scheduled.
+    Rows are inserted whenever --batch-size of them are pending, so a
+    listing with millions of bookings is never held in memory at once.
+    """
+    rng = unit_rng(plan['seed'], 'listings', start)
+    first_user = plan['user_base']
+    last_user = first_user + plan['users'] - 1
+    batch_size = plan['batch_size']
+    created = {'listings': 0, 'bookings': 0, 'reviews': 0}
+    listings, bookings, reviews = [], [], []
+
+    def guest(host_id):
+        # User can't book their own listing
+        user_id = rng.randint(first_user, last_user)
+        while user_id == host_id:
+            user_id = rng.randint(first_user, last_user)
+        return user_id
+
+    def flush():
+        # listings first, so the rows pointing at them always have a target
+        Listing.objects.bulk_create(listings, batch_size=batch_size)
+        # bulk_create skips the signals that index listings for search
+        # and link their amenities
+        get_search_backend().index(listings, created=True)
+        sync_amenities(listings, created=True)
+        Booking.objects.bulk_create(bookings, batch_size=batch_size)
+        Review.objects.bulk_create(reviews, batch_size=batch_size)
+        created['listings'] += len(listings)
+        created['bookings'] += len(bookings)
+        created['reviews'] += len(reviews)
+        listings.clear()
+        bookings.clear()
+        reviews.clear()
+
+    with transaction.atomic():
+        for j in range(start, stop):
+            listing_id = plan['listing_base'] + j
+            host_id = rng.randint(first_user, last_user)
+            data = random_listing(rng, j)
+            listings.append(Listing(id=listing_id, host_id=host_id, **data))
+
+            # reviews come from completed stays first, then from other
+            # guests; only the first completed stay of each guest can be
+            # picked, and no more of them than there are reviews to write
+            review_offset, review_count = share(
+                plan['reviews'], plan['listings'], j)
+            completed = {}
+
+            offset, count = share(plan['bookings'], plan['listings'], j)
+            stays = listing_stays(
+                rng, data['price_per_night'], data['max_guests'], count,
+                plan['today'])
+            for k, stay in enumerate(stays):
+                booking = Booking(
+                    id=plan['booking_base'] + offset + k,
+                    listing_id=listing_id, user_id=guest(host_id), **stay)
+                bookings.append(booking)
+                if (booking.status == 'completed'
+                        and len(completed) < review_count):
+                    completed.setdefault(booking.user_id, booking.id)
+                if len(bookings) >= batch_size:
+                    flush()
+
+            candidates = [
+                (booking_id, user_id)
+                for user_id, booking_id in completed.items()
+            ] + [(None, guest(host_id)) for _ in range(review_count)]
+            reviewers = set()
+            for booking_id, user_id in candidates:
+                if len(reviewers) == review_count:
+                    break
+                # Avoid duplicate reviews for same user-listing combination
+                if user_id in reviewers:
+                    continue
+                reviews.append(Review(
+                    id=plan['review_base'] + review_offset + len(reviewers),
+                    listing_id=listing_id, user_id=user_id,
+                    booking_id=booking_id, **random_review(rng)))
+                reviewers.add(user_id)
+                if len(reviews) >= batch_size:
+                    flush()
+        flush()
+        # ... and the ones that mark booked nights
+        rebuild_occupancy(
+            Listing.objects.filter(
+                id__gte=plan['listing_base'] + start,
+                id__lt=plan['listing_base'] + stop),
+            batch_size)
+    return created
 
 
 class Command(BaseCommand):
@@ -43,8 +368,35 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing data before seeding'
         )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed; the same seed reproduces the same data'
+        )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Insert rows with bulk_create in batched transactions '
+                 '(for large datasets; skips model save() and signals)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows inserted per transaction in bulk mode (default: 5000)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Processes generating data in bulk mode (default: 1)'
+        )
 
     def handle(self, *args, **options):
+        if options['workers'] > 1 and not options['bulk']:
+            raise CommandError('--workers requires --bulk')
+
         if options['clear']:
             self.stdout.write(
                 self.style.WARNING('Clearing existing data...')
@@ -55,6 +407,15 @@ class Command(BaseCommand):
             self.style.SUCCESS('Starting database seeding...')
         )
 
+        if options['bulk']:
+            self.seed_bulk(options)
+            self.stdout.write(
+                self.style.SUCCESS('Database seeding completed successfully!')
+            )
+            return
+
+        self.rng = random.Random(options['seed'])
+
         # Create users
         users = self.create_users(options['users'])
         self.stdout.write(
@@ -93,30 +454,9 @@ class Command(BaseCommand):
     def create_users(self, count):
         """Create sample users"""
         users = []
-        first_names = [
-            'John', 'Jane', 'Michael', 'Sarah', 'David', 'Emily',
-            'Robert', 'Lisa', 'Christopher', 'Jessica', 'Matthew', 'Amanda',
-            'Daniel', 'Ashley', 'James', 'Melissa', 'Joseph', 'Michelle'
-        ]
-        last_names = [
-            'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia',
-            'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez',
-            'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore'
-        ]
-
         for i in range(count):
-            first_name = random.choice(first_names)
-            last_name = random.choice(last_names)
-            username = f"{first_name.lower()}{last_name.lower()}{i+1}"
-            email = f"{username}@example.com"
-
             user = User.objects.create_user(
-                username=username,
-                email=email,
-                first_name=first_name,
-                last_name=last_name,
-                password='password123'
-            )
+                password='password123', **random_user(self.rng, i))
             users.append(user)
 
         return users
@@ -124,138 +464,26 @@ class Command(BaseCommand):
     def create_listings(self, users, count):
         """Create sample listings"""
         listings = []
-
-        sample_listings_data = [
-            {
-                'title': 'Cozy Downtown Apartment',
-                'description': 'A beautiful and cozy apartment in the heart of downtown. Perfect for business travelers and tourists alike.',
-                'location': 'New York, NY',
-                'property_type': 'apartment',
-                'amenities': ['WiFi', 'Kitchen', 'Air Conditioning', 'TV']
-            },
-            {
-                'title': 'Spacious Family House',
-                'description': 'Large family house with garden, perfect for families with children. Quiet neighborhood with great schools nearby.',
-                'location': 'Los Angeles, CA',
-                'property_type': 'house',
-                'amenities': ['WiFi', 'Kitchen', 'Garden', 'Parking', 'Pet Friendly']
-            },
-            {
-                'title': 'Luxury Villa with Pool',
-                'description': 'Stunning luxury villa with private pool and ocean view. Perfect for romantic getaways and special occasions.',
-                'location': 'Miami, FL',
-                'property_type': 'villa',
-                'amenities': ['WiFi', 'Pool', 'Ocean View', 'Kitchen', 'Air Conditioning']
-            },
-            {
-                'title': 'Modern City Loft',
-                'description': 'Contemporary loft in trendy neighborhood. High ceilings, exposed brick, and modern amenities.',
-                'location': 'Chicago, IL',
-                'property_type': 'loft',
-                'amenities': ['WiFi', 'Kitchen', 'Workspace', 'Gym Access']
-            },
-            {
-                'title': 'Mountain Cabin Retreat',
-                'description': 'Rustic cabin in the mountains. Perfect for hiking enthusiasts and nature lovers.',
-                'location': 'Denver, CO',
-                'property_type': 'cabin',
-                'amenities': ['WiFi', 'Fireplace', 'Kitchen', 'Hiking Trails']
-            },
-            {
-                'title': 'Beachfront Condo',
-                'description': 'Beautiful condominium right on the beach. Wake up to ocean views every morning.',
-                'location': 'San Diego, CA',
-                'property_type': 'condo',
-                'amenities': ['WiFi', 'Beach Access', 'Pool', 'Kitchen', 'Balcony']
-            }
-        ]
-        cities = [
-            'New York, NY', 'Los Angeles, CA', 'Chicago, IL', 'Houston, TX',
-            'Phoenix, AZ', 'Philadelphia, PA', 'San Antonio, TX', 'San Diego, CA',
-            'Dallas, TX', 'San Jose, CA', 'Austin, TX', 'Jacksonville, FL',
-            'San Francisco, CA', 'Columbus, OH', 'Charlotte, NC', 'Indianapolis, IN',
-            'Seattle, WA', 'Denver, CO', 'Boston, MA', 'Nashville, TN'
-        ]
-        property_types = ['apartment', 'house', 'villa', 'condo', 'cabin', 'loft']
         for i in range(count):
-            if i < len(sample_listings_data):
-                # Use predefined data for first few listings
-                data = sample_listings_data[i]
-                title = data['title']
-                description = data['description']
-                location = data['location']
-                property_type = data['property_type']
-                amenities = data['amenities']
-            else:
-                # Generate random data for remaining listings
-                title = f"{random.choice(['Cozy', 'Spacious', 'Modern', 'Luxury', 'Charming'])} {random.choice(['Apartment', 'House', 'Villa', 'Condo', 'Loft'])}"
-                description = f"A wonderful {random.choice(['and comfortable', 'and stylish', 'and elegant'])} place to stay during your visit."
-                location = random.choice(cities)
-                property_type = random.choice(property_types)
-                amenities = random.sample(
-                    ['WiFi', 'Kitchen', 'Air Conditioning', 'Pool', 'Parking', 
-                     'Pet Friendly', 'Garden', 'Balcony', 'Fireplace', 'Gym Access'],
-                    k=random.randint(2, 5)
-                )
-
             listing = Listing.objects.create(
-                title=title,
-                description=description,
-                price_per_night=Decimal(str(random.randint(50, 500))),
-                location=location,
-                property_type=property_type,
-                max_guests=random.randint(1, 8),
-                bedrooms=random.randint(1, 4),
-                bathrooms=random.randint(1, 3),
-                amenities=amenities,
-                available=random.choice([True, True, True, False]),  # 75% available
-                host=random.choice(users)
-            )
+                host=self.rng.choice(users), **random_listing(self.rng, i))
             listings.append(listing)
 
         return listings
 
     def create_bookings(self, users, listings, count):
-        """Create sample bookings"""
+        """Create sample bookings, spread evenly over the listings"""
         bookings = []
-        status_choices = ['pending', 'confirmed', 'cancelled', 'completed']
-
-        for i in range(count):
-            listing = random.choice(listings)
-            user = random.choice([u for u in users if u != listing.host])  # User can't book their own listing
-
-            # Generate random dates
-            start_date = date.today() + timedelta(days=random.randint(-30, 60))
-            duration = random.randint(1, 14)
-            end_date = start_date + timedelta(days=duration)
-
-            guests = random.randint(1, min(listing.max_guests, 6))
-            total_price = listing.price_per_night * duration
-            status = random.choice(status_choices)
-
-            # Generate special requests occasionally
-            special_requests = None
-            if random.random() < 0.3:  # 30% chance of special requests
-                requests = [
-                    'Late check-in requested',
-                    'Need extra towels',
-                    'Celebrating anniversary',
-                    'Early check-out needed',
-                    'Require parking space'
-                ]
-                special_requests = random.choice(requests)
-
-            booking = Booking.objects.create(
-                listing=listing,
-                user=user,
-                check_in_date=start_date,
-                check_out_date=end_date,
-                guests=guests,
-                total_price=total_price,
-                status=status,
-                special_requests=special_requests
-            )
-            bookings.append(booking)
+        today = date.today()
+        for j, listing in enumerate(listings):
+            guests = [u for u in users if u != listing.host]  # User can't book their own listing
+            _, stays = share(count, len(listings), j)
+            for stay in listing_stays(
+                    self.rng, listing.price_per_night, listing.max_guests,
+                    stays, today):
+                booking = Booking.objects.create(
+                    listing=listing, user=self.rng.choice(guests), **stay)
+                bookings.append(booking)
 
         return bookings
 
@@ -266,31 +494,18 @@ class Command(BaseCommand):
         # Get completed bookings for realistic reviews
         completed_bookings = [b for b in bookings if b.status == 'completed']
 
-        sample_comments = [
-            "Great place to stay! The host was very accommodating and the location was perfect.",
-            "Clean, comfortable, and exactly as described. Would definitely book again.",
-            "Amazing property with beautiful views. Highly recommended!",
-            "Good value for money. The amenities were exactly what we needed.",
-            "Perfect for our family vacation. Kids loved the pool!",
-            "Cozy and well-equipped. Great communication from the host.",
-            "Excellent location, walking distance to everything we wanted to see.",
-            "Beautiful property, but the WiFi was a bit slow.",
-            "Fantastic stay! The kitchen was well-stocked and the bed was comfortable.",
-            "Great experience overall. Would recommend to friends and family."
-        ]
-
         used_combinations = set()
 
         for i in range(count):
             # Try to use completed bookings first, then random combinations
-            if completed_bookings and random.random() < 0.7:
-                booking = random.choice(completed_bookings)
+            if completed_bookings and self.rng.random() < 0.7:
+                booking = self.rng.choice(completed_bookings)
                 listing = booking.listing
                 user = booking.user
                 combination = (listing.id, user.id)
             else:
-                listing = random.choice(listings)
-                user = random.choice([u for u in users if u != listing.host])
+                listing = self.rng.choice(listings)
+                user = self.rng.choice([u for u in users if u != listing.host])
                 combination = (listing.id, user.id)
                 booking = None
 
@@ -300,16 +515,112 @@ class Command(BaseCommand):
 
             used_combinations.add(combination)
 
-            rating = random.randint(3, 5)  # Mostly positive reviews
-            comment = random.choice(sample_comments)
-
             review = Review.objects.create(
                 listing=listing,
                 user=user,
                 booking=booking,
-                rating=rating,
-                comment=comment
+                **random_review(self.rng)
             )
             reviews.append(review)
 
         return reviews
+
+    def seed_bulk(self, options):
+        """
+        Seed with bulk_create, one transaction per unit of work.
+
+        Users are inserted in ranges of --batch-size; listings in ranges
+        sized so that a unit holds about --batch-size bookings, inserted
+        with their bookings and reviews. Units are independent, so with
+        --workers they run in parallel processes, and memory stays flat
+        however large the dataset. Every user shares one precomputed
+        password hash.
+        """
+        users, listings = options['users'], options['listings']
+        if listings and users < 1:
+            raise CommandError('Listings need at least one user as host')
+        if (options['bookings'] or options['reviews']) and (
+                users < 2 or listings < 1):
+            raise CommandError(
+                'Bookings and reviews need at least two users and a listing')
+
+        seed = options['seed']
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.stdout.write(f'Using seed {seed}')
+
+        plan = {
+            'seed': seed,
+            'today': date.today(),
+            'password': make_password('password123'),
+            'batch_size': options['batch_size'],
+            'users': users,
+            'listings': listings,
+            'bookings': options['bookings'],
+            'reviews': options['reviews'],
+        }
+        models = [(User, 'user'), (Listing, 'listing'), (Booking, 'booking'),
+                  (Review, 'review')]
+        for model, name in models:
+            last_id = model.objects.aggregate(last=Max('id'))['last'] or 0
+            plan[f'{name}_base'] = last_id + 1
+
+        batch_size = options['batch_size']
+        per_listing = max(
+            1, (options['bookings'] + options['reviews']) // max(listings, 1))
+        self.run_units(
+            seed_users, plan, users, batch_size, options['workers'])
+        self.run_units(
+            seed_listings, plan, listings, max(1, batch_size // per_listing),
+            options['workers'])
+
+        # explicit ids leave sequences behind on backends that have them
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [model for model, _ in models])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+        # bulk_create bypasses the signals keeping these up to date
+        self.rebuild_rating_stats(
+            plan['listing_base'], plan['listing_base'] + listings - 1,
+            batch_size)
+        invalidate('collection', 'availability')
+
+    def run_units(self, func, plan, count, unit_size, workers):
+        """Run `func` over [0, count) in units, reporting rows/s"""
+        starts = range(0, count, unit_size)
+        stops = [min(start + unit_size, count) for start in starts]
+        started = time.perf_counter()
+        if workers > 1 and len(starts) > 1:
+            # forked workers must open their own database connections
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                results = list(pool.map(
+                    func, [plan] * len(starts), starts, stops))
+        else:
+            results = [func(plan, start, stop)
+                       for start, stop in zip(starts, stops)]
+        elapsed = time.perf_counter() - started
+
+        totals = {}
+        for result in results:
+            for label, created in result.items():
+                totals[label] = totals.get(label, 0) + created
+        if not totals:
+            return
+        rows = sum(totals.values())
+        rate = rows / elapsed if elapsed else 0
+        created = ', '.join(
+            f'{created} {label}' for label, created in totals.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} in {elapsed:.2f}s ({rate:,.0f} rows/s)'
+        ))
+
+    def rebuild_rating_stats(self, first_id, last_id, batch_size):
+        for start in range(first_id, last_id + 1, batch_size):
+            with transaction.atomic():
+                Listing.objects.filter(
+                    id__gte=start, id__lt=start + batch_size, id__lte=last_id
+                ).rebuild_rating_stats()
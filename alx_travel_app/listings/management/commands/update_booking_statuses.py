@@ -0,0 +1,44 @@
+# pylint: disable=no-member
+from django.core.management.base import BaseCommand, CommandError
+from listings.jobs import acquire_lock
+from listings.tasks import (
+    LIFECYCLE_JOB, LIFECYCLE_LOCK_TIMEOUT, run_booking_lifecycle)
+
+
+class Command(BaseCommand):
+    """
+    Command to expire unpaid Pending bookings and
+    complete past stays, as the periodic task does."""
+    help = 'Expire stale Pending bookings and complete past stays'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Bookings updated per transaction '
+                 '(default: BOOKING_LIFECYCLE_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--pending-ttl',
+            type=int,
+            default=None,
+            help='Expire Pending bookings older than this many seconds '
+                 '(default: BOOKING_PENDING_TTL)'
+        )
+
+    def handle(self, *args, **options):
+        lease = acquire_lock(LIFECYCLE_JOB, LIFECYCLE_LOCK_TIMEOUT)
+        if lease is None:
+            raise CommandError('A lifecycle run is already in progress')
+        with lease:
+            totals = run_booking_lifecycle(
+                batch_size=options['batch_size'],
+                pending_ttl=options['pending_ttl'],
+                lease=lease,
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {totals['expired']} and completed "
+            f"{totals['completed']} bookings in {totals['seconds']}s"
+        ))
@@ -0,0 +1,184 @@
+# metrics.py
+"""
+Request performance metrics.
+
+`listings.middleware.PerformanceMiddleware` times a sample of requests:
+wall time, database queries and their time, serializer time and response
+size, per view. Each sampled response reports its own figures in a
+Server-Timing header, and they are aggregated into histograms that the
+metrics endpoint serves in the Prometheus text format.
+
+Server-Timing headers are only sent under DEBUG, to staff users and to
+holders of METRICS_TOKEN, so anonymous clients can't probe query counts;
+the histograms include every sampled request regardless.
+
+Histograms live in the memory of each server process, like those of the
+official client without its multiprocess mode: scrape every process, or
+aggregate across them in the queries. With sampling, the counts are those
+of the sampled requests; divide by PERF_SAMPLE_RATE for totals.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from django.conf import settings
+
+DURATION_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# figures of the request being timed in this thread or task, if any
+current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Figures of one sampled request. Installed with
+    `connection.execute_wrapper`, it counts and times every query.
+    """
+    __slots__ = ('queries', 'db', 'serialize', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+class Histogram:
+    """A labelled histogram in the Prometheus exposition format"""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> [count per bucket..., count above the last, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1)
+            series.append(0)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, label_names):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self.series.items()):
+            pairs = ','.join(
+                f'{name}="{escape(value)}"'
+                for name, value in zip(label_names, labels))
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                total += count
+                yield f'{self.name}_bucket{{{pairs},le="{bound}"}} {total}'
+            yield f'{self.name}_sum{{{pairs}}} {series[-1]:g}'
+            yield f'{self.name}_count{{{pairs}}} {total}'
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+LABELS = ('view', 'method')
+HISTOGRAMS = {
+    'duration': Histogram(
+        'http_request_duration_seconds',
+        'Wall time of sampled requests.', DURATION_BUCKETS),
+    'queries': Histogram(
+        'http_request_db_queries',
+        'Database queries per sampled request.', QUERY_BUCKETS),
+    'db': Histogram(
+        'http_request_db_duration_seconds',
+        'Database time of sampled requests.', DURATION_BUCKETS),
+    'serialize': Histogram(
+        'http_request_serializer_duration_seconds',
+        'Serializer time of sampled requests.', DURATION_BUCKETS),
+    'size': Histogram(
+        'http_response_size_bytes',
+        'Body size of sampled (non-streaming) responses.', SIZE_BUCKETS),
+}
+_lock = threading.Lock()
+
+
+def has_metrics_token(request):
+    """Whether `request` carries `Authorization: Bearer <METRICS_TOKEN>`"""
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+def observe(labels, duration, timings, size=None):
+    """Fold one sampled request into the histograms"""
+    with _lock:
+        HISTOGRAMS['duration'].observe(labels, duration)
+        HISTOGRAMS['queries'].observe(labels, timings.queries)
+        HISTOGRAMS['db'].observe(labels, timings.db)
+        HISTOGRAMS['serialize'].observe(labels, timings.serialize)
+        if size is not None:
+            HISTOGRAMS['size'].observe(labels, size)
+
+
+def render_metrics():
+    with _lock:
+        lines = [
+            line for histogram in HISTOGRAMS.values()
+            for line in histogram.render(LABELS)
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _lock:
+        for histogram in HISTOGRAMS.values():
+            histogram.series.clear()
+
+
+def timed_data(prop):
+    """
+    Wrap a serializer's `data` property to add its time to the sampled
+    request, once per outermost serializer (nested ones are part of it).
+    """
+    fget = prop.fget
+
+    def data(self):
+        timings = current.get()
+        if timings is None or timings.serializing:
+            return fget(self)
+        timings.serializing = True
+        started = time.perf_counter()
+        try:
+            return fget(self)
+        finally:
+            timings.serializing = False
+            timings.serialize += time.perf_counter() - started
+
+    data.timed = True
+    return property(data, doc=prop.__doc__)
+
+
+def install_serializer_timing():
+    """
+    DRF has no hook around serialization, so `data` is wrapped on its
+    serializer classes, once; outside sampled requests that costs one
+    context variable lookup.
+    """
+    from rest_framework import serializers
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        prop = cls.__dict__['data']
+        if not getattr(prop.fget, 'timed', False):
+            cls.data = timed_data(prop)
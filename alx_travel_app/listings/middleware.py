@@ -0,0 +1,61 @@
+# middleware.py
+import random
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from .metrics import RequestTimings, current, install_serializer_timing
+from .metrics import has_metrics_token, observe
+
+
+class PerformanceMiddleware:
+    """
+    Time a PERF_SAMPLE_RATE share of requests (see listings.metrics):
+    fold wall, database and serializer time, the query count and the
+    response size into the per-view histograms, and report the times in
+    a Server-Timing header to those allowed to see it. Unsampled requests
+    pass straight through.
+
+    List it first in MIDDLEWARE so the wall time covers the other
+    middleware. Streaming bodies are produced after it returns, so their
+    size and time are not included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_serializer_timing()
+
+    def __call__(self, request):
+        rate = settings.PERF_SAMPLE_RATE
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        size = None if response.streaming else len(response.content)
+        observe((view, request.method), duration, timings, size)
+        if self.shows_timings(request):
+            response['Server-Timing'] = (
+                f'app;dur={duration * 1000:.3f}, '
+                f'db;dur={timings.db * 1000:.3f};desc="{timings.queries} '
+                f'queries", serialize;dur={timings.serialize * 1000:.3f}')
+        return response
+
+    def shows_timings(self, request):
+        if settings.DEBUG or has_metrics_token(request):
+            return True
+        # set by AuthenticationMiddleware, and by DRF once it authenticates
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_active and user.is_staff)
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    Review = apps.get_model('listings', 'Review')
+    reviews = Review.objects.filter(
+        listing=OuterRef('pk')).order_by().values('listing')
+    Listing.objects.update(
+        review_count=Coalesce(
+            Subquery(reviews.annotate(c=Count('id')).values('c')), 0),
+        rating_sum=Coalesce(
+            Subquery(reviews.annotate(s=Sum('rating')).values('s')), 0),
+        rating_avg=Coalesce(
+            Subquery(reviews.annotate(
+                a=Avg('rating', output_field=FloatField())).values('a')),
+            0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0002_payment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['rating_avg'], name='listings_li_rating__7304e5_idx'),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:14
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_payments(apps, schema_editor):
+    """
+    Link payments to bookings (booking references are booking ids) and turn
+    blank transaction ids into NULL ahead of the unique constraint. Runs in
+    short per-batch transactions so the table is never locked for long.
+    """
+    Payment = apps.get_model('listings', 'Payment')
+    Booking = apps.get_model('listings', 'Booking')
+    db = schema_editor.connection.alias
+
+    duplicates = list(
+        Payment.objects.using(db).exclude(transaction_id__isnull=True)
+        .exclude(transaction_id='').values('transaction_id')
+        .annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('transaction_id', flat=True)[:10]
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Duplicate payment transaction ids must be resolved before '
+            f'adding the unique index: {", ".join(duplicates)}')
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            batch = list(
+                Payment.objects.using(db).filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'booking_reference', 'transaction_id')
+                [:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            references = {
+                payment.id: payment.booking_reference.strip()
+                for payment in batch
+            }
+            booking_ids = set(Booking.objects.using(db).filter(
+                id__in=[
+                    int(ref) for ref in references.values()
+                    if ref.isdecimal()
+                ]
+            ).values_list('id', flat=True))
+            for payment in batch:
+                ref = references[payment.id]
+                if ref.isdecimal() and int(ref) in booking_ids:
+                    payment.booking_id = int(ref)
+                if payment.transaction_id == '':
+                    payment.transaction_id = None
+            Payment.objects.using(db).bulk_update(
+                batch, ['booking', 'transaction_id'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    # each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('listings', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='booking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='listings.booking'),
+        ),
+        migrations.RunPython(backfill_payments, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='transaction_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='listings_pa_status_0db908_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    """
+    SQLite: an FTS5 table keyed on the listing id, ranked with bm25
+    weighting title over location over description, filled from the
+    existing listings. MySQL: a native FULLTEXT index. Other databases
+    search without an index.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE listings_listing_fts USING fts5("
+            "title, description, location, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        schema_editor.execute(
+            "INSERT INTO listings_listing_fts (listings_listing_fts, rank) "
+            "VALUES ('rank', 'bm25(10.0, 1.0, 4.0)')")
+        schema_editor.execute(
+            "INSERT INTO listings_listing_fts "
+            "(rowid, title, description, location) "
+            "SELECT id, title, description, location FROM listings_listing")
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            "ALTER TABLE listings_listing ADD FULLTEXT INDEX "
+            "listings_listing_search (title, description, location)")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE listings_listing_fts")
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            "ALTER TABLE listings_listing DROP INDEX listings_listing_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_payment_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchEntry',
+            fields=[
+                ('listing', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='listings.listing')),
+                ('document', models.TextField(db_column='listings_listing_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'listings_listing_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
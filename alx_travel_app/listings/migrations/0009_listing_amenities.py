@@ -0,0 +1,98 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:00
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def amenity_key(name):
+    return ' '.join(str(name).split()).casefold()[:100]
+
+
+def backfill_amenities(apps, schema_editor):
+    """
+    Link every listing to the amenities in its JSON list, in short
+    per-batch transactions, then count each amenity's listings once.
+    Links that already exist are skipped, so an interrupted run can be
+    resumed.
+    """
+    Listing = apps.get_model('listings', 'Listing')
+    Amenity = apps.get_model('listings', 'Amenity')
+    ListingAmenity = apps.get_model('listings', 'ListingAmenity')
+    db = schema_editor.connection.alias
+
+    # amenities are few: their ids stay cached across batches
+    ids = dict(Amenity.objects.using(db).values_list('key', 'id'))
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            batch = list(
+                Listing.objects.using(db).filter(id__gt=last_id)
+                .order_by('id').values_list('id', 'amenities')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            links = set()
+            for listing_id, amenities in batch:
+                for name in amenities if isinstance(amenities, list) else []:
+                    key = amenity_key(name)
+                    if not key:
+                        continue
+                    if key not in ids:
+                        ids[key] = Amenity.objects.using(db).get_or_create(
+                            key=key,
+                            defaults={'name': ' '.join(str(name).split())[:100]}
+                        )[0].id
+                    links.add((listing_id, ids[key]))
+            ListingAmenity.objects.using(db).bulk_create(
+                [ListingAmenity(listing_id=listing_id, amenity_id=amenity_id)
+                 for listing_id, amenity_id in links],
+                ignore_conflicts=True)
+        last_id = batch[-1][0]
+
+    counts = ListingAmenity.objects.using(db).filter(
+        amenity=OuterRef('pk')).order_by().values('amenity').annotate(
+        n=Count('id')).values('n')
+    Amenity.objects.using(db).update(
+        listing_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    # each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('listings', '0008_listing_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Amenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('listing_count', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'verbose_name_plural': 'amenities',
+            },
+        ),
+        migrations.CreateModel(
+            name='ListingAmenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amenity', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='listing_links', to='listings.amenity')),
+                ('listing', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='amenity_links', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', 'amenity'], name='listings_li_listing_a0ec15_idx')],
+                'constraints': [models.UniqueConstraint(fields=('amenity', 'listing'), name='unique_listing_amenity')],
+            },
+        ),
+        migrations.RunPython(backfill_amenities, migrations.RunPython.noop),
+    ]
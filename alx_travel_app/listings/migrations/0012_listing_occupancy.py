@@ -0,0 +1,83 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:43
+
+import django.db.models.deletion
+from datetime import date, timedelta
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+YEAR_BYTES = 46
+
+
+def night_mask(year, start, end):
+    first = date(year, 1, 1)
+    lo = max(start, first)
+    hi = min(end, date(year + 1, 1, 1))
+    if lo >= hi:
+        return 0
+    return ((1 << (hi - lo).days) - 1) << (lo - first).days
+
+
+def backfill_occupancy(apps, schema_editor):
+    """
+    Build the bitmaps of every listing's active bookings, one short
+    transaction per batch of listings. Each batch replaces its listings'
+    rows, so an interrupted run can be resumed.
+    """
+    Listing = apps.get_model('listings', 'Listing')
+    Booking = apps.get_model('listings', 'Booking')
+    ListingOccupancy = apps.get_model('listings', 'ListingOccupancy')
+    db = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            ids = list(
+                Listing.objects.using(db).filter(id__gt=last_id)
+                .order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+            )
+            if not ids:
+                break
+            bitmaps = {}
+            stays = Booking.objects.using(db).filter(
+                listing_id__in=ids, status__in=['confirmed', 'pending']
+            ).values_list('listing_id', 'check_in_date', 'check_out_date')
+            for listing_id, check_in, check_out in stays:
+                last_year = (check_out - timedelta(days=1)).year
+                for year in range(check_in.year, last_year + 1):
+                    bitmaps[listing_id, year] = bitmaps.get(
+                        (listing_id, year), 0) | night_mask(
+                        year, check_in, check_out)
+            ListingOccupancy.objects.using(db).filter(
+                listing_id__in=ids).delete()
+            ListingOccupancy.objects.using(db).bulk_create([
+                ListingOccupancy(listing_id=listing_id, year=year,
+                                 nights=bits.to_bytes(YEAR_BYTES, 'little'))
+                for (listing_id, year), bits in bitmaps.items()
+            ])
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    # each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('listings', '0011_rate_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('nights', models.BinaryField(max_length=46)),
+                ('listing', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='listings.listing')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('listing', 'year'), name='unique_listing_occupancy')],
+            },
+        ),
+        migrations.RunPython(backfill_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+YEAR_BYTES = 46
+HOLDING_STATUSES = ['confirmed', 'pending', 'completed']
+
+
+def night_mask(year, start, end):
+    first = date(year, 1, 1)
+    lo = max(start, first)
+    hi = min(end, date(year + 1, 1, 1))
+    if lo >= hi:
+        return 0
+    return ((1 << (hi - lo).days) - 1) << (lo - first).days
+
+
+def backfill_completed_stays(apps, schema_editor):
+    """
+    Completed bookings now keep their nights (0012 only marked pending and
+    confirmed ones): rebuild the bitmaps of every listing with a completed
+    booking, one short transaction per batch of listings.
+    """
+    Booking = apps.get_model('listings', 'Booking')
+    ListingOccupancy = apps.get_model('listings', 'ListingOccupancy')
+    db = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            ids = list(
+                Booking.objects.using(db)
+                .filter(status='completed', listing_id__gt=last_id)
+                .order_by('listing_id').values_list('listing_id', flat=True)
+                .distinct()[:BATCH_SIZE]
+            )
+            if not ids:
+                break
+            bitmaps = {}
+            stays = Booking.objects.using(db).filter(
+                listing_id__in=ids, status__in=HOLDING_STATUSES
+            ).values_list('listing_id', 'check_in_date', 'check_out_date')
+            for listing_id, check_in, check_out in stays:
+                last_year = (check_out - timedelta(days=1)).year
+                for year in range(check_in.year, last_year + 1):
+                    bitmaps[listing_id, year] = bitmaps.get(
+                        (listing_id, year), 0) | night_mask(
+                        year, check_in, check_out)
+            ListingOccupancy.objects.using(db).filter(
+                listing_id__in=ids).delete()
+            ListingOccupancy.objects.using(db).bulk_create([
+                ListingOccupancy(listing_id=listing_id, year=year,
+                                 nights=bits.to_bytes(YEAR_BYTES, 'little'))
+                for (listing_id, year), bits in bitmaps.items()
+            ])
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    # each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('listings', '0015_job_lock'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_completed_stays, migrations.RunPython.noop),
+    ]
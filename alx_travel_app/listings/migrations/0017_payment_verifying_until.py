@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0016_occupancy_completed_stays'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='verifying_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-17 09:13
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0017_payment_verifying_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='raterule',
+            name='min_nights',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(365)]),
+        ),
+    ]
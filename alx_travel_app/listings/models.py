@@ -1,12 +1,121 @@
-from django.db import models
+import hashlib
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
+from .geo import encode_geohash
+
+# longest stay a quote prices, and so the longest minimum stay worth
+# setting
+MAX_QUOTE_NIGHTS = 365
 # pylint: disable=no-member
 
 
+class ListingQuerySet(models.QuerySet):
+    """
+    Query planning helpers for listing reads.
+    """
+
+    def with_host(self):
+        return self.select_related('host')
+
+    def with_reviews(self):
+        """Prefetch reviews and their authors in one extra query."""
+        return self.prefetch_related(
+            models.Prefetch(
+                'reviews',
+                queryset=Review.objects.select_related('user'),
+            )
+        )
+
+    def for_api(self, fields=None):
+        """
+        Plan the query for an API read. `fields` is the projection the
+        client asked for (None for everything): relations that are not
+        serialized are not loaded and heavy columns are deferred.
+        """
+        queryset = self
+        if fields is None or 'host' in fields:
+            queryset = queryset.with_host()
+        if fields is None or 'reviews' in fields:
+            queryset = queryset.with_reviews()
+        if fields is not None:
+            deferred = [
+                name for name in Listing.DEFERRABLE_FIELDS
+                if name not in fields
+            ]
+            queryset = queryset.defer(*deferred)
+        return queryset
+
+    def available_between(self, check_in, check_out, guests=1):
+        """
+        Listings that can host `guests` and have no active booking
+        overlapping the stay, as a single NOT EXISTS anti-join.
+        """
+        conflicts = Booking.objects.filter(
+            listing=models.OuterRef('pk')
+        ).overlapping(check_in, check_out)
+        return self.filter(
+            ~models.Exists(conflicts),
+            available=True,
+            max_guests__gte=guests,
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # save() is skipped, so the geohash cells are filled in here
+        objs = list(objs)
+        for listing in objs:
+            listing.geohash = encode_geohash(
+                listing.latitude, listing.longitude)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def adjust_rating_stats(self, count_delta, rating_delta):
+        """
+        Apply a review count/rating delta to the stored aggregates in a
+        single UPDATE, recomputing the average from the same row values.
+        Touches `updated_at`, since the listing's representation changed.
+        """
+        new_count = models.F('review_count') + count_delta
+        new_sum = models.F('rating_sum') + rating_delta
+        return self.update(
+            updated_at=timezone.now(),
+            review_count=new_count,
+            rating_sum=new_sum,
+            rating_avg=models.Case(
+                models.When(
+                    review_count__gt=-count_delta,
+                    then=Cast(new_sum, models.FloatField()) / new_count,
+                ),
+                default=models.Value(0.0),
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def rebuild_rating_stats(self):
+        """Recompute the stored aggregates from the reviews table."""
+        reviews = Review.objects.filter(
+            listing=models.OuterRef('pk')).order_by().values('listing')
+        return self.update(
+            review_count=Coalesce(
+                models.Subquery(
+                    reviews.annotate(c=models.Count('id')).values('c')),
+                0),
+            rating_sum=Coalesce(
+                models.Subquery(
+                    reviews.annotate(s=models.Sum('rating')).values('s')),
+                0),
+            rating_avg=Coalesce(
+                models.Subquery(
+                    reviews.annotate(
+                        a=models.Avg('rating', output_field=models.FloatField())
+                    ).values('a')),
+                0.0),
+        )
+
+
 class Listing(models.Model):
     """
     Represents a property listing.
@@ -19,6 +128,8 @@ class Listing(models.Model):
         ('cabin', 'Cabin'),
         ('loft', 'Loft'),
     ]
+    # large columns worth skipping when a client does not request them
+    DEFERRABLE_FIELDS = ['description', 'amenities']
 
     title = models.CharField(max_length=200)
     description = models.TextField()
@@ -38,11 +149,29 @@ class Listing(models.Model):
     bathrooms = models.PositiveIntegerField(default=1)
     amenities = models.JSONField(default=list, blank=True)
     available = models.BooleanField(default=True)
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    # geohash of the coordinates, derived on save (see listings.geo)
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    # denormalized review aggregates, maintained by listings.signals
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
     host = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='listings')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ListingQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
@@ -50,17 +179,174 @@ class Listing(models.Model):
             models.Index(fields=['property_type']),
             models.Index(fields=['price_per_night']),
             models.Index(fields=['available']),
+            models.Index(fields=['rating_avg']),
+            # keyset pagination order
+            models.Index(fields=['created_at', 'id']),
+            # proximity search reads geohash cells as ranges and checks
+            # distances without visiting the table
+            models.Index(fields=['geohash', 'latitude', 'longitude']),
         ]
 
     def __str__(self):
         return f"{self.title} - {self.location}"
 
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and \
+                {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
     def average_rating(self):
-        reviews = self.reviews.all()
-        return sum(r.rating for r in reviews) / len(reviews) if reviews else 0
+        return self.rating_avg
 
     def total_reviews(self):
-        return self.reviews.count()
+        return self.review_count
+
+
+class ListingSearchEntry(models.Model):
+    """
+    A listing's row in the SQLite FTS5 index (see `listings.search`).
+
+    The virtual table is created by migration 0008 rather than by Django;
+    the model only exists so that searches can join it to listings.
+    """
+    listing = models.OneToOneField(
+        Listing,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='search_entry'
+    )
+    # FTS5 hidden columns: the one named after the table takes MATCH
+    # queries and `rank` scores each match
+    document = models.TextField(db_column='listings_listing_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'listings_listing_fts'
+
+
+class Amenity(models.Model):
+    """
+    A distinct amenity name, normalized out of `Listing.amenities` so
+    that listings can be filtered by amenity through an index.
+    """
+    # case- and whitespace-insensitive form of the name, see amenity_key()
+    key = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=100)
+    # listings linked to the amenity, used to plan multi-amenity filters
+    listing_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name_plural = 'amenities'
+
+    def __str__(self):
+        return self.name
+
+
+class ListingAmenity(models.Model):
+    """
+    Links a listing to each amenity in its `amenities` list (see
+    `listings.amenities`, which keeps the two in sync).
+    """
+    listing = models.ForeignKey(
+        Listing,
+        on_delete=models.CASCADE,
+        related_name='amenity_links',
+        db_index=False
+    )
+    amenity = models.ForeignKey(
+        Amenity,
+        on_delete=models.CASCADE,
+        related_name='listing_links',
+        db_index=False
+    )
+
+    class Meta:
+        constraints = [
+            # also serves "listings with this amenity" range scans
+            models.UniqueConstraint(
+                fields=['amenity', 'listing'], name='unique_listing_amenity')
+        ]
+        indexes = [
+            # per-listing EXISTS probes and syncing a listing's links
+            models.Index(fields=['listing', 'amenity']),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} - {self.amenity_id}"
+
+
+class RateRule(models.Model):
+    """
+    A nightly rate and/or minimum stay for some nights of a listing:
+    between two dates (seasonal), on some days of the week (weekend), or
+    both. Where rules overlap the highest priority wins; nights no rule
+    prices cost the listing's `price_per_night` (see listings.pricing).
+    """
+    # weekday bits, Monday first: a rule applies to nights starting on them
+    ALL_WEEKDAYS = 0b1111111
+    WEEKEND = 0b0110000  # Friday and Saturday nights
+
+    listing = models.ForeignKey(
+        Listing, on_delete=models.CASCADE, related_name='rate_rules')
+    name = models.CharField(max_length=100, blank=True)
+    # first and last night covered; open-ended when empty
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    weekdays = models.PositiveSmallIntegerField(
+        default=ALL_WEEKDAYS,
+        validators=[MinValueValidator(1), MaxValueValidator(ALL_WEEKDAYS)]
+    )
+    price_per_night = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(Decimal('0.01'))]
+    )
+    # shortest stay arriving on a covered night
+    min_nights = models.PositiveIntegerField(
+        null=True, blank=True,
+        validators=[MinValueValidator(1),
+                    MaxValueValidator(MAX_QUOTE_NIGHTS)])
+    priority = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['listing', 'priority', 'id']
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(start_date__isnull=True)
+                | models.Q(end_date__isnull=True)
+                | models.Q(end_date__gte=models.F('start_date')),
+                name='rate_rule_end_after_start'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name or 'Rate rule'} for listing {self.listing_id}"
+
+
+class BookingQuerySet(models.QuerySet):
+    """
+    Query helpers for booking conflict checks.
+    """
+
+    def active(self):
+        return self.filter(status__in=Booking.ACTIVE_STATUSES)
+
+    def overlapping(self, check_in, check_out):
+        """Active bookings sharing at least one night with the stay."""
+        return self.active().filter(
+            check_in_date__lt=check_out,
+            check_out_date__gt=check_in,
+        )
 
 
 class Booking(models.Model):
@@ -73,6 +359,8 @@ class Booking(models.Model):
         ('cancelled', 'Cancelled'),
         ('completed', 'Completed'),
     ]
+    # statuses that hold the listing's nights
+    ACTIVE_STATUSES = ['confirmed', 'pending']
 
     listing = models.ForeignKey(
         Listing, on_delete=models.CASCADE, related_name='bookings')
@@ -95,13 +383,20 @@ class Booking(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookingQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['check_in_date', 'check_out_date']),
-            models.Index(fields=['status']),
+            # also serves the lifecycle sweep of past confirmed stays
+            models.Index(fields=['status', 'check_out_date']),
             models.Index(fields=['user']),
-            models.Index(fields=['listing']),
+            # serves overlap checks and the availability anti-join
+            models.Index(fields=[
+                'listing', 'status', 'check_in_date', 'check_out_date']),
+            # keyset pagination order
+            models.Index(fields=['created_at', 'id']),
         ]
         constraints = [
             models.CheckConstraint(
@@ -122,10 +417,60 @@ class Booking(models.Model):
     def duration(self):
         return (self.check_out_date - self.check_in_date).days
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_stay()
+        return instance
+
+    def _remember_stay(self):
+        # the persisted stay, used to update occupancy bitmaps on save
+        self._loaded_stay = tuple(
+            self.__dict__.get(name) for name in (
+                'listing_id', 'check_in_date', 'check_out_date', 'status'))
+
     def save(self, *args, **kwargs):
-        if not self.total_price and self.listing and self.check_in_date and self.check_out_date:
-            self.total_price = self.listing.price_per_night * self.duration()
+        if not self.total_price and self.listing_id and self.check_in_date and self.check_out_date:
+            # priced from the listing's (cached) rate calendar
+            from .pricing import stay_price
+            self.total_price = stay_price(
+                self.listing_id, self.check_in_date, self.check_out_date)
+            if self.total_price is None:
+                # no calendar (e.g. a stale negative cache entry): the flat
+                # nightly price, as before rate rules
+                price = Listing.objects.filter(pk=self.listing_id) \
+                    .values_list('price_per_night', flat=True).first()
+                if price is None:
+                    raise ValidationError('Listing does not exist.')
+                self.total_price = price * self.duration()
         super().save(*args, **kwargs)
+        self._remember_stay()
+
+
+class ListingOccupancy(models.Model):
+    """
+    A listing's booked nights in one calendar year as a bitmap: bit i
+    (least significant first within each byte) is set when a pending,
+    confirmed or completed booking holds the night starting on January
+    1st + i days. Maintained by listings.occupancy.
+    """
+    listing = models.ForeignKey(
+        Listing,
+        on_delete=models.CASCADE,
+        related_name='occupancy',
+        db_index=False
+    )
+    year = models.PositiveSmallIntegerField()
+    nights = models.BinaryField(max_length=46)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['listing', 'year'], name='unique_listing_occupancy')
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} - {self.year}"
 
 
 class Review(models.Model):
@@ -161,6 +506,27 @@ class Review(models.Model):
     def __str__(self):
         return f"Review by {self.user.username} for {self.listing.title} - {self.rating}/5"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_rating()
+        return instance
+
+    def _remember_rating(self):
+        # the persisted listing/rating, used to apply aggregate deltas on save
+        self._loaded_rating = (
+            self.__dict__.get('listing_id'), self.__dict__.get('rating'))
+
+    def save(self, *args, **kwargs):
+        # keep the review write and the listing aggregate update atomic
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._remember_rating()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def clean(self):
         if not Booking.objects.filter(
             user=self.user,
@@ -173,15 +539,107 @@ class Review(models.Model):
 
 class Payment(models.Model):
     """this handles payments for our system"""
+    booking = models.ForeignKey(
+        Booking,
+        on_delete=models.SET_NULL,
+        related_name='payments',
+        null=True,
+        blank=True
+    )
     booking_reference = models.CharField(max_length=100)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    transaction_id = models.CharField(
+        max_length=100, blank=True, null=True, unique=True)
     status = models.CharField(max_length=20, choices=[
         ('Pending', 'Pending'),
         ('Completed', 'Completed'),
         ('Failed', 'Failed')
         ])
     created_at = models.DateTimeField(auto_now_add=True)
+    # a queued verify_payment task owns the payment until then (or until
+    # it finishes); a lost task's claim lapses
+    verifying_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # reconciliation scans: stale payments in a given status
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.booking_reference} - {self.status}"
+
+    @staticmethod
+    def booking_id_for_reference(reference):
+        """Booking references are booking ids; anything else is unlinked"""
+        reference = str(reference or '').strip()
+        return int(reference) if reference.isdecimal() else None
+
+
+class PaymentEvent(models.Model):
+    """
+    A gateway webhook delivery, stored as soon as it is received and
+    applied to payments and bookings later in batches.
+    """
+    # hash of (tx_ref, event, status): redeliveries collapse onto one row
+    event_id = models.CharField(max_length=64, unique=True)
+    tx_ref = models.CharField(max_length=100)
+    event = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, blank=True)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event or 'event'} {self.tx_ref} - {self.status}"
+
+    @staticmethod
+    def make_event_id(tx_ref, event, status):
+        key = f'{tx_ref}:{event}:{status}'.encode()
+        return hashlib.sha256(key).hexdigest()
+
+
+class JobLock(models.Model):
+    """
+    Lock and resume position of a periodic job, kept in the database so
+    every worker and management command sees the same ones (see
+    listings.jobs).
+    """
+    name = models.CharField(max_length=100, unique=True)
+    # run currently holding the lock; its lease lapses if it dies
+    owner = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # job-defined position of an interrupted run, e.g. the last id done
+    checkpoint = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class OutgoingEmail(models.Model):
+    """
+    A rendered notification waiting to be sent, queued in the transaction
+    that caused it and sent in rate-limited batches by
+    listings.tasks.flush_emails.
+    """
+    kind = models.CharField(max_length=50)
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    # failed sends; the message is given up after EMAIL_OUTBOX_MAX_ATTEMPTS
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'id']),
+        ]
 
     def __str__(self):
-        return f"{self.booking_reference} - {self.status}"
\ No newline at end of file
+        return f"{self.kind} to {self.recipient}"
@@ -0,0 +1,220 @@
+# occupancy.py
+"""
+Per-listing availability calendars.
+
+Each listing has one `ListingOccupancy` bitmap per calendar year, with a
+bit per night that is set while a booking holds it (see HOLDING_STATUSES),
+so a year long window is read with one query touching two 46-byte rows
+instead of scanning the listing's bookings.
+
+The bitmaps follow the Booking signals. When a saved or deleted booking
+changes the nights it holds (dates, listing, or moving in or out of the
+holding statuses; pending -> confirmed -> completed changes nothing), only
+those nights are recomputed, from the listing's bookings under its row
+lock, so overlapping bookings never clear each other's nights. Writes that
+skip the signals call `refresh_stays` for the stays they moved, or
+`rebuild_occupancy` for whole listings.
+"""
+import re
+from datetime import date, timedelta
+from django.db import connection, transaction
+from django.db.models import FilteredRelation, Q
+from .models import Booking, Listing, ListingOccupancy
+
+YEAR_BYTES = 46  # 366 bits
+# bookings whose nights are marked: the active ones, and finished stays
+# so that completing a booking leaves its bitmap alone
+HOLDING_STATUSES = [*Booking.ACTIVE_STATUSES, 'completed']
+
+
+def year_start(year):
+    return date(year, 1, 1)
+
+
+def years_between(start, end):
+    """Years holding the nights [start, end)"""
+    return range(start.year, (end - timedelta(days=1)).year + 1)
+
+
+def night_mask(year, start, end):
+    """Bits of the nights [start, end) clipped to `year`'s bitmap"""
+    first = year_start(year)
+    lo = max(start, first)
+    hi = min(end, year_start(year + 1))
+    if lo >= hi:
+        return 0
+    return ((1 << (hi - lo).days) - 1) << (lo - first).days
+
+
+def to_bitmap(bits):
+    return bits.to_bytes(YEAR_BYTES, 'little')
+
+
+def from_bitmap(data):
+    return int.from_bytes(bytes(data), 'little')
+
+
+def refresh_stays(stays):
+    """
+    Recompute the bits of the nights of (listing_id, start, end) stays
+    from their listings' bookings, in one transaction and a fixed number
+    of queries however many stays are given.
+    """
+    regions = {}
+    for listing_id, start, end in stays:
+        for year in years_between(start, end):
+            regions[listing_id, year] = regions.get(
+                (listing_id, year), 0) | night_mask(year, start, end)
+    if not regions:
+        return
+    first = min(start for _, start, _ in stays)
+    last = max(end for _, _, end in stays)
+    with transaction.atomic():
+        # serializes refreshes per listing; listings gone are skipped
+        listing_ids = set(
+            Listing.objects.select_for_update()
+            .filter(pk__in={listing_id for listing_id, _ in regions})
+            .order_by('pk').values_list('pk', flat=True))
+        held = {}
+        # statuses are checked here: filtering on them lets SQLite pick the
+        # (status, check_out_date) index over the per-listing one
+        bookings = Booking.objects.filter(
+            listing_id__in=listing_ids,
+            check_in_date__lt=last, check_out_date__gt=first,
+        ).order_by().values_list(
+            'listing_id', 'status', 'check_in_date', 'check_out_date')
+        for listing_id, status, check_in, check_out in bookings:
+            if status not in HOLDING_STATUSES:
+                continue
+            for year in years_between(check_in, check_out):
+                if (listing_id, year) in regions:
+                    held[listing_id, year] = held.get(
+                        (listing_id, year), 0) | night_mask(
+                        year, check_in, check_out)
+        rows = {
+            (row.listing_id, row.year): row
+            for row in ListingOccupancy.objects.select_for_update().filter(
+                listing_id__in=listing_ids,
+                year__in={year for _, year in regions})
+        }
+        changed, created = [], []
+        for (listing_id, year), region in regions.items():
+            if listing_id not in listing_ids:
+                continue
+            bits = held.get((listing_id, year), 0) & region
+            row = rows.get((listing_id, year))
+            if row is None:
+                if bits:
+                    created.append(ListingOccupancy(
+                        listing_id=listing_id, year=year,
+                        nights=to_bitmap(bits)))
+                continue
+            old = from_bitmap(row.nights)
+            if old & region != bits:
+                row.nights = to_bitmap(old & ~region | bits)
+                changed.append(row)
+        if changed:
+            # one prepared UPDATE per row: building bulk_update's CASE
+            # expression costs more than the writes
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    'UPDATE {} SET {} = %s WHERE id = %s'.format(
+                        quote(ListingOccupancy._meta.db_table),
+                        quote('nights')),
+                    [(row.nights, row.id) for row in changed])
+        ListingOccupancy.objects.bulk_create(created)
+
+
+def booking_moved(booking, deleted=False):
+    """Refresh the nights a saved or deleted booking held or now holds"""
+    previous = getattr(booking, '_loaded_stay', None)
+    if previous and None in previous:
+        previous = None
+    current = (
+        booking.listing_id, booking.check_in_date, booking.check_out_date,
+        booking.status)
+    if deleted:
+        stays = [previous or current]
+    elif previous and previous[:3] == current[:3] and \
+            (previous[3] in HOLDING_STATUSES) == \
+            (current[3] in HOLDING_STATUSES):
+        # the same nights, held before and after (or neither)
+        return
+    else:
+        stays = [stay for stay in (previous, current) if stay]
+    refresh_stays([
+        stay[:3] for stay in stays if stay[3] in HOLDING_STATUSES
+    ])
+
+
+def rebuild_occupancy(listings, batch_size=1000):
+    """
+    Rebuild the bitmaps of `listings` (a queryset) from their bookings,
+    one transaction per batch of listings. Returns the number of bitmaps
+    written.
+    """
+    written, last_id = 0, 0
+    while True:
+        ids = list(
+            listings.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return written
+        last_id = ids[-1]
+        bitmaps = {}
+        with transaction.atomic():
+            # the same row locks as refresh_stays
+            list(Listing.objects.select_for_update().filter(pk__in=ids)
+                 .order_by().values_list('pk'))
+            stays = Booking.objects.filter(
+                listing_id__in=ids, status__in=HOLDING_STATUSES,
+            ).order_by().values_list(
+                'listing_id', 'check_in_date', 'check_out_date',
+            ).iterator(chunk_size=batch_size)
+            for listing_id, check_in, check_out in stays:
+                for year in years_between(check_in, check_out):
+                    key = listing_id, year
+                    bitmaps[key] = bitmaps.get(key, 0) | night_mask(
+                        year, check_in, check_out)
+            ListingOccupancy.objects.filter(listing_id__in=ids).delete()
+            ListingOccupancy.objects.bulk_create([
+                ListingOccupancy(
+                    listing_id=listing_id, year=year, nights=to_bitmap(bits))
+                for (listing_id, year), bits in bitmaps.items()
+            ])
+        written += len(bitmaps)
+
+
+def booked_nights(listing_id, start, end):
+    """
+    One '0' (free) or '1' (booked) per night of [start, end), or None when
+    the listing does not exist, read with a single query.
+    """
+    years = years_between(start, end)
+    rows = list(
+        Listing.objects.filter(pk=listing_id)
+        .annotate(window=FilteredRelation(
+            'occupancy', condition=Q(occupancy__year__in=years)))
+        .values_list('window__year', 'window__nights'))
+    if not rows:
+        return None
+    bitmaps = {year: data for year, data in rows if year is not None}
+    nights = []
+    for year in years:
+        first = year_start(year)
+        lo = (max(start, first) - first).days
+        hi = (min(end, year_start(year + 1)) - first).days
+        bits = from_bitmap(bitmaps.get(year, b''))
+        # bit i is night i: read the binary digits right to left
+        nights.append(format(bits, f'0{8 * YEAR_BYTES}b')[::-1][lo:hi])
+    return ''.join(nights)
+
+
+def booked_ranges(start, nights):
+    """[{start, end}] runs of booked nights; `end` is the check-out day"""
+    return [
+        {'start': start + timedelta(days=run.start()),
+         'end': start + timedelta(days=run.end())}
+        for run in re.finditer('1+', nights)
+    ]
@@ -0,0 +1,182 @@
+# pagination.py
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination on `(ordering field, id)`.
+
+    The cursor carries the position of the last row served, so every page is
+    an index range scan from that position and deep pages cost the same as
+    the first one. The `id` tie-breaker keeps the order total when several
+    rows share a value.
+
+    Like DRF's CursorPagination, the ordering can come from a filter backend
+    on the view exposing `get_ordering()`; only its first term is used.
+    """
+    ordering = '-created_at'
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        ordering = self.get_ordering(request, queryset, view)
+        self.field = ordering.lstrip('-')
+        self.descending = ordering.startswith('-')
+        self.model_field = queryset.model._meta.get_field(self.field)
+
+        position, reverse = self.decode_cursor(request)
+        # walking backwards flips the scan direction
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + self.field, prefix + 'id')
+        if position is not None:
+            queryset = queryset.filter(self.seek(position, descending))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return rows
+
+    def seek(self, position, descending):
+        value, pk = position
+        op = 'lt' if descending else 'gt'
+        # the leading range term keeps the predicate sargable on the
+        # (field, id) index; the OR only separates ties on the first field
+        return (
+            Q(**{f'{self.field}__{op}e': value})
+            & (Q(**{f'{self.field}__{op}': value}) | Q(**{f'id__{op}': pk}))
+        )
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return ordering[0]
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if data['f'] != self.field:
+                raise ValueError(data['f'])
+            value = self.model_field.to_python(data['v'])
+            if value is None:
+                raise ValueError(data['v'])
+            return (value, int(data['i'])), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        data = {
+            'f': self.field,
+            'v': self.model_field.value_to_string(row),
+            'i': row.pk,
+        }
+        if reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(
+            json.dumps(data, separators=(',', ':')).encode('ascii'))
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {
+                    'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Limit/offset pages over relevance-ordered search results.
+
+    Relevance is computed per query rather than stored, so there is no
+    column to seek on; pages instead fetch one extra row to tell whether
+    there is a next page, and never count the whole result set.
+    """
+    default_limit = api_settings.PAGE_SIZE or 20
+    max_limit = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        # only what the next/previous links need to know
+        self.count = self.offset + len(rows)
+        return rows[:self.limit]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        del response_schema['properties']['count']
+        response_schema['required'] = ['results']
+        return response_schema
@@ -0,0 +1,215 @@
+# pricing.py
+"""
+Stay quotes from per-listing nightly rate rules.
+
+Every night of a listing costs its `price_per_night` unless a `RateRule`
+covering it (by date range and weekday) sets another rate; the highest
+priority rule wins, and a rule's minimum stay applies to arrivals on the
+nights it covers.
+
+Rules are resolved once per listing into a `PriceCalendar`: the nightly
+price (in cents) and minimum stay of every night in a window of
+PRICE_CALENDAR_YEARS calendar years, plus a running total of the prices.
+A stay inside the window is then priced with two lookups however long it
+is. Calendars are cached under the listing's cache generation, so saving
+the listing or any of its rules drops them. A batch of quotes reads all
+the calendars it needs in one cache round trip and builds the missing
+ones from a single query.
+"""
+from array import array
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+from django.conf import settings
+from django.core.cache import cache
+from .cache import KEY_PREFIX, get_generations, listing_scope
+from .models import Listing
+
+
+def to_cents(price):
+    return int(price * 100)
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+class PriceCalendar:
+    """A listing's resolved nightly prices and minimum stays"""
+
+    def __init__(self, base_price, rules, start, days):
+        """
+        `rules` are (start_date, end_date, weekdays, price, min_nights)
+        tuples in ascending priority, so later ones override earlier ones.
+        """
+        self.base = to_cents(base_price)
+        self.rules = [
+            (first, last, weekdays,
+             None if price is None else to_cents(price), min_nights)
+            for first, last, weekdays, price, min_nights in rules
+        ]
+        self.start = start
+        self.days = days
+        prices = array('q', [self.base]) * days
+        # wide enough for any stored min_nights, validated or not
+        self.min_nights = array('L', [1]) * days
+        for first, last, weekdays, price, min_nights in self.rules:
+            self._apply(prices, first, last, weekdays, price, min_nights)
+        # totals[i] is the price of the first i nights of the window; the
+        # nightly prices are its differences, so only it is kept
+        self.totals = array('q', accumulate(prices, initial=0))
+
+    def _apply(self, prices, first, last, weekdays, price, min_nights):
+        """Write a rule over the window, one strided slice per weekday"""
+        lo = 0 if first is None else max((first - self.start).days, 0)
+        hi = self.days if last is None else min(
+            (last - self.start).days + 1, self.days)
+        for weekday in range(7):
+            if not weekdays >> weekday & 1 or lo >= hi:
+                continue
+            first_day = self.start + timedelta(lo)
+            offset = lo + (weekday - first_day.weekday()) % 7
+            count = len(range(offset, hi, 7))
+            if price is not None:
+                prices[offset:hi:7] = array('q', [price]) * count
+            if min_nights is not None:
+                self.min_nights[offset:hi:7] = \
+                    array('L', [min_nights]) * count
+
+    def night(self, day):
+        """(price in cents, minimum stay) of the night starting on `day`"""
+        index = (day - self.start).days
+        if 0 <= index < self.days:
+            price = self.totals[index + 1] - self.totals[index]
+            return price, self.min_nights[index]
+        price, min_stay = self.base, 1
+        for first, last, weekdays, rule_price, rule_min in self.rules:
+            if (first is None or first <= day) and \
+                    (last is None or day <= last) and \
+                    weekdays >> day.weekday() & 1:
+                price = price if rule_price is None else rule_price
+                min_stay = min_stay if rule_min is None else rule_min
+        return price, min_stay
+
+    def total(self, check_in, check_out):
+        """Price in cents of the nights from check_in to check_out"""
+        lo = (check_in - self.start).days
+        hi = (check_out - self.start).days
+        if 0 <= lo and hi <= self.days:
+            return self.totals[hi] - self.totals[lo]
+        return sum(
+            self.night(check_in + timedelta(n))[0]
+            for n in range((check_out - check_in).days))
+
+    def nightly(self, check_in, check_out):
+        return [
+            self.night(check_in + timedelta(n))[0]
+            for n in range((check_out - check_in).days)
+        ]
+
+
+def calendar_window(today=None):
+    """(first day, number of days) that calendars precompute"""
+    today = today or date.today()
+    start = date(today.year, 1, 1)
+    end = date(today.year + settings.PRICE_CALENDAR_YEARS, 1, 1)
+    return start, (end - start).days
+
+
+def build_calendars(listing_ids, start, days):
+    """Calendars of the existing listings among `listing_ids`, one query"""
+    rows = (
+        Listing.objects.filter(id__in=listing_ids)
+        .order_by('id', 'rate_rules__priority', 'rate_rules__id')
+        .values_list(
+            'id', 'price_per_night', 'rate_rules__id',
+            'rate_rules__start_date', 'rate_rules__end_date',
+            'rate_rules__weekdays', 'rate_rules__price_per_night',
+            'rate_rules__min_nights')
+    )
+    prices, rules = {}, {}
+    for listing_id, base, rule_id, *rule in rows:
+        prices[listing_id] = base
+        rules.setdefault(listing_id, [])
+        if rule_id is not None:
+            rules[listing_id].append(rule)
+    return {
+        listing_id: PriceCalendar(base, rules[listing_id], start, days)
+        for listing_id, base in prices.items()
+    }
+
+
+def get_calendars(listing_ids):
+    """listing id -> PriceCalendar, read through the cache"""
+    listing_ids = list(dict.fromkeys(listing_ids))
+    start, days = calendar_window()
+    generations = get_generations(
+        [listing_scope(listing_id) for listing_id in listing_ids])
+    keys = {
+        listing_id: f'{KEY_PREFIX}:prices:{start:%Y}:{listing_id}:{gen}'
+        for listing_id, gen in zip(listing_ids, generations)
+    }
+    found = cache.get_many(keys.values())
+    calendars = {
+        listing_id: found[key]
+        for listing_id, key in keys.items() if key in found
+    }
+    missing = [
+        listing_id for listing_id in listing_ids
+        if listing_id not in calendars
+    ]
+    if missing:
+        built = build_calendars(missing, start, days)
+        # unknown listings are cached as False: creating one bumps the
+        # generation in its key
+        cache.set_many(
+            {keys[listing_id]: built.get(listing_id, False)
+             for listing_id in missing},
+            settings.PRICE_CALENDAR_TIMEOUT)
+        calendars.update(built)
+    return {
+        listing_id: calendar
+        for listing_id, calendar in calendars.items() if calendar
+    }
+
+
+def quote_stays(stays, nightly=False):
+    """
+    Quotes for (listing_id, check_in, check_out) stays, in order. Each is
+    a dict with the total price and minimum stay, or an `error` when the
+    listing does not exist or the stay is too short.
+    """
+    calendars = get_calendars(listing_id for listing_id, _, _ in stays)
+    quotes = []
+    for listing_id, check_in, check_out in stays:
+        quote = {
+            'listing_id': listing_id,
+            'check_in': check_in,
+            'check_out': check_out,
+            'nights': (check_out - check_in).days,
+        }
+        calendar = calendars.get(listing_id)
+        if calendar is None:
+            quote['error'] = 'Listing not found.'
+            quotes.append(quote)
+            continue
+        total = calendar.total(check_in, check_out)
+        quote['min_nights'] = calendar.night(check_in)[1]
+        quote['total_price'] = from_cents(total)
+        if nightly:
+            quote['nightly_prices'] = [
+                {'date': check_in + timedelta(n), 'price': from_cents(cents)}
+                for n, cents in enumerate(
+                    calendar.nightly(check_in, check_out))
+            ]
+        if quote['nights'] < quote['min_nights']:
+            quote['error'] = (
+                f"Minimum stay is {quote['min_nights']} nights.")
+        quotes.append(quote)
+    return quotes
+
+
+def stay_price(listing_id, check_in, check_out):
+    """Total price of one stay, ignoring its minimum (None if no listing)"""
+    quote = quote_stays([(listing_id, check_in, check_out)])[0]
+    return quote.get('total_price')
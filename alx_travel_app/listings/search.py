@@ -0,0 +1,179 @@
+# search.py
+"""
+Full-text listing search over title, description and location.
+
+The index lives in the database and is reached through a pluggable
+backend, picked from the database vendor unless LISTING_SEARCH_BACKEND
+names one:
+
+* ``sqlite`` - an FTS5 virtual table keyed on the listing id, kept in
+  sync from the Listing signals and ranked with bm25
+* ``mysql``  - a native FULLTEXT index queried in boolean mode; InnoDB
+  maintains it, so there is nothing to sync
+* anything else falls back to unindexed substring matching
+
+Every query term is matched as a prefix and all terms must match.
+Backends return the queryset filtered to matches and ordered by
+relevance, annotated with `search_rank` (higher is better).
+"""
+import re
+from abc import ABC, abstractmethod
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import F, FloatField, Lookup, Q, Value
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .models import ListingSearchEntry
+
+# longer queries are cut to their first terms
+MAX_TERMS = 8
+INDEXED_FIELDS = ('title', 'description', 'location')
+
+
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+ListingSearchEntry._meta.get_field('document').register_lookup(Match)
+
+
+class SearchBackend(ABC):
+    """Base backend: query parsing plus no-op index maintenance"""
+
+    def terms(self, text):
+        return [term.lower() for term in re.findall(r'\w+', text)][:MAX_TERMS]
+
+    @abstractmethod
+    def search(self, queryset, text):
+        """`queryset` narrowed to listings matching `text`, best first"""
+
+    def index(self, listings, created=False):
+        """(Re)index saved listings; `created` when none was indexed yet"""
+
+    def remove(self, ids):
+        """Drop deleted listings from the index"""
+
+    def rebuild(self, queryset, batch_size):
+        """Reindex every listing in `queryset`; returns the rows indexed"""
+        return 0
+
+
+class FTS5SearchBackend(SearchBackend):
+    table = ListingSearchEntry._meta.db_table
+
+    def search(self, queryset, text):
+        terms = self.terms(text)
+        if not terms:
+            return queryset.none()
+        # quoting keeps FTS5 operators in user input literal; * = prefix
+        expression = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(
+            search_entry__document__match=expression
+        ).annotate(
+            # FTS5 ranks are bm25 scores negated: lower is more relevant
+            search_rank=-F('search_entry__rank')
+        ).order_by('-search_rank', 'id')
+
+    def index(self, listings, created=False):
+        rows = [
+            (listing.pk, listing.title, listing.description, listing.location)
+            for listing in listings if listing.pk is not None
+        ]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            if not created:
+                cursor.executemany(
+                    f'DELETE FROM {self.table} WHERE rowid = %s',
+                    [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, description, '
+                f'location) VALUES (%s, %s, %s, %s)', rows)
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [(pk,) for pk in ids])
+
+    def rebuild(self, queryset, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        indexed, last_id = 0, 0
+        queryset = queryset.only('id', *INDEXED_FIELDS).order_by('id')
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            self.index(batch, created=True)
+            indexed += len(batch)
+            last_id = batch[-1].id
+        with connection.cursor() as cursor:
+            # merge the index segments written batch by batch
+            cursor.execute(
+                f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+        return indexed
+
+
+class MySQLFulltextSearchBackend(SearchBackend):
+    def search(self, queryset, text):
+        terms = self.terms(text)
+        if not terms:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        columns = ', '.join(f'{table}.{name}' for name in INDEXED_FIELDS)
+        return queryset.annotate(search_rank=RawSQL(
+            f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)',
+            [' '.join(f'+{term}*' for term in terms)],
+            output_field=FloatField(),
+        )).filter(search_rank__gt=0).order_by('-search_rank', 'id')
+
+
+class BasicSearchBackend(SearchBackend):
+    """Unindexed fallback: every term as a substring of some field"""
+
+    def search(self, queryset, text):
+        terms = self.terms(text)
+        if not terms:
+            return queryset.none()
+        for term in terms:
+            matches = Q()
+            for name in INDEXED_FIELDS:
+                matches |= Q(**{f'{name}__icontains': term})
+            queryset = queryset.filter(matches)
+        return queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('-created_at', 'id')
+
+
+BACKENDS = {
+    'sqlite': FTS5SearchBackend,
+    'mysql': MySQLFulltextSearchBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'LISTING_SEARCH_BACKEND', None)
+        backend_class = (
+            import_string(path) if path
+            else BACKENDS.get(connection.vendor, BasicSearchBackend))
+        _backend = backend_class()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'LISTING_SEARCH_BACKEND':
+        _backend = None
@@ -1,9 +1,23 @@
 # serializers.py
 # pylint: disable=no-member
+import math
+from datetime import timedelta
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.utils import timezone
-from .models import Listing, Booking, Review
+from .geo import KM_PER_DEGREE
+from .models import MAX_QUOTE_NIGHTS, Listing, Booking, RateRule, Review
+from .pricing import quote_stays
+
+# each requested amenity adds one indexed probe to the listing query
+MAX_AMENITY_FILTERS = 10
+# proximity searches, in km: larger areas hold too many candidates to sort
+DEFAULT_NEARBY_RADIUS = 10
+MAX_NEARBY_RADIUS = 200
+# availability calendar windows, in nights
+DEFAULT_CALENDAR_DAYS = 365
+MAX_CALENDAR_DAYS = 731
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -36,24 +50,21 @@ class ReviewSerializer(serializers.ModelSerializer):
         return value
 
 
-class ListingSerializer(serializers.ModelSerializer):
-    """Serializer for Listing model"""
+class FieldProjectionMixin:
+    """
+    Restrict a serializer's output to the `fields` passed at init time,
+    e.g. from a `?fields=id,title` query parameter.
+    """
 
-    host = UserSerializer(read_only=True)
-    host_id = serializers.IntegerField(write_only=True)
-    reviews = ReviewSerializer(many=True, read_only=True)
-    average_rating = serializers.ReadOnlyField()
-    total_reviews = serializers.ReadOnlyField()
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
-    class Meta:
-        model = Listing
-        fields = [
-            'id', 'title', 'description', 'price_per_night', 'location',
-            'property_type', 'max_guests', 'bedrooms', 'bathrooms',
-            'amenities', 'available', 'host', 'host_id', 'reviews',
-            'average_rating', 'total_reviews', 'created_at', 'updated_at'
-        ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+
+class ListingValidationMixin:
+    """Field checks shared by the listing write serializers"""
 
     def validate_price_per_night(self, value):
         if value <= 0:
@@ -69,8 +80,98 @@ class ListingSerializer(serializers.ModelSerializer):
     def validate_amenities(self, value):
         if not isinstance(value, list):
             raise serializers.ValidationError("Amenities must be a list.")
+        if not all(isinstance(name, str) and len(name) <= 100
+                   for name in value):
+            raise serializers.ValidationError(
+                "Amenities must be names of at most 100 characters.")
         return value
 
+    def validate(self, attrs):
+        instance = getattr(self, 'instance', None)
+        coordinates = [
+            attrs.get(name, getattr(instance, name, None))
+            for name in ('latitude', 'longitude')
+        ]
+        if coordinates.count(None) == 1:
+            raise serializers.ValidationError(
+                "Latitude and longitude must be given together.")
+        return attrs
+
+
+class ListingSerializer(ListingValidationMixin, FieldProjectionMixin,
+                        serializers.ModelSerializer):
+    """Serializer for Listing model"""
+
+    host = UserSerializer(read_only=True)
+    host_id = serializers.IntegerField(write_only=True)
+    reviews = ReviewSerializer(many=True, read_only=True)
+    average_rating = serializers.ReadOnlyField()
+    total_reviews = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Listing
+        fields = [
+            'id', 'title', 'description', 'price_per_night', 'location',
+            'property_type', 'max_guests', 'bedrooms', 'bathrooms',
+            'amenities', 'available', 'latitude', 'longitude', 'host',
+            'host_id', 'reviews', 'average_rating', 'total_reviews',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class ListingImportSerializer(ListingValidationMixin,
+                              serializers.ModelSerializer):
+    """
+    Flat write serializer for bulk imports: one instance validates every
+    row (see `listings.imports`), and host existence is checked per batch.
+    """
+
+    host_id = serializers.IntegerField()
+
+    class Meta:
+        model = Listing
+        fields = [
+            'title', 'description', 'price_per_night', 'location',
+            'property_type', 'max_guests', 'bedrooms', 'bathrooms',
+            'amenities', 'available', 'latitude', 'longitude', 'host_id'
+        ]
+
+
+class ListingListSerializer(FieldProjectionMixin, serializers.ModelSerializer):
+    """
+    Flat serializer for listing collections: no nested host or reviews and
+    no description, with ratings read from the stored aggregates.
+    """
+
+    host_id = serializers.IntegerField(read_only=True)
+    average_rating = serializers.FloatField(source='rating_avg', read_only=True)
+    total_reviews = serializers.IntegerField(
+        source='review_count', read_only=True)
+
+    class Meta:
+        model = Listing
+        fields = [
+            'id', 'title', 'price_per_night', 'location', 'property_type',
+            'max_guests', 'bedrooms', 'bathrooms', 'available', 'latitude',
+            'longitude', 'host_id', 'average_rating', 'total_reviews',
+            'created_at'
+        ]
+        read_only_fields = fields
+
+
+class ListingNearbySerializer(ListingListSerializer):
+    """Collection rows of a proximity search, with their distance in km"""
+
+    distance = serializers.SerializerMethodField()
+
+    class Meta(ListingListSerializer.Meta):
+        fields = ListingListSerializer.Meta.fields + ['distance']
+        read_only_fields = fields
+
+    def get_distance(self, obj):
+        return round(math.sqrt(obj.distance_sq), 3)
+
 
 class ListingBasicSerializer(serializers.ModelSerializer):
     """Basic serializer for Listing model (for nested representations)"""
@@ -121,27 +222,285 @@ class BookingSerializer(serializers.ModelSerializer):
 
         # Check for conflicting bookings
         if check_in and check_out and listing_id:
-            conflicts = Booking.objects.filter(
-                listing_id=listing_id,
-                status__in=['confirmed', 'pending'],
-                check_in_date__lt=check_out,
-                check_out_date__gt=check_in
-            )
-            if self.instance:
-                conflicts = conflicts.exclude(id=self.instance.id)
-            if conflicts.exists():
-                raise serializers.ValidationError(
-                    "Listing is not available for the selected dates.")
+            self._check_conflicts(listing_id, check_in, check_out)
 
         return attrs
 
+    def _check_conflicts(self, listing_id, check_in, check_out):
+        conflicts = Booking.objects.filter(
+            listing_id=listing_id
+        ).overlapping(check_in, check_out)
+        if self.instance:
+            conflicts = conflicts.exclude(id=self.instance.id)
+        if conflicts.exists():
+            raise serializers.ValidationError(
+                "Listing is not available for the selected dates.")
+
+    def _lock_listing(self, listing_id, check_in, check_out):
+        """
+        Lock the listing row and re-run the conflict check under the lock.
+
+        Concurrent bookings for the same listing queue up on the row lock,
+        while bookings for other listings proceed independently. Must be
+        called inside a transaction.
+        """
+        listing = Listing.objects.select_for_update().get(id=listing_id)
+        self._check_conflicts(listing.id, check_in, check_out)
+        return listing
+
     def create(self, validated_data):
-        listing = Listing.objects.get(id=validated_data['listing_id'])
-        nights = (
-            validated_data['check_out_date'] - validated_data['check_in_date']
-            ).days
-        validated_data['total_price'] = listing.price_per_night * nights
-        return super().create(validated_data)
+        check_in = validated_data['check_in_date']
+        check_out = validated_data['check_out_date']
+        with transaction.atomic():
+            listing = self._lock_listing(
+                validated_data['listing_id'], check_in, check_out)
+            quote = quote_stays([(listing.id, check_in, check_out)])[0]
+            if 'error' in quote:
+                raise serializers.ValidationError(quote['error'])
+            validated_data['total_price'] = quote['total_price']
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if validated_data.get('status', instance.status) \
+                not in Booking.ACTIVE_STATUSES:
+            # cancelling or completing a stay never creates a conflict
+            return super().update(instance, validated_data)
+        check_in = validated_data.get('check_in_date', instance.check_in_date)
+        check_out = validated_data.get(
+            'check_out_date', instance.check_out_date)
+        listing_id = validated_data.get('listing_id', instance.listing_id)
+        with transaction.atomic():
+            self._lock_listing(listing_id, check_in, check_out)
+            return super().update(instance, validated_data)
+
+
+class AvailabilitySearchSerializer(serializers.Serializer):
+    """Query parameters for the listing availability search"""
+
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+    guests = serializers.IntegerField(min_value=1, default=1)
+
+    def validate(self, attrs):
+        if attrs['check_out'] <= attrs['check_in']:
+            raise serializers.ValidationError(
+                "Check-out date must be after check-in date.")
+        return attrs
+
+
+class WeekdaysField(serializers.Field):
+    """Weekday bitmask exposed as a list of ISO weekdays (1 = Monday)"""
+
+    default_error_messages = {
+        'invalid': 'Expected a non-empty list of weekdays from 1 to 7.',
+    }
+
+    def to_representation(self, value):
+        return [day + 1 for day in range(7) if value >> day & 1]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data or not all(
+                isinstance(day, int) and 1 <= day <= 7 for day in data):
+            self.fail('invalid')
+        return sum(1 << (day - 1) for day in set(data))
+
+
+class RateRuleSerializer(serializers.ModelSerializer):
+    """Serializer for RateRule model"""
+
+    listing_id = serializers.IntegerField()
+    weekdays = WeekdaysField(required=False)
+
+    class Meta:
+        model = RateRule
+        fields = [
+            'id', 'listing_id', 'name', 'start_date', 'end_date', 'weekdays',
+            'price_per_night', 'min_nights', 'priority', 'created_at',
+            'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate_listing_id(self, value):
+        if not Listing.objects.filter(id=value).exists():
+            raise serializers.ValidationError("Listing does not exist.")
+        return value
+
+    def validate(self, attrs):
+        def current(name):
+            return attrs.get(name, getattr(self.instance, name, None))
+
+        start, end = current('start_date'), current('end_date')
+        if start and end and end < start:
+            raise serializers.ValidationError(
+                "end_date cannot be before start_date.")
+        if current('price_per_night') is None and \
+                current('min_nights') is None:
+            raise serializers.ValidationError(
+                "A rule needs a price_per_night or min_nights.")
+        return attrs
+
+
+class QuoteSerializer(serializers.Serializer):
+    """Query parameters for a single stay quote"""
+
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+
+    def validate(self, attrs):
+        nights = (attrs['check_out'] - attrs['check_in']).days
+        if nights <= 0:
+            raise serializers.ValidationError(
+                "Check-out date must be after check-in date.")
+        if nights > MAX_QUOTE_NIGHTS:
+            raise serializers.ValidationError(
+                f"Stays can be at most {MAX_QUOTE_NIGHTS} nights.")
+        return attrs
+
+
+class StayQuoteSerializer(QuoteSerializer):
+    """One stay of a batch quote"""
+
+    listing_id = serializers.IntegerField()
+
+
+class NightlyPriceSerializer(serializers.Serializer):
+    """The price of one night of a quoted stay"""
+
+    date = serializers.DateField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class QuoteResultSerializer(serializers.Serializer):
+    """
+    A quote from listings.pricing.quote_stays, with prices as decimal
+    strings like the rest of the API. Keys the quote lacks are left out.
+    """
+
+    listing_id = serializers.IntegerField()
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+    nights = serializers.IntegerField()
+    min_nights = serializers.IntegerField(required=False)
+    total_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False)
+    nightly_prices = NightlyPriceSerializer(many=True, required=False)
+    error = serializers.CharField(required=False)
+
+
+class CalendarSerializer(serializers.Serializer):
+    """Query parameters for a listing's availability calendar"""
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        start = attrs.setdefault('start', timezone.localdate())
+        end = attrs.setdefault(
+            'end', start + timedelta(days=DEFAULT_CALENDAR_DAYS))
+        nights = (end - start).days
+        if nights <= 0:
+            raise serializers.ValidationError(
+                "End date must be after start date.")
+        if nights > MAX_CALENDAR_DAYS:
+            raise serializers.ValidationError(
+                f"Calendars can span at most {MAX_CALENDAR_DAYS} nights.")
+        return attrs
+
+
+class ListingSearchSerializer(serializers.Serializer):
+    """Query parameters for the full-text listing search"""
+
+    q = serializers.CharField(max_length=200)
+
+
+class NearbySearchSerializer(serializers.Serializer):
+    """
+    Query parameters for the proximity search: a point and a radius in km,
+    a box as `bbox=min_lng,min_lat,max_lng,max_lat`, or both (results
+    inside the box, nearest the point first). Without a point, distances
+    are from the centre of the box.
+    """
+
+    lat = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    lng = serializers.FloatField(
+        min_value=-180, max_value=180, required=False)
+    radius = serializers.FloatField(
+        min_value=0.01, max_value=MAX_NEARBY_RADIUS, required=False)
+    bbox = serializers.CharField(required=False)
+
+    def validate_bbox(self, value):
+        try:
+            min_lng, min_lat, max_lng, max_lat = map(float, value.split(','))
+        except ValueError:
+            raise serializers.ValidationError(
+                "Expected min_lng,min_lat,max_lng,max_lat.")
+        if not (-90 <= min_lat <= max_lat <= 90
+                and -180 <= min_lng <= max_lng <= 180):
+            raise serializers.ValidationError(
+                "Box corners are out of range or out of order.")
+        middle = math.radians((min_lat + max_lat) / 2)
+        if (max_lat - min_lat) * KM_PER_DEGREE > 2 * MAX_NEARBY_RADIUS or \
+                (max_lng - min_lng) * KM_PER_DEGREE * math.cos(middle) \
+                > 2 * MAX_NEARBY_RADIUS:
+            raise serializers.ValidationError(
+                f"Boxes can span at most {2 * MAX_NEARBY_RADIUS} km.")
+        return min_lat, min_lng, max_lat, max_lng
+
+    def validate(self, attrs):
+        point = [attrs.get('lat'), attrs.get('lng')]
+        if point.count(None) == 1:
+            raise serializers.ValidationError(
+                "lat and lng must be given together.")
+        box = attrs.get('bbox')
+        if box is None:
+            if None in point:
+                raise serializers.ValidationError(
+                    "Either lat and lng or bbox is required.")
+            attrs.setdefault('radius', DEFAULT_NEARBY_RADIUS)
+        elif None in point:
+            attrs['lat'] = (box[0] + box[2]) / 2
+            attrs['lng'] = (box[1] + box[3]) / 2
+        return attrs
+
+
+class ListingFilterSerializer(serializers.Serializer):
+    """Query parameters accepted by the listing filters"""
+
+    location = serializers.CharField(required=False)
+    property_type = serializers.CharField(required=False)
+    min_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False)
+    guests = serializers.IntegerField(min_value=1, required=False)
+    available = serializers.BooleanField(
+        required=False, allow_null=True, default=None)
+    amenities = serializers.CharField(required=False)
+
+    def validate_property_type(self, value):
+        types = [t for t in value.split(',') if t]
+        valid = dict(Listing.PROPERTY_TYPES)
+        unknown = [t for t in types if t not in valid]
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown property type: {', '.join(unknown)}.")
+        return types
+
+    def validate_amenities(self, value):
+        names = [name for name in value.split(',') if name.strip()]
+        if len(names) > MAX_AMENITY_FILTERS:
+            raise serializers.ValidationError(
+                f"At most {MAX_AMENITY_FILTERS} amenities can be combined.")
+        return names
+
+    def validate(self, attrs):
+        min_price = attrs.get('min_price')
+        max_price = attrs.get('max_price')
+        if min_price is not None and max_price is not None \
+                and min_price > max_price:
+            raise serializers.ValidationError(
+                "min_price cannot be greater than max_price.")
+        return attrs
 
 
 class BookingBasicSerializer(serializers.ModelSerializer):
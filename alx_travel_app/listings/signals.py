@@ -0,0 +1,139 @@
+# pylint: disable=no-member
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .amenities import release_amenities, sync_amenities
+from .cache import invalidate, listing_scope
+from .models import Booking, Listing, RateRule, Review
+from .occupancy import booking_moved
+from .search import INDEXED_FIELDS, get_search_backend
+from .tasks import queue_booking_emails
+
+# guest notifications for booking status changes
+BOOKING_STATUS_EMAILS = {
+    'confirmed': 'booking_confirmed',
+    'cancelled': 'booking_cancelled',
+}
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    """Fold a created or edited review into its listing's aggregates"""
+    listings = Listing.objects.all()
+    if created:
+        listings.filter(pk=instance.listing_id).adjust_rating_stats(
+            1, instance.rating)
+        return
+
+    previous = getattr(instance, '_loaded_rating', None)
+    if previous is None or None in previous:
+        # no snapshot of the stored row: recount the listing instead
+        listings.filter(pk=instance.listing_id).rebuild_rating_stats()
+        return
+
+    old_listing_id, old_rating = previous
+    if old_listing_id == instance.listing_id:
+        # also run for comment-only edits so updated_at moves
+        listings.filter(pk=instance.listing_id).adjust_rating_stats(
+            0, instance.rating - old_rating)
+    else:
+        listings.filter(pk=old_listing_id).adjust_rating_stats(
+            -1, -old_rating)
+        listings.filter(pk=instance.listing_id).adjust_rating_stats(
+            1, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    """Remove a deleted review from its listing's aggregates"""
+    previous = getattr(instance, '_loaded_rating', None)
+    listing_id, rating = previous if previous else (
+        instance.listing_id, instance.rating)
+    Listing.objects.filter(pk=listing_id).adjust_rating_stats(-1, -rating)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def listing_changed(sender, instance, **kwargs):
+    """Evict the listing's detail entries and all list pages"""
+    invalidate(listing_scope(instance.pk), 'collection')
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Reindex the listing unless none of its searched fields was saved"""
+    if update_fields is None or set(update_fields) & set(INDEXED_FIELDS):
+        get_search_backend().index([instance], created=created)
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Listing)
+def listing_amenities_saved(sender, instance, created, update_fields=None,
+                            **kwargs):
+    """Relink the listing's amenities unless they were not saved"""
+    if update_fields is None or 'amenities' in update_fields:
+        sync_amenities([instance], created=created)
+
+
+@receiver(pre_delete, sender=Listing)
+def listing_amenities_deleted(sender, instance, **kwargs):
+    """The links cascade with the listing; their counts must go first"""
+    release_amenities([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    """Reviews feed the listing detail and its rating aggregates"""
+    scopes = {listing_scope(instance.listing_id), 'collection'}
+    previous = getattr(instance, '_loaded_rating', None)
+    if previous and previous[0] is not None:
+        scopes.add(listing_scope(previous[0]))
+    invalidate(*scopes)
+
+
+@receiver(post_save, sender=RateRule)
+@receiver(post_delete, sender=RateRule)
+def rate_rule_changed(sender, instance, **kwargs):
+    """Price calendars are cached under the listing's scope"""
+    invalidate(listing_scope(instance.listing_id))
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_changed(sender, instance, **kwargs):
+    """Bookings are only visible through availability search"""
+    invalidate('availability')
+
+
+@receiver(post_save, sender=Booking)
+def booking_occupancy_saved(sender, instance, **kwargs):
+    """Update the occupancy bitmap where the booking's nights changed"""
+    booking_moved(instance)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_occupancy_deleted(sender, instance, origin=None, **kwargs):
+    """
+    Free the nights a deleted active booking held, unless it goes with
+    its listing (deleted on its own or in a queryset), whose bitmaps go
+    too.
+    """
+    if isinstance(origin, Listing) or \
+            getattr(origin, 'model', None) is Listing:
+        return
+    booking_moved(instance, deleted=True)
+
+
+@receiver(post_save, sender=Booking)
+def booking_status_email(sender, instance, created, **kwargs):
+    """Tell the guest when a stored booking is confirmed or cancelled"""
+    previous = getattr(instance, '_loaded_stay', None)
+    kind = BOOKING_STATUS_EMAILS.get(instance.status)
+    if created or not kind or not previous or \
+            previous[3] in (None, instance.status):
+        return
+    queue_booking_emails(kind, Booking.objects.filter(pk=instance.pk))
@@ -1,8 +1,544 @@
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from celery import shared_task
-from django.core.mail import send_mail
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .cache import invalidate
+from .gateway import ChapaError, get_client
+from .jobs import acquire_lock, get_checkpoint, set_checkpoint
+from .models import Booking, OutgoingEmail, Payment, PaymentEvent
+from .occupancy import HOLDING_STATUSES, refresh_stays
+
+logger = get_task_logger(__name__)
+
+# how long an enqueued verification blocks duplicates for the same tx_ref
+# unless it finishes first
+VERIFY_LOCK_TIMEOUT = 300
+# a reconciliation run refreshes its lock every batch; a crashed run
+# releases it after this many seconds
+RECONCILE_LOCK_TIMEOUT = 600
+RECONCILE_JOB = 'payments:reconcile'
+# gateway statuses that settle a payment; anything else stays Pending
+GATEWAY_OUTCOMES = {'success': 'Completed', 'failed': 'Failed'}
+# overlapping lifecycle runs are skipped; a run refreshes its lock every
+# chunk, and a crashed run releases it after this many seconds
+LIFECYCLE_LOCK_TIMEOUT = 3600
+LIFECYCLE_JOB = 'bookings:lifecycle'
+EMAIL_FLUSH_JOB = 'emails:flush'
+EMAIL_FLUSH_SCHEDULED_KEY = 'emails:flush:scheduled'
+
 
 @shared_task
 def send_payment_confirmation_email(email, booking_ref):
-    subject = 'Payment Confirmation'
-    message = f"Your payment for booking {booking_ref} was successful!"
-    send_mail(subject, message, 'no-reply@yourdomain.com', [email])
\ No newline at end of file
+    # kept for messages already queued on the broker: they join the outbox
+    queue_emails('payment_confirmed', [
+        (email, {'booking_reference': booking_ref})])
+
+
+def claim_verification(tx_ref):
+    """
+    Mark the Pending payment `tx_ref` as being verified, unless a claim
+    is already live. The claim is on the payment row, so the web
+    processes and the workers all see it. Returns True when claimed.
+    """
+    now = timezone.now()
+    return bool(Payment.objects.filter(
+        Q(verifying_until__isnull=True) | Q(verifying_until__lte=now),
+        transaction_id=tx_ref, status='Pending',
+    ).update(verifying_until=now + timedelta(seconds=VERIFY_LOCK_TIMEOUT)))
+
+
+def release_verification(tx_ref):
+    Payment.objects.filter(transaction_id=tx_ref).update(verifying_until=None)
+
+
+def enqueue_payment_verification(tx_ref):
+    """
+    Queue `verify_payment` for `tx_ref` unless one is already in flight.
+    Returns True when a task was queued.
+    """
+    if not claim_verification(tx_ref):
+        return False
+    verify_payment.delay(tx_ref)
+    return True
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=10)
+def verify_payment(self, tx_ref):
+    """
+    Ask Chapa for the outcome of `tx_ref` and settle the Pending payment.
+    Gateway errors are retried; the in-flight claim is held until the
+    task finishes for good.
+    """
+    if not Payment.objects.filter(
+            transaction_id=tx_ref, status='Pending').exists():
+        release_verification(tx_ref)
+        return None
+
+    try:
+        data = get_client().verify(tx_ref)
+    except ChapaError as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        release_verification(tx_ref)
+        raise
+
+    try:
+        return settle_payment(tx_ref, data.get('status'), data.get('email'))
+    finally:
+        release_verification(tx_ref)
+
+
+def settle_payment(tx_ref, gateway_status, email=None):
+    """
+    Move a Pending payment to Completed/Failed from the gateway status.
+    Any other status (Chapa still reports `pending`) leaves it Pending for
+    a later verify call or reconciliation.
+
+    Idempotent: only the call that moves the payment out of Pending writes.
+    It settles through `apply_payment_outcomes`, like webhooks and
+    reconciliation, so a success also confirms the booking and queues the
+    same emails. Returns the new status, or None when there was nothing
+    to settle.
+    """
+    new_status = GATEWAY_OUTCOMES.get(gateway_status)
+    if new_status is None:
+        return None
+    with transaction.atomic():
+        if not apply_payment_outcomes({tx_ref: (new_status, email)}):
+            return None
+    return new_status
+
+
+def schedule_payment_event_processing():
+    """
+    Queue one `process_payment_events` run shortly from now unless one is
+    already scheduled, so a burst of webhooks shares a few batch tasks
+    instead of one task per delivery.
+    """
+    if cache.add('payments:events:scheduled', 1,
+                 settings.PAYMENT_EVENT_DEBOUNCE + 5):
+        process_payment_events.apply_async(
+            countdown=settings.PAYMENT_EVENT_DEBOUNCE)
+
+
+@shared_task
+def process_payment_events(batch_size=None):
+    """Apply pending webhook events batch by batch until none are left"""
+    cache.delete('payments:events:scheduled')
+    batch_size = batch_size or settings.PAYMENT_EVENT_BATCH_SIZE
+    processed = 0
+    while True:
+        applied = apply_payment_events(batch_size)
+        processed += applied
+        if applied < batch_size:
+            return processed
+
+
+def apply_payment_events(batch_size):
+    """
+    Apply up to `batch_size` unprocessed events in a single transaction.
+
+    Only Pending payments move (to Completed or Failed), so replays and
+    out-of-order deliveries are no-ops; bookings of completed payments are
+    confirmed. Events with other statuses (e.g. `pending`) are consumed
+    without settling anything. Returns the number of events consumed.
+    """
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.select_for_update()
+            .filter(processed_at__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        outcomes = {}
+        for event in events:
+            new_status = GATEWAY_OUTCOMES.get(event.status)
+            if new_status is not None:
+                # the first outcome received for a transaction wins
+                outcomes.setdefault(
+                    event.tx_ref, (new_status, event.payload.get('email')))
+        apply_payment_outcomes(outcomes)
+
+        PaymentEvent.objects.filter(
+            id__in=[event.id for event in events]
+        ).update(processed_at=timezone.now())
+
+    return len(events)
+
+
+def apply_payment_outcomes(outcomes):
+    """
+    Settle Pending payments in bulk inside the current transaction.
+
+    `outcomes` maps tx_ref to `(new_status, email)`. Payments that already
+    left Pending are skipped; bookings of completed payments are confirmed
+    and the payment and booking confirmation emails queued. Returns the
+    number of payments settled.
+    """
+    payments = list(
+        Payment.objects.select_for_update()
+        .filter(transaction_id__in=outcomes, status='Pending')
+    )
+    emails = []
+    for payment in payments:
+        payment.status, email = outcomes[payment.transaction_id]
+        if payment.status == 'Completed':
+            emails.append(
+                (email, {'booking_reference': payment.booking_reference}))
+    Payment.objects.bulk_update(payments, ['status'])
+
+    confirmed = list(Booking.objects.select_for_update().filter(
+        payments__in=[p for p in payments if p.status == 'Completed'],
+        status='pending',
+    ).values_list('pk', flat=True))
+    if confirmed:
+        # UPDATE skips the signal that notifies guests of the change
+        Booking.objects.filter(pk__in=confirmed).update(
+            status='confirmed', updated_at=timezone.now())
+        queue_booking_emails(
+            'booking_confirmed', Booking.objects.filter(pk__in=confirmed))
+
+    queue_emails('payment_confirmed', emails)
+    return len(payments)
+
+
+@shared_task
+def reconcile_payments(batch_size=None, concurrency=None, older_than=None):
+    """
+    Periodic catch-up for Pending payments that never got a verify call.
+    Skipped while another run holds the lock.
+    """
+    lease = acquire_lock(RECONCILE_JOB, RECONCILE_LOCK_TIMEOUT)
+    if lease is None:
+        return None
+    with lease:
+        return run_reconciliation(
+            batch_size, concurrency, older_than, lease=lease)
+
+
+def stale_payment_batches(cutoff, after_id, batch_size):
+    """
+    Yield lists of `(id, tx_ref)` for Pending payments created before
+    `cutoff`, in id order from `after_id`. Each batch is one keyset query,
+    so memory stays flat however many payments are stale.
+    """
+    while True:
+        batch = list(
+            Payment.objects.filter(
+                status='Pending', created_at__lt=cutoff, id__gt=after_id,
+                transaction_id__isnull=False,
+            ).order_by('id').values_list('id', 'transaction_id')[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1][0]
+
+
+def check_gateway(tx_refs, concurrency):
+    """
+    Verify `tx_refs` with at most `concurrency` calls in flight over the
+    shared connection pool. Returns `(outcomes, errors)`, where outcomes
+    only holds the transactions the gateway reports as settled.
+    """
+    client = get_client()
+
+    def check(tx_ref):
+        try:
+            return tx_ref, client.verify(tx_ref), None
+        except ChapaError as exc:
+            return tx_ref, None, exc
+
+    outcomes, errors = {}, 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for tx_ref, data, exc in pool.map(check, tx_refs):
+            if exc is not None:
+                errors += 1
+                continue
+            new_status = GATEWAY_OUTCOMES.get(data.get('status'))
+            if new_status:
+                outcomes[tx_ref] = (new_status, data.get('email'))
+    return outcomes, errors
+
+
+def run_reconciliation(batch_size=None, concurrency=None, older_than=None,
+                       restart=False, progress=None, lease=None):
+    """
+    Check every stale Pending payment against the gateway and write the
+    settled ones back, one transaction per batch.
+
+    The id of the last finished batch is checkpointed in that transaction,
+    so a run that dies part way resumes after it; the checkpoint is
+    cleared once a pass completes. The run's `lease`, if given, is renewed
+    every batch, and the run stops without writing if it was lost.
+    `progress`, if given, is called with the running totals after each
+    batch.
+    """
+    batch_size = batch_size or settings.PAYMENT_RECONCILE_BATCH_SIZE
+    concurrency = concurrency or settings.PAYMENT_RECONCILE_CONCURRENCY
+    if older_than is None:
+        older_than = settings.PAYMENT_RECONCILE_AFTER
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    if restart:
+        set_checkpoint(RECONCILE_JOB, None)
+    after_id = get_checkpoint(RECONCILE_JOB) or 0
+
+    totals = {'checked': 0, 'settled': 0, 'errors': 0}
+    for batch in stale_payment_batches(cutoff, after_id, batch_size):
+        outcomes, errors = check_gateway(
+            [tx_ref for _, tx_ref in batch], concurrency)
+        with transaction.atomic():
+            if lease is not None and not lease.refresh():
+                logger.warning('Reconciliation lock lost, stopping')
+                return totals
+            totals['settled'] += apply_payment_outcomes(outcomes)
+            set_checkpoint(RECONCILE_JOB, batch[-1][0])
+        totals['checked'] += len(batch)
+        totals['errors'] += errors
+        if progress:
+            progress(totals)
+
+    set_checkpoint(RECONCILE_JOB, None)
+    return totals
+
+
+@shared_task
+def update_booking_statuses(batch_size=None):
+    """
+    Periodic sweep moving bookings along their lifecycle. Skipped while
+    another run holds the lock.
+    """
+    lease = acquire_lock(LIFECYCLE_JOB, LIFECYCLE_LOCK_TIMEOUT)
+    if lease is None:
+        return None
+    with lease:
+        return run_booking_lifecycle(batch_size, lease=lease)
+
+
+def run_booking_lifecycle(batch_size=None, pending_ttl=None, lease=None):
+    """
+    Expire (cancel) Pending bookings left unpaid for `pending_ttl` seconds
+    or whose check-in day has come, and complete Confirmed stays whose
+    check-out day has come. Bookings with a payment still in flight are
+    left for reconciliation to settle first, and paid ones are never
+    expired. The run's `lease`, if given,
+    is renewed every chunk.
+
+    Returns the counts and the run time in seconds, which are also logged.
+    """
+    batch_size = batch_size or settings.BOOKING_LIFECYCLE_BATCH_SIZE
+    if pending_ttl is None:
+        pending_ttl = settings.BOOKING_PENDING_TTL
+    started = time.monotonic()
+    today = timezone.localdate()
+    # a Pending payment may yet succeed; a Completed one already has
+    paid = Payment.objects.filter(
+        booking=OuterRef('pk'), status__in=['Pending', 'Completed'])
+
+    totals = {
+        'expired': transition_bookings(
+            Booking.objects.filter(
+                Q(created_at__lt=timezone.now() - timedelta(
+                    seconds=pending_ttl))
+                | Q(check_in_date__lte=today),
+                status='pending',
+            ).exclude(Exists(paid)),
+            'cancelled', batch_size, email='booking_cancelled', lease=lease),
+        'completed': transition_bookings(
+            Booking.objects.filter(
+                status='confirmed', check_out_date__lte=today),
+            'completed', batch_size, lease=lease),
+    }
+    if totals['expired'] or totals['completed']:
+        invalidate('availability')
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    logger.info(
+        'Booking lifecycle: %(expired)d expired, %(completed)d completed '
+        'in %(seconds).3fs', totals)
+    return totals
+
+
+def transition_bookings(bookings, status, batch_size, email=None,
+                        lease=None):
+    """
+    Move the `bookings` queryset to `status` with one UPDATE per chunk of
+    at most `batch_size` rows, each in its own short transaction. Chunks
+    are read from the queryset as it shrinks, and the UPDATE repeats its
+    conditions, so rows changed meanwhile are left alone. UPDATE skips the
+    signals: moving out of the statuses that hold nights refreshes the
+    chunk's occupancy bitmaps alongside, and the guests of the moved
+    bookings are sent the `email` notification, if any. A run that lost
+    its `lease` stops. Returns the number of bookings moved.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic():
+            if lease is not None and not lease.refresh():
+                logger.warning('Booking lifecycle lock lost, stopping')
+                return moved
+            chunk = list(
+                bookings.order_by().values_list(
+                    'pk', 'listing_id', 'check_in_date', 'check_out_date')
+                [:batch_size])
+            if not chunk:
+                return moved
+            moved += bookings.filter(
+                pk__in=[pk for pk, *_ in chunk],
+            ).update(status=status, updated_at=timezone.now())
+            if status not in HOLDING_STATUSES:
+                refresh_stays([stay for _, *stay in chunk])
+            if email:
+                queue_booking_emails(email, Booking.objects.filter(
+                    pk__in=[pk for pk, *_ in chunk], status=status))
+
+
+def render_email(kind, context):
+    """(subject, body) of the `kind` notification"""
+    subject = render_to_string(f'listings/emails/{kind}_subject.txt', context)
+    body = render_to_string(f'listings/emails/{kind}.txt', context)
+    return ' '.join(subject.split()), body
+
+
+def queue_emails(kind, messages):
+    """
+    Render `kind` for each (recipient, context) of `messages` into the
+    outbox, in the current transaction, and schedule a flush once it
+    commits. Messages without a recipient are dropped. Returns the
+    number queued.
+    """
+    queued = 0
+    rows = []
+    for recipient, context in messages:
+        if not recipient:
+            continue
+        subject, body = render_email(kind, context)
+        rows.append(OutgoingEmail(
+            kind=kind, recipient=recipient, subject=subject[:255], body=body))
+        if len(rows) >= 500:
+            OutgoingEmail.objects.bulk_create(rows)
+            queued += len(rows)
+            rows = []
+    OutgoingEmail.objects.bulk_create(rows)
+    queued += len(rows)
+    if queued:
+        # a lost schedule is picked up by the periodic flush
+        transaction.on_commit(schedule_email_flush, robust=True)
+    return queued
+
+
+def queue_booking_emails(kind, bookings):
+    """Queue `kind` to the guest of each booking of the `bookings` queryset"""
+    bookings = bookings.select_related('user', 'listing').order_by()
+    return queue_emails(kind, (
+        (booking.user.email, {'booking': booking})
+        for booking in bookings.iterator(chunk_size=500)
+    ))
+
+
+def schedule_email_flush(countdown=None):
+    """
+    Queue one `flush_emails` run unless one is already scheduled, by
+    default EMAIL_OUTBOX_FLUSH_INTERVAL seconds from now so that a burst of
+    messages shares a few batches.
+    """
+    if countdown is None:
+        countdown = settings.EMAIL_OUTBOX_FLUSH_INTERVAL
+    if cache.add(EMAIL_FLUSH_SCHEDULED_KEY, 1, countdown + 5):
+        flush_emails.apply_async(countdown=countdown)
+
+
+@shared_task
+def flush_emails():
+    """
+    Send queued emails for up to EMAIL_OUTBOX_FLUSH_INTERVAL seconds, then
+    hand the rest to the next run. Skipped while another run holds the
+    lock.
+    """
+    cache.delete(EMAIL_FLUSH_SCHEDULED_KEY)
+    lease = acquire_lock(
+        EMAIL_FLUSH_JOB, settings.EMAIL_OUTBOX_FLUSH_INTERVAL * 2 + 60)
+    if lease is None:
+        return None
+    with lease:
+        totals = send_queued_emails()
+    if totals['remaining']:
+        schedule_email_flush(countdown=0)
+    return totals
+
+
+def queued_emails():
+    return OutgoingEmail.objects.filter(
+        sent_at__isnull=True,
+        attempts__lt=settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+
+
+def send_queued_emails(batch_size=None, rate_limit=None, duration=None):
+    """
+    Send queued emails oldest first over one reused connection, in
+    batches of `batch_size`, paced to `rate_limit` messages per second and
+    stopping after about `duration` seconds.
+
+    A refused recipient costs its own message an attempt; any other error
+    ends the run, keeping what was sent so far. Sending is at least once:
+    a crash between sending a batch and marking it sent repeats the batch.
+    Returns the number of messages sent, failed and still queued.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    rate_limit = rate_limit or settings.EMAIL_OUTBOX_RATE_LIMIT
+    if duration is None:
+        duration = settings.EMAIL_OUTBOX_FLUSH_INTERVAL
+    budget = max(int(rate_limit * duration), 1)
+    totals = {'sent': 0, 'failed': 0}
+    last_id = 0
+    connection = get_connection()
+    try:
+        connection.open()
+        while totals['sent'] + totals['failed'] < budget:
+            # each message is tried at most once per run
+            batch = list(
+                queued_emails().filter(id__gt=last_id).order_by('id')[:min(
+                    batch_size, budget - totals['sent'] - totals['failed'])])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            started = time.monotonic()
+            sent, failed = [], []
+            try:
+                # one message per call, as send_mass_mail sends them, so a
+                # failure part way still tells which ones were delivered
+                for email in batch:
+                    try:
+                        connection.send_messages([EmailMessage(
+                            email.subject, email.body, None,
+                            [email.recipient])])
+                    except smtplib.SMTPRecipientsRefused:
+                        failed.append(email.id)
+                    else:
+                        sent.append(email.id)
+            finally:
+                OutgoingEmail.objects.filter(id__in=sent).update(
+                    sent_at=timezone.now())
+                OutgoingEmail.objects.filter(id__in=failed).update(
+                    attempts=F('attempts') + 1)
+                totals['sent'] += len(sent)
+                totals['failed'] += len(failed)
+            time.sleep(max(
+                len(batch) / rate_limit - (time.monotonic() - started), 0))
+    except (smtplib.SMTPException, OSError) as exc:
+        # the server dropped or cannot be reached: later runs retry
+        logger.warning('Email flush stopped: %s', exc)
+    finally:
+        connection.close()
+    totals['remaining'] = queued_emails().count()
+    return totals
@@ -1,3 +1,2343 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import smtplib
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from celery.exceptions import Retry
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Exists, F, OuterRef
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from alx_travel_app.celery import app as celery_app
+from .gateway import AsyncChapaClient, ChapaClient, ChapaError
+from .geo import bounding_box, encode_geohash
+from .imports import import_listings
+from .jobs import acquire_lock, get_checkpoint
+from .metrics import reset_metrics
+from .models import Amenity, Booking, Listing, ListingAmenity
+from .models import JobLock, ListingOccupancy, ListingSearchEntry
+from .models import OutgoingEmail, Payment, PaymentEvent, RateRule, Review
+from .occupancy import booked_nights, rebuild_occupancy
+from .pagination import KeysetPagination
+from .pricing import quote_stays
+from .serializers import BookingSerializer
+from .tasks import claim_verification, enqueue_payment_verification
+from .tasks import verify_payment
+from .tasks import process_payment_events, reconcile_payments
+from .tasks import RECONCILE_JOB, run_reconciliation
+from .tasks import LIFECYCLE_JOB, update_booking_statuses
+from .tasks import flush_emails, queue_emails, send_queued_emails
+from .tasks import EMAIL_FLUSH_JOB, apply_payment_outcomes, render_email
+
+
+def make_listing(host, **kwargs):
+    data = {
+        'title': 'Cozy Apartment',
+        'description': 'A nice place to stay.',
+        'price_per_night': Decimal('100.00'),
+        'location': 'New York, NY',
+        'property_type': 'apartment',
+        'max_guests': 4,
+    }
+    data.update(kwargs)
+    return Listing.objects.create(host=host, **data)
+
+
+class StubChapaHandler(BaseHTTPRequestHandler):
+    """Serves scripted Chapa responses: server.script[path] is a list of
+    (status, body, delay) consumed in order, the last one repeating."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.calls.append({
+            'method': self.command, 'path': self.path, 'body': body,
+            'auth': self.headers.get('Authorization'),
+            'port': self.client_address[1],
+        })
+        script = self.server.script.get(self.path) or [(404, {}, 0)]
+        status, payload, delay = (
+            script.pop(0) if len(script) > 1 else script[0])
+        time.sleep(delay)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = respond
+
+
+class StubChapaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients that gave up (timeouts) leave broken pipes behind
+        pass
+
+
+class StubChapaMixin:
+    """Runs a local stub Chapa API for the duration of each test."""
+
+    def setUp(self):
+        super().setUp()
+        self.server = StubChapaServer(('127.0.0.1', 0), StubChapaHandler)
+        self.server.script, self.server.calls = {}, []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def script(self, path, *responses):
+        self.server.script[path] = [
+            r if len(r) == 3 else (*r, 0) for r in responses]
+
+    def verified(self, tx_ref, status='success'):
+        self.script(
+            f'/transaction/verify/{tx_ref}',
+            (200, {'data': {'tx_ref': tx_ref, 'status': status}}))
+
+
+class ListingQueryCountTests(TestCase):
+    """Listing reads must not issue per-row queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user(username='host', password='x')
+        reviewers = [
+            User.objects.create_user(username=f'guest{i}', password='x')
+            for i in range(3)
+        ]
+        for i in range(100):
+            listing = make_listing(cls.host, title=f'Listing {i}')
+            for rating, reviewer in enumerate(reviewers, start=3):
+                Review.objects.create(
+                    listing=listing, user=reviewer,
+                    rating=rating, comment='Nice')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_list_query_count_is_bounded(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/listings/', {'page_size': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 100)
+        self.assertLessEqual(len(ctx.captured_queries), 2)
+
+    def test_list_rating_aggregates(self):
+        response = self.client.get('/api/listings/')
+        item = response.data['results'][0]
+        self.assertEqual(item['total_reviews'], 3)
+        self.assertEqual(item['average_rating'], 4)
+
+    def test_detail_query_count_is_bounded(self):
+        listing = Listing.objects.first()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/listings/{listing.id}/')
+        self.assertEqual(len(response.data['reviews']), 3)
+        self.assertIn('username', response.data['reviews'][0]['user'])
+        self.assertEqual(response.data['host']['username'], 'host')
+        self.assertLessEqual(len(ctx.captured_queries), 2)
+
+
+class ListingRepresentationTests(TestCase):
+    """List and detail actions use different representations."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.listing = make_listing(self.host)
+
+    def test_list_items_are_flat(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/listings/')
+        item = response.data['results'][0]
+        self.assertEqual(item['host_id'], self.host.id)
+        for name in ('description', 'reviews', 'host', 'amenities'):
+            self.assertNotIn(name, item)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('description', ctx.captured_queries[0]['sql'])
+
+    def test_detail_is_full(self):
+        response = self.client.get(f'/api/listings/{self.listing.id}/')
+        for name in ('description', 'reviews', 'host', 'amenities'):
+            self.assertIn(name, response.data)
+
+    def test_projection_applies_to_list(self):
+        response = self.client.get('/api/listings/', {'fields': 'id,title'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+
+
+class ListingRatingStatsTests(TestCase):
+    """Stored rating aggregates follow review writes."""
+
+    def setUp(self):
+        self.host = User.objects.create_user(username='host', password='x')
+        self.alice = User.objects.create_user(username='alice', password='x')
+        self.bob = User.objects.create_user(username='bob', password='x')
+        self.listing = make_listing(self.host)
+
+    def assertStats(self, listing, count, total, average):
+        listing.refresh_from_db()
+        self.assertEqual(listing.total_reviews(), count)
+        self.assertEqual(listing.rating_sum, total)
+        self.assertAlmostEqual(listing.average_rating(), average)
+
+    def test_create_update_delete(self):
+        review = Review.objects.create(
+            listing=self.listing, user=self.alice, rating=5, comment='Great')
+        Review.objects.create(
+            listing=self.listing, user=self.bob, rating=2, comment='Meh')
+        self.assertStats(self.listing, 2, 7, 3.5)
+
+        review.rating = 3
+        review.save()
+        self.assertStats(self.listing, 2, 5, 2.5)
+
+        review.delete()
+        self.assertStats(self.listing, 1, 2, 2)
+
+    def test_reloaded_review_update(self):
+        Review.objects.create(
+            listing=self.listing, user=self.alice, rating=5, comment='Great')
+        review = Review.objects.get()
+        review.rating = 1
+        review.save()
+        self.assertStats(self.listing, 1, 1, 1)
+
+    def test_move_review_between_listings(self):
+        other = make_listing(self.host, title='Other')
+        review = Review.objects.create(
+            listing=self.listing, user=self.alice, rating=4, comment='Good')
+        review.listing = other
+        review.save()
+        self.assertStats(self.listing, 0, 0, 0)
+        self.assertStats(other, 1, 4, 4)
+
+    def test_cascade_delete(self):
+        Review.objects.create(
+            listing=self.listing, user=self.alice, rating=4, comment='Good')
+        Review.objects.create(
+            listing=self.listing, user=self.bob, rating=2, comment='Meh')
+        self.alice.delete()
+        self.assertStats(self.listing, 1, 2, 2)
+
+    def test_rebuild_command(self):
+        Review.objects.create(
+            listing=self.listing, user=self.alice, rating=4, comment='Good')
+        Review.objects.create(
+            listing=self.listing, user=self.bob, rating=5, comment='Great')
+        Listing.objects.update(review_count=0, rating_sum=0, rating_avg=0)
+        call_command('rebuild_rating_stats', batch_size=1, stdout=StringIO())
+        self.assertStats(self.listing, 2, 9, 4.5)
+
+    def test_ordering_by_rating(self):
+        other = make_listing(self.host, title='Other')
+        Review.objects.create(
+            listing=self.listing, user=self.alice, rating=2, comment='Meh')
+        Review.objects.create(
+            listing=other, user=self.alice, rating=5, comment='Great')
+        top = Listing.objects.order_by('-rating_avg').first()
+        self.assertEqual(top, other)
+
+
+class ListingAvailabilityTests(TestCase):
+    """Availability search excludes listings with conflicting bookings."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(username='guest', password='x')
+        self.free = make_listing(self.host, title='Free', max_guests=4)
+        self.busy = make_listing(self.host, title='Busy', max_guests=4)
+        self.small = make_listing(self.host, title='Small', max_guests=1)
+        self.check_in = date.today() + timedelta(days=10)
+        self.check_out = self.check_in + timedelta(days=3)
+
+    def book(self, listing, check_in, nights, status='confirmed'):
+        return Booking.objects.create(
+            listing=listing, user=self.guest, check_in_date=check_in,
+            check_out_date=check_in + timedelta(days=nights), guests=1,
+            status=status)
+
+    def search(self, **params):
+        params.setdefault('check_in', self.check_in.isoformat())
+        params.setdefault('check_out', self.check_out.isoformat())
+        return self.client.get('/api/listings/available/', params)
+
+    def titles(self, response):
+        return sorted(item['title'] for item in response.data['results'])
+
+    def test_overlapping_booking_excludes_listing(self):
+        self.book(self.busy, self.check_in + timedelta(days=1), 5)
+        response = self.search(guests=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.titles(response), ['Free'])
+
+    def test_adjacent_and_cancelled_bookings_do_not_conflict(self):
+        self.book(self.busy, self.check_out, 2)
+        self.book(self.busy, self.check_in - timedelta(days=2), 2)
+        self.book(self.free, self.check_in, 3, status='cancelled')
+        response = self.search(guests=2)
+        self.assertEqual(self.titles(response), ['Busy', 'Free'])
+
+    def test_unavailable_listing_is_excluded(self):
+        Listing.objects.filter(pk=self.free.pk).update(available=False)
+        response = self.search()
+        self.assertEqual(self.titles(response), ['Busy', 'Small'])
+
+    def test_invalid_range_is_rejected(self):
+        response = self.search(check_out=self.check_in.isoformat())
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/listings/available/')
+        self.assertEqual(response.status_code, 400)
+
+
+class BookingCreationTests(TestCase):
+    """Bookings re-check conflicts under the listing lock."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(username='guest', password='x')
+        self.listing = make_listing(self.host)
+        self.check_in = date.today() + timedelta(days=5)
+
+    def payload(self, nights=3, offset=0):
+        check_in = self.check_in + timedelta(days=offset)
+        return {
+            'listing_id': self.listing.id,
+            'user_id': self.guest.id,
+            'check_in_date': check_in.isoformat(),
+            'check_out_date': (check_in + timedelta(days=nights)).isoformat(),
+            'guests': 2,
+        }
+
+    def test_create_prices_stay(self):
+        response = self.client.post('/api/bookings/', self.payload())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('300'))
+
+    def test_conflict_after_validation_is_rejected(self):
+        # both requests pass validation before either one is saved
+        first = BookingSerializer(data=self.payload())
+        second = BookingSerializer(data=self.payload(offset=1))
+        self.assertTrue(first.is_valid())
+        self.assertTrue(second.is_valid())
+        first.save()
+        with self.assertRaises(serializers.ValidationError):
+            second.save()
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_api_conflict_returns_400(self):
+        self.client.post('/api/bookings/', self.payload())
+        response = self.client.post('/api/bookings/', self.payload(offset=2))
+        self.assertEqual(response.status_code, 400)
+
+    def test_cancel_skips_conflict_check(self):
+        response = self.client.post('/api/bookings/', self.payload())
+        response = self.client.patch(
+            f"/api/bookings/{response.data['id']}/", {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get().status, 'cancelled')
+
+
+class KeysetPaginationTests(TestCase):
+    """Listing pages are addressed by (created_at, id) cursors."""
+
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user(username='host', password='x')
+        for i in range(25):
+            make_listing(host, title=f'Listing {i}')
+        # force timestamp ties so the id tie-breaker matters
+        Listing.objects.filter(title__in=['Listing 10', 'Listing 11']).update(
+            created_at=Listing.objects.get(title='Listing 12').created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def walk(self, url, params=None, key='next'):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url, params, pages = response.data[key], None, pages + 1
+        return ids, pages
+
+    def test_forward_walk_matches_ordering(self):
+        ids, pages = self.walk('/api/listings/', {'page_size': 10})
+        expected = list(Listing.objects.order_by(
+            '-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/listings/', {'page_size': 10})
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNotNone(back.data['next'])
+
+    def test_page_size_is_capped(self):
+        KeysetPagination.max_page_size, original = 5, (
+            KeysetPagination.max_page_size)
+        self.addCleanup(
+            setattr, KeysetPagination, 'max_page_size', original)
+        response = self.client.get('/api/listings/', {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_deep_page_query_count_matches_first_page(self):
+        with CaptureQueriesContext(connection) as first_ctx:
+            first = self.client.get('/api/listings/', {'page_size': 5})
+        url = first.data['next']
+        for _ in range(3):
+            url = self.client.get(url).data['next']
+        cache.clear()
+        with CaptureQueriesContext(connection) as deep_ctx:
+            self.client.get(url)
+        self.assertEqual(
+            len(deep_ctx.captured_queries), len(first_ctx.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/listings/', {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_bookings_are_paginated(self):
+        response = self.client.get('/api/bookings/')
+        self.assertEqual(response.data['results'], [])
+
+
+class ListingFilterTests(TestCase):
+    """Query parameter filters, sorting and field projection."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user(username='host', password='x')
+        cls.guest = User.objects.create_user(username='guest', password='x')
+        cls.villa = make_listing(
+            cls.host, title='Villa', property_type='villa',
+            price_per_night=Decimal('300'), max_guests=8, location='Miami, FL')
+        cls.house = make_listing(
+            cls.host, title='House', property_type='house',
+            price_per_night=Decimal('150'), max_guests=5)
+        cls.loft = make_listing(
+            cls.host, title='Loft', property_type='loft',
+            price_per_night=Decimal('90'), max_guests=2, available=False)
+        Review.objects.create(
+            listing=cls.loft, user=cls.guest, rating=5, comment='Great')
+        Review.objects.create(
+            listing=cls.villa, user=cls.guest, rating=3, comment='Fine')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def titles(self, **params):
+        response = self.client.get('/api/listings/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [item['title'] for item in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.titles(location='Miami, FL'), ['Villa'])
+        self.assertEqual(
+            sorted(self.titles(property_type='villa,loft')), ['Loft', 'Villa'])
+        self.assertEqual(
+            self.titles(min_price='100', max_price='200'), ['House'])
+        self.assertEqual(sorted(self.titles(guests=5)), ['House', 'Villa'])
+        self.assertEqual(self.titles(available='false'), ['Loft'])
+
+    def test_invalid_filters(self):
+        for params in ({'property_type': 'castle'},
+                       {'min_price': '300', 'max_price': '100'},
+                       {'guests': 'many'}):
+            response = self.client.get('/api/listings/', params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_sorting(self):
+        self.assertEqual(
+            self.titles(ordering='price_per_night'), ['Loft', 'House', 'Villa'])
+        self.assertEqual(
+            self.titles(ordering='-rating_avg'), ['Loft', 'Villa', 'House'])
+        response = self.client.get('/api/listings/', {'ordering': 'title'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_sorted_pages_follow_cursor(self):
+        response = self.client.get(
+            '/api/listings/', {'ordering': '-price_per_night', 'page_size': 2})
+        titles = [item['title'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        titles += [item['title'] for item in response.data['results']]
+        self.assertEqual(titles, ['Villa', 'House', 'Loft'])
+
+    def test_cursor_from_other_ordering_is_rejected(self):
+        response = self.client.get('/api/listings/', {'page_size': 1})
+        response = self.client.get(
+            response.data['next'] + '&ordering=price_per_night')
+        self.assertEqual(response.status_code, 404)
+
+    def test_field_projection(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                '/api/listings/', {'fields': 'id,title,price_per_night'})
+        item = response.data['results'][0]
+        self.assertEqual(set(item), {'id', 'title', 'price_per_night'})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('description', sql)
+        self.assertNotIn('auth_user', sql)
+
+    def test_projection_ignored_on_writes(self):
+        response = self.client.post('/api/listings/?fields=id', {
+            'title': 'New', 'description': 'New place',
+            'price_per_night': '80.00', 'location': 'Austin, TX',
+            'max_guests': 2, 'host_id': self.host.id,
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertIn('title', response.data)
+
+
+class ListingResponseCacheTests(TestCase):
+    """Listing reads are cached and evicted by the writes they depend on."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(username='guest', password='x')
+        self.listing = make_listing(self.host, title='Original')
+        self.other = make_listing(self.host, title='Other')
+        self.url = f'/api/listings/{self.listing.id}/'
+
+    def assertQueries(self, count, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(len(ctx.captured_queries), count, response.data)
+        return response
+
+    def test_repeated_reads_hit_cache(self):
+        first = self.assertQueries(2, self.url)
+        second = self.assertQueries(0, self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertQueries(1, '/api/listings/')
+        self.assertQueries(0, '/api/listings/')
+
+    def test_query_signature_separates_entries(self):
+        self.client.get('/api/listings/', {'fields': 'id'})
+        response = self.assertQueries(1, '/api/listings/')
+        self.assertIn('title', response.data['results'][0])
+
+    def test_listing_save_evicts_only_that_listing(self):
+        other_url = f'/api/listings/{self.other.id}/'
+        self.client.get(self.url)
+        self.client.get(other_url)
+        self.client.get('/api/listings/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.title = 'Renamed'
+            self.listing.save()
+        self.assertEqual(self.client.get(self.url).data['title'], 'Renamed')
+        self.assertQueries(0, other_url)
+        response = self.assertQueries(1, '/api/listings/')
+        self.assertIn(
+            'Renamed', [item['title'] for item in response.data['results']])
+
+    def test_review_evicts_listing_and_lists(self):
+        self.client.get(self.url)
+        self.client.get('/api/listings/')
+        Review.objects.create(
+            listing=self.listing, user=self.guest, rating=4, comment='Good')
+        self.assertEqual(self.client.get(self.url).data['total_reviews'], 1)
+        self.assertQueries(1, '/api/listings/')
+
+    def test_booking_evicts_availability_only(self):
+        check_in = date.today() + timedelta(days=3)
+        params = {
+            'check_in': check_in.isoformat(),
+            'check_out': (check_in + timedelta(days=2)).isoformat(),
+        }
+        self.client.get('/api/listings/')
+        response = self.client.get('/api/listings/available/', params)
+        self.assertEqual(len(response.data['results']), 2)
+        Booking.objects.create(
+            listing=self.listing, user=self.guest, check_in_date=check_in,
+            check_out_date=check_in + timedelta(days=2), guests=1,
+            status='confirmed')
+        self.assertQueries(0, '/api/listings/')
+        response = self.client.get('/api/listings/available/', params)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        Review.objects.create(
+            listing=self.listing, user=self.guest, rating=4, comment='Good')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_etag(self):
+        etag = self.client.get('/api/listings/')['ETag']
+        response = self.client.get('/api/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_is_not_validated_by_date(self):
+        response = self.client.get('/api/listings/')
+        self.assertNotIn('Last-Modified', response)
+        self.other.delete()
+        response = self.client.get(
+            '/api/listings/',
+            HTTP_IF_MODIFIED_SINCE='Tue, 01 Jan 2030 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'api.example.com'])
+    def test_pagination_links_follow_the_host(self):
+        params = {'page_size': 1}
+        first = self.client.get('/api/listings/', params)
+        self.assertTrue(first.data['next'].startswith('http://testserver/'))
+        second = self.client.get(
+            '/api/listings/', params, HTTP_HOST='api.example.com')
+        self.assertTrue(
+            second.data['next'].startswith('http://api.example.com/'))
+
+    def test_invalid_pk_is_not_found(self):
+        response = self.client.get('/api/listings/abc/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ChapaClientTests(StubChapaMixin, TestCase):
+    """The gateway client against a local stub server."""
+
+    def client_for(self, **kwargs):
+        kwargs.setdefault('backoff_factor', 0)
+        client = ChapaClient(
+            secret_key='test-key', base_url=self.base_url, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_initialize_and_verify(self):
+        self.script('/transaction/initialize', (200, {'data': {
+            'tx_ref': 'ref-1', 'checkout_url': 'https://pay/ref-1'}}))
+        self.verified('ref-1')
+        client = self.client_for()
+        data = client.initialize({'tx_ref': 'ref-1', 'amount': '10'})
+        self.assertEqual(data['checkout_url'], 'https://pay/ref-1')
+        self.assertEqual(client.verify('ref-1')['status'], 'success')
+        self.assertEqual(self.server.calls[0]['body']['tx_ref'], 'ref-1')
+        self.assertEqual(self.server.calls[0]['auth'], 'Bearer test-key')
+
+    def test_connections_are_reused(self):
+        self.verified('ref-1')
+        client = self.client_for()
+        for _ in range(3):
+            client.verify('ref-1')
+        ports = {call['port'] for call in self.server.calls}
+        self.assertEqual(len(ports), 1)
+
+    def test_verify_retries_transient_errors(self):
+        self.script(
+            '/transaction/verify/ref-1',
+            (503, {}), (502, {}),
+            (200, {'data': {'status': 'success'}}))
+        self.assertEqual(
+            self.client_for(max_retries=3).verify('ref-1')['status'],
+            'success')
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_retries_are_bounded(self):
+        self.script('/transaction/verify/ref-1', (503, {}))
+        with self.assertRaises(ChapaError) as ctx:
+            self.client_for(max_retries=2).verify('ref-1')
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_initialize_is_not_retried_after_reaching_server(self):
+        self.script('/transaction/initialize', (503, {}))
+        with self.assertRaises(ChapaError):
+            self.client_for(max_retries=3).initialize({'tx_ref': 'ref-1'})
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_timeout(self):
+        self.script('/transaction/verify/ref-1', (200, {}, 0.5))
+        with self.assertRaises(ChapaError):
+            self.client_for(timeout=(1, 0.1), max_retries=0).verify('ref-1')
+
+    def test_async_client(self):
+        self.verified('ref-1')
+        client = AsyncChapaClient(self.client_for())
+        data = async_to_sync(client.verify)('ref-1')
+        self.assertEqual(data['status'], 'success')
+
+
+class EagerCeleryMixin:
+    """Runs Celery tasks inline, as CELERY_TASK_ALWAYS_EAGER would."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # namespaced keys from Django settings shadow the plain ones
+        previous = celery_app.conf.CELERY_TASK_ALWAYS_EAGER
+        celery_app.conf.CELERY_TASK_ALWAYS_EAGER = True
+        self.addCleanup(
+            setattr, celery_app.conf, 'CELERY_TASK_ALWAYS_EAGER', previous)
+
+
+class PaymentViewTests(EagerCeleryMixin, StubChapaMixin, TestCase):
+    """Payment views talk to the gateway through the shared client."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        overrides = override_settings(
+            CHAPA_BASE_URL=self.base_url, CHAPA_BACKOFF_FACTOR=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_initiate_payment(self):
+        self.script('/transaction/initialize', (200, {'data': {
+            'tx_ref': 'ref-1', 'checkout_url': 'https://pay/ref-1'}}))
+        response = self.client.post('/api/initiate-payment/', {
+            'booking_reference': 'ref-1', 'amount': '250.00',
+            'email': 'guest@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['payment_url'], 'https://pay/ref-1')
+        self.assertEqual(Payment.objects.get().status, 'Pending')
+
+    def test_initiate_payment_failure(self):
+        self.script('/transaction/initialize', (400, {'message': 'bad'}))
+        response = self.client.post('/api/initiate-payment/', {
+            'booking_reference': 'ref-1', 'amount': '250.00'})
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_verify_payment(self):
+        Payment.objects.create(
+            booking_reference='ref-1', amount=Decimal('250'),
+            transaction_id='ref-1', status='Pending')
+        self.verified('ref-1')
+        response = self.client.get('/api/verify-payment/', {'tx_ref': 'ref-1'})
+        self.assertEqual(response.data, {'status': 'Completed'})
+
+    def test_verify_unknown_payment(self):
+        response = self.client.get('/api/verify-payment/', {'tx_ref': 'ref-2'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.server.calls, [])
+
+    def test_settled_payment_is_not_reverified(self):
+        Payment.objects.create(
+            booking_reference='ref-1', amount=Decimal('250'),
+            transaction_id='ref-1', status='Failed')
+        response = self.client.get('/api/verify-payment/', {'tx_ref': 'ref-1'})
+        self.assertEqual(response.data, {'status': 'Failed'})
+        self.assertEqual(self.server.calls, [])
+
+
+class PaymentVerificationTaskTests(
+        EagerCeleryMixin, StubChapaMixin, TestCase):
+    """verify_payment settles payments once and chains the email."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        overrides = override_settings(
+            CHAPA_BASE_URL=self.base_url, CHAPA_BACKOFF_FACTOR=0,
+            CHAPA_MAX_RETRIES=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        Payment.objects.create(
+            booking_reference='BK-1', amount=Decimal('250'),
+            transaction_id='ref-1', status='Pending')
+        self.script('/transaction/verify/ref-1', (200, {'data': {
+            'status': 'success', 'email': 'guest@example.com'}}))
+
+    def test_success_chains_confirmation_email(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(
+                '/api/verify-payment/', {'tx_ref': 'ref-1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'status': 'Completed'})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('BK-1', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].to, ['guest@example.com'])
+
+    def test_verified_booking_survives_the_lifecycle(self):
+        host = User.objects.create_user(username='host', password='x')
+        guest = User.objects.create_user(
+            username='guest', password='x', email='guest@example.com')
+        today = timezone.localdate()
+        booking = Booking.objects.create(
+            listing=make_listing(host), user=guest, guests=1,
+            check_in_date=today, check_out_date=today + timedelta(days=2))
+        Payment.objects.filter(transaction_id='ref-1').update(booking=booking)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(verify_payment.delay('ref-1').get(), 'Completed')
+        self.assertEqual(
+            Booking.objects.get(pk=booking.pk).status, 'confirmed')
+        self.assertEqual(len(mail.outbox), 2)
+
+        # check-in is today, which would expire it were it still pending
+        Booking.objects.filter(pk=booking.pk).update(status='pending')
+        totals = update_booking_statuses()
+        self.assertEqual(totals['expired'], 0)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'pending')
+
+    def test_duplicate_runs_are_noops(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(verify_payment.delay('ref-1').get(), 'Completed')
+            self.assertIsNone(verify_payment.delay('ref-1').get())
+        self.assertEqual(len(self.server.calls), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_in_flight_verification_is_not_requeued(self):
+        claim_verification('ref-1')
+        self.assertFalse(enqueue_payment_verification('ref-1'))
+        self.assertEqual(self.server.calls, [])
+
+    def test_lapsed_claim_is_requeued(self):
+        Payment.objects.update(
+            verifying_until=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(claim_verification('ref-1'))
+        self.assertFalse(claim_verification('ref-1'))
+
+    def test_pending_response_while_queued(self):
+        celery_app.conf.CELERY_TASK_ALWAYS_EAGER = False
+        with mock.patch.object(verify_payment, 'delay') as delay:
+            response = self.client.get(
+                '/api/verify-payment/', {'tx_ref': 'ref-1'})
+        delay.assert_called_once_with('ref-1')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data, {'status': 'Pending'})
+
+    def test_pending_gateway_status_keeps_payment_pending(self):
+        self.script('/transaction/verify/ref-1', (200, {'data': {
+            'status': 'pending', 'email': 'guest@example.com'}}))
+        response = self.client.get(
+            '/api/verify-payment/', {'tx_ref': 'ref-1'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Payment.objects.get().status, 'Pending')
+        self.assertIsNone(Payment.objects.get().verifying_until)
+
+        # the later success still settles it
+        self.script('/transaction/verify/ref-1', (200, {'data': {
+            'status': 'success', 'email': 'guest@example.com'}}))
+        response = self.client.get(
+            '/api/verify-payment/', {'tx_ref': 'ref-1'})
+        self.assertEqual(response.data, {'status': 'Completed'})
+
+    def test_gateway_error_schedules_retry(self):
+        self.script('/transaction/verify/ref-1', (400, {}))
+        claim_verification('ref-1')
+        with self.assertRaises(Retry):
+            verify_payment.delay('ref-1')
+        self.assertEqual(Payment.objects.get().status, 'Pending')
+        # the retry still owns the in-flight claim
+        self.assertFalse(enqueue_payment_verification('ref-1'))
+
+    def test_gateway_error_on_last_retry_releases_claim(self):
+        self.script('/transaction/verify/ref-1', (400, {}))
+        claim_verification('ref-1')
+        with self.assertRaises(ChapaError):
+            verify_payment.apply(
+                args=['ref-1'], retries=verify_payment.max_retries).get()
+        self.assertIsNone(Payment.objects.get().verifying_until)
+
+
+class PaymentBackfillMigrationTests(TransactionTestCase):
+    """0006 links existing payments to bookings in batches."""
+
+    migrate_from = [('listings', '0005_keyset_pagination_indexes')]
+    migrate_to = [('listings', '0006_payment_booking_link')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_backfill(self):
+        apps = self.migrate(self.migrate_from)
+        User_ = apps.get_model('auth', 'User')
+        Listing_ = apps.get_model('listings', 'Listing')
+        Booking_ = apps.get_model('listings', 'Booking')
+        Payment_ = apps.get_model('listings', 'Payment')
+        user = User_.objects.create(username='guest')
+        listing = Listing_.objects.create(
+            title='Flat', description='x', price_per_night=10,
+            location='Addis Ababa', max_guests=2, host=user)
+        booking = Booking_.objects.create(
+            listing=listing, user=user, guests=1, total_price=20,
+            check_in_date=date(2030, 1, 1), check_out_date=date(2030, 1, 3))
+        Payment_.objects.create(
+            booking_reference=str(booking.id), amount=20,
+            transaction_id='tx-1', status='Pending')
+        Payment_.objects.create(
+            booking_reference='external-7', amount=5,
+            transaction_id='', status='Failed')
+        Payment_.objects.create(
+            booking_reference='99999', amount=5,
+            transaction_id='', status='Failed')
+
+        Payment_ = self.migrate(self.migrate_to).get_model(
+            'listings', 'Payment')
+        linked = Payment_.objects.get(transaction_id='tx-1')
+        self.assertEqual(linked.booking_id, booking.id)
+        unlinked = Payment_.objects.exclude(transaction_id='tx-1')
+        self.assertEqual(
+            list(unlinked.values_list('booking_id', 'transaction_id')),
+            [(None, None), (None, None)])
+        with self.assertRaises(IntegrityError):
+            Payment_.objects.create(
+                booking_reference='x', amount=1,
+                transaction_id='tx-1', status='Pending')
+
+
+class OccupancyBackfillMigrationTests(PaymentBackfillMigrationTests):
+    """0016 marks the nights of completed stays in existing bitmaps."""
+
+    migrate_from = [('listings', '0015_job_lock')]
+    migrate_to = [('listings', '0016_occupancy_completed_stays')]
+
+    def test_backfill(self):
+        apps = self.migrate(self.migrate_from)
+        User_ = apps.get_model('auth', 'User')
+        Listing_ = apps.get_model('listings', 'Listing')
+        Booking_ = apps.get_model('listings', 'Booking')
+        user = User_.objects.create(username='guest')
+        listing = Listing_.objects.create(
+            title='Flat', description='x', price_per_night=10,
+            location='Addis Ababa', max_guests=2, host=user)
+        for check_in, status in ((date(2030, 1, 1), 'completed'),
+                                 (date(2030, 1, 5), 'confirmed'),
+                                 (date(2030, 1, 8), 'cancelled')):
+            Booking_.objects.create(
+                listing=listing, user=user, guests=1, total_price=20,
+                check_in_date=check_in,
+                check_out_date=check_in + timedelta(days=2), status=status)
+
+        self.migrate(self.migrate_to)
+        self.assertEqual(
+            booked_nights(listing.id, date(2030, 1, 1), date(2030, 1, 11)),
+            '1100110000')
+
+
+@override_settings(CHAPA_WEBHOOK_SECRET='whsec')
+class ChapaWebhookTests(EagerCeleryMixin, TestCase):
+    """Webhooks are stored on receipt and applied in batches."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        host = User.objects.create_user(username='host', password='x')
+        guest = User.objects.create_user(username='guest', password='x')
+        listing = make_listing(host)
+        self.booking = Booking.objects.create(
+            listing=listing, user=guest, guests=1,
+            check_in_date=date.today() + timedelta(days=5),
+            check_out_date=date.today() + timedelta(days=7))
+        for ref in ('ref-1', 'ref-2', 'ref-3'):
+            Payment.objects.create(
+                booking=self.booking if ref == 'ref-1' else None,
+                booking_reference=f'BK-{ref}', amount=Decimal('200'),
+                transaction_id=ref, status='Pending')
+
+    def deliver(self, payload, secret='whsec'):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.generic(
+            'POST', '/api/chapa-webhook/', body,
+            content_type='application/json',
+            HTTP_X_CHAPA_SIGNATURE=signature)
+
+    def event(self, tx_ref, status='success'):
+        return {'event': f'charge.{status}', 'tx_ref': tx_ref,
+                'status': status, 'email': 'guest@example.com'}
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.deliver(self.event('ref-1'), secret='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_event_is_stored_and_acknowledged(self):
+        with mock.patch(
+                'listings.views.schedule_payment_event_processing') as sched:
+            response = self.deliver(self.event('ref-1'))
+            self.deliver(self.event('ref-1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertEqual(sched.call_count, 2)
+        self.assertEqual(Payment.objects.get(transaction_id='ref-1').status,
+                         'Pending')
+
+    def test_events_are_applied(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.deliver(self.event('ref-1'))
+            self.deliver(self.event('ref-2', status='failed'))
+        statuses = dict(Payment.objects.values_list('transaction_id', 'status'))
+        self.assertEqual(statuses, {
+            'ref-1': 'Completed', 'ref-2': 'Failed', 'ref-3': 'Pending'})
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'confirmed')
+        self.assertFalse(
+            PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_pending_events_do_not_settle(self):
+        self.deliver(self.event('ref-1', status='pending'))
+        self.assertEqual(
+            Payment.objects.get(transaction_id='ref-1').status, 'Pending')
+        self.assertFalse(
+            PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+        self.deliver(self.event('ref-1'))
+        self.assertEqual(
+            Payment.objects.get(transaction_id='ref-1').status, 'Completed')
+
+    def test_replays_are_noops(self):
+        self.deliver(self.event('ref-1'))
+        # a late contradicting delivery does not reopen a settled payment
+        self.deliver(self.event('ref-1', status='failed'))
+        self.deliver(self.event('ref-1'))
+        self.assertEqual(
+            Payment.objects.get(transaction_id='ref-1').status, 'Completed')
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+
+    def test_batches(self):
+        with mock.patch('listings.views.schedule_payment_event_processing'):
+            for ref in ('ref-1', 'ref-2', 'ref-3', 'ref-4', 'ref-5'):
+                self.deliver(self.event(ref))
+        self.assertEqual(process_payment_events(batch_size=2), 5)
+        self.assertEqual(
+            Payment.objects.filter(status='Completed').count(), 3)
+
+
+class PaymentReconciliationTests(
+        EagerCeleryMixin, StubChapaMixin, TestCase):
+    """Stale Pending payments are settled from the gateway in batches."""
+
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(
+            CHAPA_BASE_URL=self.base_url, CHAPA_BACKOFF_FACTOR=0,
+            CHAPA_MAX_RETRIES=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        host = User.objects.create_user(username='host', password='x')
+        guest = User.objects.create_user(username='guest', password='x')
+        self.booking = Booking.objects.create(
+            listing=make_listing(host), user=guest, guests=1,
+            check_in_date=date.today() + timedelta(days=5),
+            check_out_date=date.today() + timedelta(days=7))
+        for ref in ('ref-1', 'ref-2', 'ref-3', 'ref-4'):
+            Payment.objects.create(
+                booking=self.booking if ref == 'ref-1' else None,
+                booking_reference=f'BK-{ref}', amount=Decimal('200'),
+                transaction_id=ref, status='Pending')
+        Payment.objects.update(
+            created_at=timezone.now() - timedelta(hours=1))
+        self.script('/transaction/verify/ref-1', (200, {'data': {
+            'status': 'success', 'email': 'guest@example.com'}}))
+        self.verified('ref-2', status='failed')
+        self.verified('ref-3', status='pending')
+        self.verified('ref-4')
+
+    def statuses(self):
+        return dict(Payment.objects.values_list('transaction_id', 'status'))
+
+    def test_stale_payments_are_settled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            totals = reconcile_payments.delay(batch_size=3).get()
+        self.assertEqual(
+            totals, {'checked': 4, 'settled': 3, 'errors': 0})
+        self.assertEqual(self.statuses(), {
+            'ref-1': 'Completed', 'ref-2': 'Failed',
+            'ref-3': 'Pending', 'ref-4': 'Completed'})
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'confirmed')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNone(get_checkpoint(RECONCILE_JOB))
+
+    def test_recent_payments_are_left_alone(self):
+        Payment.objects.filter(transaction_id='ref-4').update(
+            created_at=timezone.now())
+        totals = run_reconciliation()
+        self.assertEqual(totals['checked'], 3)
+        self.assertEqual(self.statuses()['ref-4'], 'Pending')
+
+    def test_gateway_errors_leave_payments_pending(self):
+        self.script('/transaction/verify/ref-2', (500, {}))
+        totals = run_reconciliation()
+        self.assertEqual(totals['errors'], 1)
+        self.assertEqual(self.statuses()['ref-2'], 'Pending')
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        def crash(totals):
+            if totals['checked'] == 2:
+                raise RuntimeError('worker lost')
+
+        with self.assertRaises(RuntimeError):
+            run_reconciliation(batch_size=1, progress=crash)
+        self.assertEqual(
+            get_checkpoint(RECONCILE_JOB),
+            Payment.objects.get(transaction_id='ref-2').id)
+
+        self.server.calls.clear()
+        totals = run_reconciliation(batch_size=1)
+        self.assertEqual(totals['checked'], 2)
+        self.assertEqual(
+            [call['path'] for call in self.server.calls],
+            ['/transaction/verify/ref-3', '/transaction/verify/ref-4'])
+        self.assertEqual(self.statuses()['ref-4'], 'Completed')
+
+    def test_concurrent_runs_are_skipped(self):
+        self.assertIsNotNone(acquire_lock(RECONCILE_JOB, 60))
+        self.assertIsNone(reconcile_payments.delay().get())
+        with self.assertRaises(CommandError):
+            call_command('reconcile_payments', stdout=StringIO())
+        self.assertEqual(self.server.calls, [])
+
+    def test_lapsed_lock_is_taken_over(self):
+        stale = acquire_lock(RECONCILE_JOB, 60)
+        JobLock.objects.filter(name=RECONCILE_JOB).update(
+            locked_until=timezone.now() - timedelta(seconds=1))
+        lease = acquire_lock(RECONCILE_JOB, 60)
+        self.assertIsNotNone(lease)
+        # the run that lost its lock stops before writing anything
+        self.assertFalse(stale.refresh())
+        totals = run_reconciliation(lease=stale)
+        self.assertEqual(totals['settled'], 0)
+        self.assertEqual(set(self.statuses().values()), {'Pending'})
+        stale.release()
+        self.assertIsNone(acquire_lock(RECONCILE_JOB, 60))
+        lease.release()
+        self.assertIsNotNone(acquire_lock(RECONCILE_JOB, 60))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('reconcile_payments', '--restart', stdout=out)
+        self.assertIn('Checked 4 payments: 3 settled', out.getvalue())
+
+
+class SeedCommandTests(TestCase):
+    """seed --bulk inserts the same kind of data in batches."""
+
+    def test_bulk_seed(self):
+        out = StringIO()
+        call_command(
+            'seed', '--bulk', '--users', '5', '--listings', '12',
+            '--bookings', '300', '--reviews', '40', '--batch-size', '50',
+            stdout=out)
+        self.assertIn('300 bookings', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Listing.objects.count(), 12)
+        self.assertEqual(Booking.objects.count(), 300)
+        self.assertFalse(
+            Booking.objects.filter(user=F('listing__host')).exists())
+        for booking in Booking.objects.select_related('listing')[:20]:
+            self.assertEqual(
+                booking.total_price,
+                booking.listing.price_per_night * booking.duration())
+        self.assertTrue(Review.objects.filter(
+            booking__status='completed').exists())
+        # aggregates are rebuilt since bulk_create skips the signals
+        for listing in Listing.objects.all():
+            self.assertEqual(
+                listing.review_count, listing.reviews.count())
+
+    def test_bulk_seed_hashes_password_once(self):
+        with mock.patch(
+                'listings.management.commands.seed.make_password',
+                return_value='hash') as make_password:
+            call_command(
+                'seed', '--bulk', '--users', '20', '--listings', '2',
+                '--bookings', '0', '--reviews', '0', stdout=StringIO())
+        make_password.assert_called_once()
+        self.assertEqual(
+            set(User.objects.values_list('password', flat=True)), {'hash'})
+
+    def snapshot(self):
+        return (
+            list(User.objects.order_by('id').values_list(
+                'id', 'username')),
+            list(Listing.objects.order_by('id').values_list(
+                'id', 'host_id', 'title', 'price_per_night')),
+            list(Booking.objects.order_by('id').values_list(
+                'id', 'listing_id', 'user_id', 'check_in_date',
+                'check_out_date', 'status', 'total_price')),
+            list(Review.objects.order_by('id').values_list(
+                'id', 'listing_id', 'user_id', 'booking_id', 'rating')),
+        )
+
+    def test_bulk_seed_is_deterministic(self):
+        args = ['seed', '--bulk', '--clear', '--users', '8', '--listings',
+                '10', '--bookings', '200', '--reviews', '30',
+                '--batch-size', '40', '--seed', '7']
+        call_command(*args, stdout=StringIO())
+        first = self.snapshot()
+        call_command(*args, stdout=StringIO())
+        self.assertEqual(self.snapshot(), first)
+        call_command(*args[:-1], '8', stdout=StringIO())
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_bulk_seed_respects_booking_invariants(self):
+        call_command(
+            'seed', '--bulk', '--users', '4', '--listings', '3',
+            '--bookings', '500', '--reviews', '0', '--seed', '1',
+            stdout=StringIO())
+        self.assertFalse(Booking.objects.filter(
+            check_out_date__lte=F('check_in_date')).exists())
+        self.assertFalse(Booking.objects.filter(Exists(
+            Booking.objects.filter(
+                listing=OuterRef('listing'), id__gt=OuterRef('id')
+            ).overlapping(
+                OuterRef('check_in_date'), OuterRef('check_out_date'))
+        )).exists())
+        self.assertFalse(
+            Booking.objects.filter(user=F('listing__host')).exists())
+
+    def test_bulk_seed_inserts_a_busy_listing_in_batches(self):
+        sizes = []
+        bulk_create = Booking.objects.bulk_create
+
+        def record(objs, **kwargs):
+            # the command reuses its buffers, so measure them on the way in
+            sizes.append(len(objs))
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Booking.objects, 'bulk_create', record):
+            call_command(
+                'seed', '--bulk', '--users', '6', '--listings', '1',
+                '--bookings', '120', '--reviews', '2', '--batch-size', '25',
+                '--seed', '1', stdout=StringIO())
+        self.assertEqual(sum(sizes), 120)
+        self.assertLessEqual(max(sizes), 25)
+        self.assertEqual(Booking.objects.count(), 120)
+        self.assertEqual(Review.objects.count(), 2)
+        self.assertTrue(ListingOccupancy.objects.exists())
+
+    def test_workers_require_bulk(self):
+        with self.assertRaises(CommandError):
+            call_command('seed', '--workers', '2', stdout=StringIO())
+
+
+class ExportTests(TestCase):
+    """Table dumps stream as CSV or NDJSON to staff only."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(
+            username='ops', password='x', is_staff=True)
+        self.listing = make_listing(self.staff, amenities=['WiFi', 'Pool'])
+        make_listing(self.staff, title='Second')
+        self.client.force_authenticate(self.staff)
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response = self.client.get('/api/export/listings.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('listings.csv', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(self.content(response).decode())))
+        self.assertEqual(rows[0][:2], ['id', 'title'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][0], str(self.listing.id))
+        amenities = rows[1][rows[0].index('amenities')]
+        self.assertEqual(json.loads(amenities), ['WiFi', 'Pool'])
+
+    def test_ndjson(self):
+        response = self.client.get('/api/export/listings.ndjson')
+        lines = self.content(response).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['title'] for r in records],
+                         [self.listing.title, 'Second'])
+        self.assertEqual(records[0]['host_id'], self.staff.id)
+        self.assertEqual(records[0]['price_per_night'], '100.00')
+
+    def test_gzip(self):
+        response = self.client.get(
+            '/api/export/listings.ndjson', {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(self.content(response)).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(
+            User.objects.create_user(username='guest', password='x'))
+        response = self.client.get('/api/export/payments.csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_export(self):
+        self.assertEqual(
+            self.client.get('/api/export/users.csv').status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/export/listings.xml').status_code, 404)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'listings.csv.gz')
+            call_command(
+                'export_data', 'listings', '--gzip', '--chunk-size', '1',
+                '--output', path, stdout=StringIO())
+            with open(path, 'rb') as output:
+                lines = gzip.decompress(output.read()).splitlines()
+        self.assertEqual(len(lines), 3)
+
+
+class ListingImportTests(TestCase):
+    """Bulk imports validate per batch and report rows they reject."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+
+    def row(self, **kwargs):
+        data = {
+            'title': 'Imported', 'description': 'Bulk', 'location': 'Paris',
+            'price_per_night': '80.00', 'property_type': 'apartment',
+            'max_guests': 2, 'host_id': self.host.id,
+        }
+        data.update(kwargs)
+        return data
+
+    def test_bulk_endpoint(self):
+        rows = [self.row(title=f'Listing {i}') for i in range(30)]
+        rows[3] = self.row(price_per_night='-1')
+        rows[7] = self.row(host_id=999999)
+        rows[9] = 'not a listing'
+        with override_settings(LISTING_IMPORT_BATCH_SIZE=10), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/listings/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 27)
+        self.assertEqual(
+            [error['row'] for error in response.data['errors']], [3, 7, 9])
+        self.assertIn('price_per_night', response.data['errors'][0]['errors'])
+        self.assertIn('host_id', response.data['errors'][1]['errors'])
+        self.assertEqual(Listing.objects.count(), 27)
+        # per batch: the host lookup, the insert and its index entries,
+        # plus the savepoint around them
+        self.assertLessEqual(len(queries), 3 * 5)
+
+    def test_backends_without_bulk_returning_insert_row_by_row(self):
+        rows = [self.row(title=f'Chalet {i}', amenities=['Sauna'])
+                for i in range(3)]
+        with mock.patch.object(type(connection.features),
+                               'can_return_rows_from_bulk_insert',
+                               new_callable=mock.PropertyMock,
+                               return_value=False):
+            result = import_listings(rows)
+        self.assertEqual(result, {'created': 3, 'errors': []})
+        listings = Listing.objects.filter(title__startswith='Chalet')
+        self.assertEqual(listings.count(), 3)
+        self.assertEqual(
+            ListingAmenity.objects.filter(listing__in=listings).count(), 3)
+        self.assertEqual(
+            ListingSearchEntry.objects.filter(listing__in=listings).count(),
+            3)
+
+    def test_bulk_endpoint_rejects_oversized_requests(self):
+        with override_settings(LISTING_IMPORT_MAX_ROWS=2):
+            response = self.client.post(
+                '/api/listings/bulk/', [self.row()] * 3, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Listing.objects.exists())
+
+    def test_bulk_endpoint_with_only_invalid_rows(self):
+        response = self.client.post(
+            '/api/listings/bulk/', [self.row(max_guests=0)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+
+    def test_bulk_import_evicts_cached_pages(self):
+        self.client.get('/api/listings/')
+        self.client.post('/api/listings/bulk/', [self.row()], format='json')
+        self.assertEqual(
+            len(self.client.get('/api/listings/').data['results']), 1)
+
+    def test_command_round_trips_an_export(self):
+        make_listing(self.host, amenities=['WiFi', 'Pool'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'listings.csv')
+            call_command('export_data', 'listings', '--output', path,
+                         stdout=StringIO())
+            out = StringIO()
+            call_command('import_listings', path, stdout=out)
+        self.assertIn('Created 1 listings, 0 rows rejected', out.getvalue())
+        copy = Listing.objects.order_by('id').last()
+        self.assertEqual(copy.amenities, ['WiFi', 'Pool'])
+        self.assertEqual(copy.host, self.host)
+
+    def test_command_reports_bad_ndjson_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'listings.ndjson.gz')
+            with gzip.open(path, 'wt') as output:
+                output.write(json.dumps(self.row()) + '\n')
+                output.write('{broken\n')
+                output.write(json.dumps(self.row(title='')) + '\n')
+            out, err = StringIO(), StringIO()
+            call_command('import_listings', path, stdout=out, stderr=err)
+        self.assertIn('Created 1 listings, 2 rows rejected', out.getvalue())
+        self.assertIn('row 2:', err.getvalue())
+        self.assertIn('row 3:', err.getvalue())
+
+
+class ListingSearchTests(TestCase):
+    """Full-text search is ranked, prefix-matched and kept in sync."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.condo = make_listing(
+            self.host, title='Beachfront Condo', location='San Diego, CA',
+            description='Wake up to ocean views.')
+        self.cabin = make_listing(
+            self.host, title='Mountain Cabin', location='Denver, CO',
+            description='A short drive from the beach lake.')
+        self.loft = make_listing(
+            self.host, title='City Loft', location='Chicago, IL',
+            description='Exposed brick and high ceilings.')
+
+    def search(self, **params):
+        response = self.client.get('/api/listings/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(
+            self.search(q='beach'), [self.condo.id, self.cabin.id])
+
+    def test_prefix_and_all_terms(self):
+        self.assertEqual(self.search(q='chic'), [self.loft.id])
+        self.assertEqual(self.search(q='beach denv'), [self.cabin.id])
+        self.assertEqual(self.search(q='beach chicago'), [])
+
+    def test_query_syntax_is_literal(self):
+        self.assertEqual(self.search(q='"brick" OR (NEAR'), [])
+        self.assertEqual(self.search(q='brick*'), [self.loft.id])
+
+    def test_uses_the_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(q='condo')
+        self.assertIn(' MATCH ', queries[-1]['sql'])
+        self.assertNotIn('LIKE', queries[-1]['sql'])
+
+    def test_filters_apply(self):
+        self.assertEqual(
+            self.search(q='beach', location='Denver, CO'), [self.cabin.id])
+
+    def test_query_is_required(self):
+        response = self.client.get('/api/listings/search/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages(self):
+        response = self.client.get(
+            '/api/listings/search/', {'q': 'beach', 'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [row['id'] for row in response.data['results']], [self.cabin.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(self.search(q='loft'), [self.loft.id])
+        self.loft.title = 'City Studio'
+        self.loft.save()
+        self.assertEqual(self.search(q='loft'), [])
+        self.assertEqual(self.search(q='studio'), [self.loft.id])
+        self.condo.delete()
+        self.assertEqual(self.search(q='beach'), [self.cabin.id])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM listings_listing_fts')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_bulk_imports_are_indexed(self):
+        self.client.post('/api/listings/bulk/', [{
+            'title': 'Lakeside Chalet', 'description': 'Quiet',
+            'location': 'Tahoe', 'price_per_night': '90',
+            'property_type': 'cabin', 'max_guests': 2,
+            'host_id': self.host.id,
+        }], format='json')
+        self.assertEqual(len(self.search(q='chalet')), 1)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM listings_listing_fts')
+        call_command('rebuild_search_index', stdout=StringIO())
+        cache.clear()
+        self.assertEqual(self.search(q='cabin'), [self.cabin.id])
+
+
+@override_settings(AMENITY_FILTER_DRIVE_LIMIT=1)
+class AmenityFilterTests(TestCase):
+    """Amenity filters go through the normalized, indexed link table."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.villa = make_listing(
+            self.host, title='Villa', amenities=['WiFi', 'Pool', 'Parking'])
+        self.house = make_listing(
+            self.host, title='House', amenities=['wifi', 'Parking'])
+        self.loft = make_listing(
+            self.host, title='Loft', amenities=['WiFi', ' air  conditioning'])
+
+    def titles(self, amenities, **params):
+        response = self.client.get(
+            '/api/listings/', {'amenities': amenities, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(item['title'] for item in response.data['results'])
+
+    def counts(self):
+        return dict(Amenity.objects.values_list('key', 'listing_count'))
+
+    def test_all_amenities_must_match(self):
+        self.assertEqual(
+            self.titles('wifi'), ['House', 'Loft', 'Villa'])
+        self.assertEqual(self.titles('WiFi,parking'), ['House', 'Villa'])
+        self.assertEqual(self.titles('parking,pool,wifi'), ['Villa'])
+        self.assertEqual(self.titles('Air Conditioning'), ['Loft'])
+        self.assertEqual(self.titles('pool,sauna'), [])
+        self.assertEqual(
+            self.titles('parking', location='Nowhere'), [])
+
+    def test_uses_the_link_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.titles('wifi,pool')
+        sql = queries[-1]['sql']
+        self.assertIn('listings_listingamenity', sql)
+        self.assertNotIn('amenities', sql.split('WHERE')[1])
+
+    def test_links_follow_saves_and_deletes(self):
+        self.assertEqual(
+            self.counts(),
+            {'wifi': 3, 'pool': 1, 'parking': 2, 'air conditioning': 1})
+        self.house.amenities = ['Pool']
+        self.house.save()
+        self.assertEqual(self.titles('pool'), ['House', 'Villa'])
+        self.assertEqual(self.titles('parking'), ['Villa'])
+        self.villa.delete()
+        self.assertEqual(
+            self.counts(),
+            {'wifi': 1, 'pool': 1, 'parking': 0, 'air conditioning': 1})
+        self.assertEqual(ListingAmenity.objects.count(), 3)
+
+    def test_bulk_imports_are_linked(self):
+        self.client.post('/api/listings/bulk/', [{
+            'title': 'Chalet', 'description': 'Quiet', 'location': 'Tahoe',
+            'price_per_night': '90', 'property_type': 'cabin',
+            'max_guests': 2, 'amenities': ['Pool', 'Sauna'],
+            'host_id': self.host.id,
+        }], format='json')
+        self.assertEqual(self.titles('sauna,pool'), ['Chalet'])
+        self.assertEqual(self.counts()['pool'], 2)
+
+    def test_invalid_amenities(self):
+        response = self.client.get(
+            '/api/listings/', {'amenities': ','.join('abcdefghijk')})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/listings/', {
+            'title': 'Bad', 'description': 'x', 'location': 'y',
+            'price_per_night': '10', 'max_guests': 1,
+            'amenities': [1, 2], 'host_id': self.host.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ProximitySearchTests(TestCase):
+    """Radius and box searches read geohash cells, nearest first."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.midtown = make_listing(
+            self.host, title='Midtown', latitude=40.758, longitude=-73.9855)
+        self.brooklyn = make_listing(
+            self.host, title='Brooklyn', latitude=40.6782, longitude=-73.9442,
+            property_type='house')
+        self.newark = make_listing(
+            self.host, title='Newark', latitude=40.7357, longitude=-74.1724)
+        self.london = make_listing(
+            self.host, title='London', latitude=51.5074, longitude=-0.1278)
+        self.unplaced = make_listing(self.host, title='Unplaced')
+
+    def nearby(self, **params):
+        response = self.client.get('/api/listings/nearby/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(row['title'], row['distance'])
+                for row in response.data['results']]
+
+    def test_radius_search_is_sorted_by_distance(self):
+        rows = self.nearby(lat=40.758, lng=-73.9855, radius=12)
+        self.assertEqual(
+            [title for title, _ in rows], ['Midtown', 'Brooklyn'])
+        self.assertEqual(rows[0][1], 0)
+        self.assertAlmostEqual(rows[1][1], 9.55, delta=0.1)
+        self.assertEqual(
+            [title for title, _ in self.nearby(
+                lat=40.758, lng=-73.9855, radius=25)],
+            ['Midtown', 'Brooklyn', 'Newark'])
+
+    def test_default_radius_and_filters(self):
+        self.assertEqual(
+            [title for title, _ in self.nearby(lat=40.68, lng=-73.95)],
+            ['Brooklyn', 'Midtown'])
+        self.assertEqual(
+            [title for title, _ in self.nearby(
+                lat=40.68, lng=-73.95, property_type='house')],
+            ['Brooklyn'])
+
+    def test_box_search(self):
+        rows = self.nearby(bbox='-74.3,40.7,-73.9,40.8')
+        self.assertEqual(
+            sorted(title for title, _ in rows), ['Midtown', 'Newark'])
+        rows = self.nearby(bbox='-74.3,40.6,-73.9,40.8', lat=40.68, lng=-73.95)
+        self.assertEqual(
+            [title for title, _ in rows], ['Brooklyn', 'Midtown', 'Newark'])
+
+    def test_crosses_the_antimeridian(self):
+        east = make_listing(
+            self.host, title='East', latitude=-17.8, longitude=179.95)
+        west = make_listing(
+            self.host, title='West', latitude=-17.8, longitude=-179.95)
+        self.assertEqual(
+            [title for title, _ in self.nearby(
+                lat=-17.8, lng=179.99, radius=20)],
+            [east.title, west.title])
+
+    def test_high_latitudes(self):
+        # 200 km around 88N spans every longitude without reaching the pole
+        self.assertEqual(bounding_box(88, -179.5, 200)[1::2], (-180, 180))
+        across = make_listing(
+            self.host, title='Across', latitude=88.5, longitude=179.5)
+        make_listing(
+            self.host, title='Far side', latitude=88, longitude=0)
+        rows = self.nearby(lat=88, lng=-179.5, radius=200)
+        self.assertEqual([title for title, _ in rows], [across.title])
+        self.assertLess(rows[0][1], 60)
+
+    def test_uses_the_geohash_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.nearby(lat=40.758, lng=-73.9855, radius=5)
+        self.assertIn('"geohash" >=', queries[-1]['sql'])
+
+    def test_geohash_follows_coordinates(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertTrue(self.midtown.geohash.startswith('dr5ru'))
+        self.assertEqual(self.unplaced.geohash, '')
+        self.midtown.latitude, self.midtown.longitude = 51.5, -0.12
+        self.midtown.save(update_fields=['latitude', 'longitude'])
+        self.midtown.refresh_from_db()
+        self.assertTrue(self.midtown.geohash.startswith('gcpuv'))
+
+    def test_invalid_parameters(self):
+        for params in ({}, {'lat': 40}, {'lat': 40, 'lng': 0, 'radius': 500},
+                       {'bbox': '1,2,3'}, {'bbox': '10,0,0,10'},
+                       {'bbox': '-20,0,20,10'}):
+            response = self.client.get('/api/listings/nearby/', params)
+            self.assertEqual(response.status_code, 400, params)
+        response = self.client.patch(
+            f'/api/listings/{self.unplaced.id}/', {'latitude': 10},
+            format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_command(self):
+        Listing.objects.filter(pk=self.midtown.pk).update(geohash='')
+        Listing.objects.filter(pk=self.london.pk).update(
+            latitude=None, longitude=None)
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', delete=False) as handle:
+            handle.write('id,latitude,longitude\n'
+                         f'{self.unplaced.id},48.8566,2.3522\n'
+                         f'{self.newark.id},north,west\n')
+        self.addCleanup(os.remove, handle.name)
+        stderr = StringIO()
+        call_command('backfill_geo', coordinates=handle.name,
+                     stdout=StringIO(), stderr=stderr)
+        self.assertIn('Line 3', stderr.getvalue())
+        geohashes = dict(Listing.objects.values_list('title', 'geohash'))
+        self.assertTrue(geohashes['Midtown'].startswith('dr5ru'))
+        self.assertTrue(geohashes['Unplaced'].startswith('u09t'))
+        self.assertEqual(geohashes['London'], '')
+        self.assertEqual(
+            [title for title, _ in self.nearby(lat=48.85, lng=2.35)],
+            ['Unplaced'])
+
+
+class PriceQuoteTests(TestCase):
+    """Stays are priced from cached per-listing rate calendars."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(username='guest', password='x')
+        self.listing = make_listing(self.host)
+        self.other = make_listing(self.host, price_per_night=Decimal('80'))
+        year = date.today().year + 1
+        RateRule.objects.create(
+            listing=self.listing, name='Weekend',
+            weekdays=RateRule.WEEKEND, price_per_night=Decimal('150'))
+        RateRule.objects.create(
+            listing=self.listing, name='Summer', priority=1,
+            start_date=date(year, 7, 1), end_date=date(year, 8, 31),
+            price_per_night=Decimal('200.50'), min_nights=3)
+        # a Monday in March and one in July of next year
+        march = date(year, 3, 1)
+        self.monday = march + timedelta(days=-march.weekday() % 7)
+        july = date(year, 7, 1)
+        self.summer_monday = july + timedelta(days=-july.weekday() % 7)
+
+    def quote(self, listing, check_in, nights):
+        return quote_stays(
+            [(listing.id, check_in, check_in + timedelta(days=nights))])[0]
+
+    def test_weekday_and_seasonal_rates(self):
+        self.assertEqual(
+            self.quote(self.listing, self.monday, 4)['total_price'],
+            Decimal('400'))
+        # Thursday to Monday: two weekend nights
+        self.assertEqual(
+            self.quote(self.listing, self.monday + timedelta(days=3), 4)
+            ['total_price'], Decimal('500'))
+        # the seasonal rule outranks the weekend one
+        self.assertEqual(
+            self.quote(self.listing, self.summer_monday, 7)['total_price'],
+            Decimal('1403.50'))
+        self.assertEqual(
+            self.quote(self.other, self.monday, 7)['total_price'],
+            Decimal('560'))
+
+    def test_minimum_stay(self):
+        quote = self.quote(self.listing, self.summer_monday, 2)
+        self.assertEqual(quote['min_nights'], 3)
+        self.assertIn('error', quote)
+        self.assertNotIn('error', self.quote(self.listing, self.monday, 1))
+
+    def test_outside_the_calendar_window(self):
+        far = self.monday.replace(year=self.monday.year + 10)
+        far += timedelta(days=-far.weekday() % 7)
+        self.assertEqual(
+            self.quote(self.listing, far + timedelta(days=3), 4)
+            ['total_price'], Decimal('500'))
+
+    def test_batch_costs_one_query_then_none(self):
+        stays = [
+            (listing_id, self.monday, self.monday + timedelta(days=n))
+            for n in range(1, 8) for listing_id in (
+                self.listing.id, self.other.id, 999999)
+        ]
+        with self.assertNumQueries(1):
+            quotes = quote_stays(stays)
+        with self.assertNumQueries(0):
+            self.assertEqual(quote_stays(stays), quotes)
+        self.assertEqual(quotes[2]['error'], 'Listing not found.')
+
+    def test_rule_changes_reprice(self):
+        self.quote(self.listing, self.monday, 1)
+        RateRule.objects.create(
+            listing=self.listing, priority=5, price_per_night=Decimal('90'))
+        self.assertEqual(
+            self.quote(self.listing, self.monday, 1)['total_price'],
+            Decimal('90'))
+        self.listing.rate_rules.all().delete()
+        self.listing.price_per_night = Decimal('120')
+        self.listing.save()
+        self.assertEqual(
+            self.quote(self.listing, self.monday, 1)['total_price'],
+            Decimal('120'))
+
+    def test_quote_endpoints(self):
+        response = self.client.get(
+            f'/api/listings/{self.listing.id}/quote/',
+            {'check_in': self.monday + timedelta(days=4),
+             'check_out': self.monday + timedelta(days=6)})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['total_price'], '300.00')
+        self.assertEqual(
+            [night['price'] for night in response.data['nightly_prices']],
+            ['150.00', '150.00'])
+        response = self.client.get(
+            '/api/listings/999999/quote/',
+            {'check_in': self.monday, 'check_out': self.summer_monday})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post('/api/listings/quotes/', [
+            {'listing_id': self.listing.id, 'check_in': self.monday,
+             'check_out': self.monday + timedelta(days=2)},
+            {'listing_id': self.other.id, 'check_in': self.monday,
+             'check_out': self.monday + timedelta(days=2)},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [quote['total_price'] for quote in response.data],
+            ['200.00', '160.00'])
+        response = self.client.post('/api/listings/quotes/', [
+            {'listing_id': 999999, 'check_in': self.monday,
+             'check_out': self.monday + timedelta(days=2)}], format='json')
+        self.assertEqual(response.data[0]['error'], 'Listing not found.')
+        self.assertNotIn('total_price', response.data[0])
+        response = self.client.post('/api/listings/quotes/', [
+            {'listing_id': self.listing.id, 'check_in': self.monday,
+             'check_out': self.monday}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bookings_are_priced_by_the_rules(self):
+        payload = {
+            'listing_id': self.listing.id, 'user_id': self.guest.id,
+            'check_in_date': self.monday + timedelta(days=3),
+            'check_out_date': self.monday + timedelta(days=7), 'guests': 2,
+        }
+        response = self.client.post('/api/bookings/', payload)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('500'))
+        payload.update(check_in_date=self.summer_monday,
+                       check_out_date=self.summer_monday + timedelta(days=2))
+        response = self.client.post('/api/bookings/', payload)
+        self.assertEqual(response.status_code, 400)
+        booking = Booking.objects.create(
+            listing_id=self.other.id, user=self.guest, guests=1,
+            check_in_date=self.monday,
+            check_out_date=self.monday + timedelta(days=2))
+        self.assertEqual(booking.total_price, Decimal('160'))
+
+    def test_bookings_without_a_calendar(self):
+        stay = {'user': self.guest, 'guests': 1, 'check_in_date': self.monday,
+                'check_out_date': self.monday + timedelta(days=2)}
+        with mock.patch('listings.pricing.get_calendars', return_value={}):
+            booking = Booking.objects.create(listing_id=self.other.id, **stay)
+            self.assertEqual(booking.total_price, Decimal('160'))
+            with self.assertRaises(ValidationError):
+                Booking.objects.create(listing_id=999999, **stay)
+
+    def test_rate_rule_api(self):
+        response = self.client.post('/api/rate-rules/', {
+            'listing_id': self.other.id, 'weekdays': [6, 7],
+            'price_per_night': '95.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['weekdays'], [6, 7])
+        self.assertEqual(
+            RateRule.objects.get(id=response.data['id']).weekdays, 0b1100000)
+        response = self.client.get(
+            '/api/rate-rules/', {'listing_id': self.other.id})
+        self.assertEqual(len(response.data['results']), 1)
+        for payload in ({'listing_id': self.other.id, 'weekdays': [0],
+                         'price_per_night': '10'},
+                        {'listing_id': self.other.id},
+                        {'listing_id': self.other.id, 'min_nights': 2,
+                         'start_date': '2030-02-01',
+                         'end_date': '2030-01-01'},
+                        {'listing_id': self.other.id,
+                         'min_nights': 70000}):
+            response = self.client.post(
+                '/api/rate-rules/', payload, format='json')
+            self.assertEqual(response.status_code, 400, payload)
+
+
+class OccupancyCalendarTests(TestCase):
+    """Booked nights are kept as per-year bitmaps, updated on save."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(username='guest', password='x')
+        self.listing = make_listing(self.host)
+        self.other = make_listing(self.host, title='Other')
+        # straddles the new year
+        self.start = date(date.today().year, 12, 20)
+
+    def book(self, listing, offset, nights, status='confirmed'):
+        check_in = self.start + timedelta(days=offset)
+        return Booking.objects.create(
+            listing=listing, user=self.guest, check_in_date=check_in,
+            check_out_date=check_in + timedelta(days=nights), guests=1,
+            status=status)
+
+    def nights(self, listing, days=30):
+        return booked_nights(
+            listing.id, self.start, self.start + timedelta(days=days))
+
+    def expected(self, *stays, days=30):
+        nights = ['0'] * days
+        for offset, count in stays:
+            nights[offset:offset + count] = '1' * count
+        return ''.join(nights)
+
+    def test_bookings_mark_their_nights(self):
+        self.book(self.listing, 2, 3)
+        self.book(self.listing, 9, 5, status='pending')
+        self.book(self.listing, 20, 2, status='cancelled')
+        self.assertEqual(
+            self.nights(self.listing), self.expected((2, 3), (9, 5)))
+        self.assertEqual(self.nights(self.other), self.expected())
+        self.assertEqual(ListingOccupancy.objects.count(), 2)
+
+    def test_status_and_date_changes(self):
+        booking = self.book(self.listing, 2, 3, status='pending')
+        overlapping = self.book(self.listing, 4, 2)
+        with self.assertNumQueries(2):
+            # pending -> confirmed holds the same nights: only the save and
+            # the lookup for the guest's (here empty) email address
+            booking.status = 'confirmed'
+            booking.save()
+        booking.status = 'cancelled'
+        booking.save()
+        # the overlapping booking keeps its nights
+        self.assertEqual(self.nights(self.listing), self.expected((4, 2)))
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.status = 'confirmed'
+        booking.check_in_date += timedelta(days=10)
+        booking.check_out_date += timedelta(days=10)
+        booking.listing = self.other
+        booking.save()
+        self.assertEqual(self.nights(self.listing), self.expected((4, 2)))
+        self.assertEqual(self.nights(self.other), self.expected((12, 3)))
+        Booking.objects.get(pk=overlapping.pk).delete()
+        self.assertEqual(self.nights(self.listing), self.expected())
+
+    def test_listing_delete_skips_per_booking_refresh(self):
+        third = make_listing(self.host, title='Third')
+        self.book(self.listing, 0, 1)
+        for offset in range(0, 40, 2):
+            self.book(self.other, offset, 1)
+        with CaptureQueriesContext(connection) as few:
+            Listing.objects.get(pk=self.listing.pk).delete()
+        with CaptureQueriesContext(connection) as many:
+            Listing.objects.filter(pk=self.other.pk).delete()
+        self.assertEqual(len(many), len(few))
+        self.assertFalse(ListingOccupancy.objects.exists())
+
+        # bookings going with their guest still free their nights
+        self.book(third, 2, 3)
+        self.guest.delete()
+        self.assertEqual(self.nights(third), self.expected())
+
+    def test_rebuild_matches_signals(self):
+        self.book(self.listing, 2, 3)
+        self.book(self.listing, 8, 400)
+        self.book(self.other, 0, 1, status='pending')
+        expected = {
+            listing.id: self.nights(listing, days=500)
+            for listing in (self.listing, self.other)
+        }
+        ListingOccupancy.objects.all().delete()
+        self.assertEqual(rebuild_occupancy(Listing.objects.all(), 1), 4)
+        for listing_id, nights in expected.items():
+            self.assertEqual(booked_nights(
+                listing_id, self.start, self.start + timedelta(days=500)),
+                nights)
+
+    def test_calendar_endpoint(self):
+        self.book(self.listing, 2, 3)
+        self.book(self.listing, 5, 1)
+        url = f'/api/listings/{self.listing.id}/calendar/'
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {
+                'start': self.start,
+                'end': self.start + timedelta(days=30)})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['nights'], self.expected((2, 4)))
+        self.assertEqual(response.data['booked'], [{
+            'start': self.start + timedelta(days=2),
+            'end': self.start + timedelta(days=6)}])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['nights']), 365)
+        self.assertEqual(response.data['start'], date.today())
+        for params in ({'start': self.start, 'end': self.start},
+                       {'start': self.start,
+                        'end': self.start + timedelta(days=800)}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        response = self.client.get('/api/listings/999999/calendar/')
+        self.assertEqual(response.status_code, 404)
+
+
+class BookingLifecycleTests(TestCase):
+    """Stale Pending bookings expire and past stays complete in bulk."""
+
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(username='guest', password='x')
+        self.guest.email = 'guest@example.com'
+        self.guest.save()
+        self.listing = make_listing(self.host)
+        self.today = timezone.localdate()
+
+    def book(self, offset, nights, status, age=0):
+        check_in = self.today + timedelta(days=offset)
+        booking = Booking.objects.create(
+            listing=self.listing, user=self.guest, guests=1,
+            check_in_date=check_in,
+            check_out_date=check_in + timedelta(days=nights), status=status)
+        Booking.objects.filter(pk=booking.pk).update(
+            created_at=timezone.now() - timedelta(seconds=age))
+        return booking
+
+    def status(self, booking):
+        return Booking.objects.get(pk=booking.pk).status
+
+    def test_transitions(self):
+        stale = self.book(10, 2, 'pending', age=2 * 86400)
+        arriving = self.book(0, 2, 'pending')
+        paying = self.book(-1, 2, 'pending')
+        Payment.objects.create(
+            booking=paying, booking_reference=str(paying.pk),
+            amount=Decimal('200'), transaction_id='ref-1', status='Pending')
+        paid = self.book(4, 1, 'pending', age=2 * 86400)
+        Payment.objects.create(
+            booking=paid, booking_reference=str(paid.pk),
+            amount=Decimal('100'), transaction_id='ref-2', status='Completed')
+        fresh = self.book(10, 2, 'pending')
+        past = [self.book(-10 - 3 * n, 2, 'confirmed') for n in range(5)]
+        ending = self.book(-2, 2, 'confirmed')
+        staying = self.book(-1, 3, 'confirmed')
+
+        totals = update_booking_statuses(batch_size=2)
+        self.assertEqual(
+            (totals['expired'], totals['completed']), (2, 6))
+        self.assertGreaterEqual(totals['seconds'], 0)
+        for booking, status in (
+                (stale, 'cancelled'), (arriving, 'cancelled'),
+                (paying, 'pending'), (paid, 'pending'), (fresh, 'pending'),
+                (ending, 'completed'), (staying, 'confirmed'),
+                *((booking, 'completed') for booking in past)):
+            self.assertEqual(self.status(booking), status, booking)
+        # the expired bookings no longer hold their nights
+        nights = booked_nights(
+            self.listing.id, self.today, self.today + timedelta(days=14))
+        self.assertEqual(nights, '1100100000' + '11' + '0' * 2)
+        # completed stays keep theirs
+        self.assertEqual(booked_nights(
+            self.listing.id, self.today - timedelta(days=2), self.today),
+            '11')
+
+        totals = update_booking_statuses()
+        self.assertEqual((totals['expired'], totals['completed']), (0, 0))
+        # the guests of expired bookings are told
+        self.assertEqual(
+            list(OutgoingEmail.objects.values_list('kind', flat=True)),
+            ['booking_cancelled'] * 2)
+
+    def test_overlapping_runs_are_skipped(self):
+        self.book(-5, 2, 'confirmed')
+        lease = acquire_lock(LIFECYCLE_JOB, 60)
+        self.assertIsNone(update_booking_statuses())
+        with self.assertRaises(CommandError):
+            call_command('update_booking_statuses', stdout=StringIO())
+        lease.release()
+        out = StringIO()
+        call_command('update_booking_statuses', stdout=out)
+        self.assertIn('completed 1 bookings', out.getvalue())
+
+    def test_completed_stays_can_be_reviewed(self):
+        booking = self.book(-4, 2, 'confirmed')
+        review = Review(listing=self.listing, user=self.guest, rating=5)
+        with self.assertRaises(ValidationError):
+            review.clean()
+        update_booking_statuses()
+        self.assertEqual(self.status(booking), 'completed')
+        review.clean()
+
+
+class EmailOutboxTests(EagerCeleryMixin, TestCase):
+    """Notifications are queued, then sent in paced batches."""
+
+    def setUp(self):
+        super().setUp()
+        host = User.objects.create_user(username='host', password='x')
+        self.guest = User.objects.create_user(
+            username='guest', password='x', first_name='Ada',
+            email='guest@example.com')
+        self.listing = make_listing(host, title='Seaside Loft')
+
+    def queue(self, count, recipient='guest{}@example.com'):
+        queue_emails('payment_confirmed', [
+            (recipient.format(n), {'booking_reference': f'BK-{n}'})
+            for n in range(count)
+        ])
+
+    def test_status_changes_notify_the_guest(self):
+        booking = Booking.objects.create(
+            listing=self.listing, user=self.guest, guests=1,
+            check_in_date=date.today() + timedelta(days=3),
+            check_out_date=date.today() + timedelta(days=5))
+        self.assertFalse(OutgoingEmail.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'confirmed'
+            booking.save()
+            booking.guests = 2
+            booking.save()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            mail.outbox[0].subject, 'Your booking at Seaside Loft is confirmed')
+        self.assertIn('Hi Ada', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].to, ['guest@example.com'])
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'cancelled'
+            booking.save()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('was cancelled', mail.outbox[1].body)
+        self.assertFalse(
+            OutgoingEmail.objects.filter(sent_at__isnull=True).exists())
+
+    def test_plain_text_is_not_html_escaped(self):
+        self.listing.title = "Bed & Breakfast <Tom's>"
+        self.listing.save()
+        booking = Booking.objects.create(
+            listing=self.listing, user=self.guest, guests=1,
+            status='confirmed', check_in_date=date.today() + timedelta(days=3),
+            check_out_date=date.today() + timedelta(days=5))
+        subject, body = render_email('booking_confirmed', {'booking': booking})
+        self.assertEqual(
+            subject, "Your booking at Bed & Breakfast <Tom's> is confirmed")
+        self.assertIn("at Bed & Breakfast <Tom's> (", body)
+
+    def test_paid_bookings_are_confirmed_with_a_notification(self):
+        booking = Booking.objects.create(
+            listing=self.listing, user=self.guest, guests=1,
+            check_in_date=date.today() + timedelta(days=3),
+            check_out_date=date.today() + timedelta(days=5))
+        Payment.objects.create(
+            booking=booking, booking_reference='BK-1', amount=Decimal('200'),
+            transaction_id='ref-1', status='Pending')
+        with self.captureOnCommitCallbacks(execute=True), \
+                transaction.atomic():
+            apply_payment_outcomes(
+                {'ref-1': ('Completed', 'payer@example.com')})
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'confirmed')
+        self.assertEqual(
+            sorted((message.to[0], message.subject)
+                   for message in mail.outbox),
+            [('guest@example.com',
+              'Your booking at Seaside Loft is confirmed'),
+             ('payer@example.com', 'Payment confirmation')])
+
+    def test_overlapping_flushes_are_skipped(self):
+        self.queue(1)
+        lease = acquire_lock(EMAIL_FLUSH_JOB, 60)
+        self.assertIsNone(flush_emails())
+        lease.release()
+        self.assertEqual(flush_emails()['sent'], 1)
+
+    def test_batches_share_one_paced_connection(self):
+        self.queue(25)
+        with mock.patch('listings.tasks.get_connection',
+                        wraps=get_connection) as connect, \
+                mock.patch('listings.tasks.time.sleep') as sleep:
+            totals = send_queued_emails(
+                batch_size=10, rate_limit=10, duration=2)
+        self.assertEqual(connect.call_count, 1)
+        # two seconds at ten per second: two batches, the rest waits
+        self.assertEqual(totals, {'sent': 20, 'failed': 0, 'remaining': 5})
+        self.assertEqual(len(mail.outbox), 20)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertAlmostEqual(
+            sum(call.args[0] for call in sleep.call_args_list), 2, delta=0.2)
+        self.assertEqual(
+            [message.to for message in mail.outbox[:2]],
+            [['guest0@example.com'], ['guest1@example.com']])
+
+    def test_flush_hands_the_backlog_to_the_next_run(self):
+        self.queue(5)
+        with override_settings(EMAIL_OUTBOX_RATE_LIMIT=2,
+                               EMAIL_OUTBOX_FLUSH_INTERVAL=1), \
+                mock.patch('listings.tasks.time.sleep'):
+            totals = flush_emails.delay().get()
+        # the eager follow-up runs sent the rest
+        self.assertEqual(totals['sent'], 2)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_refused_recipients_are_retried_then_dropped(self):
+        self.queue(3)
+        self.queue(1, recipient='bounce@example.com')
+        deliver = mail.backends.locmem.EmailBackend.send_messages
+
+        def refuse(backend, messages):
+            if messages[0].to == ['bounce@example.com']:
+                raise smtplib.SMTPRecipientsRefused({})
+            return deliver(backend, messages)
+
+        with mock.patch.object(mail.backends.locmem.EmailBackend,
+                               'send_messages', refuse):
+            totals = send_queued_emails()
+            self.assertEqual(
+                totals, {'sent': 3, 'failed': 1, 'remaining': 1})
+            for _ in range(4):
+                totals = send_queued_emails()
+        self.assertEqual(totals, {'sent': 0, 'failed': 1, 'remaining': 0})
+        self.assertEqual(
+            OutgoingEmail.objects.get(recipient='bounce@example.com')
+            .attempts, 5)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_unreachable_server_keeps_the_queue(self):
+        self.queue(2)
+        with mock.patch.object(mail.backends.locmem.EmailBackend,
+                               'send_messages',
+                               side_effect=smtplib.SMTPServerDisconnected()):
+            totals = send_queued_emails()
+        self.assertEqual(totals, {'sent': 0, 'failed': 0, 'remaining': 2})
+        self.assertFalse(OutgoingEmail.objects.filter(attempts__gt=0).exists())
+
+
+@override_settings(PERF_SAMPLE_RATE=1)
+class PerformanceMiddlewareTests(TestCase):
+    """Sampled requests report their timings and feed the histograms."""
+
+    def setUp(self):
+        reset_metrics()
+        self.addCleanup(reset_metrics)
+        self.client = APIClient()
+        self.host = User.objects.create_user(username='host', password='x')
+        self.staff = User.objects.create_user(
+            username='ops', password='x', is_staff=True)
+        for n in range(3):
+            make_listing(self.host, title=f'Listing {n}')
+
+    def metrics(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/metrics/')
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/listings/')
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertRegex(
+            timing, r'^app;dur=[0-9.]+, db;dur=[0-9.]+;desc="(\d+) queries", '
+                    r'serialize;dur=[0-9.]+$')
+        queries = int(re.search(r'"(\d+) queries"', timing)[1])
+        self.assertGreaterEqual(queries, 1)
+        serialize = float(re.search(r'serialize;dur=([0-9.]+)', timing)[1])
+        self.assertGreater(serialize, 0)
+
+    def test_server_timing_is_not_shown_to_everyone(self):
+        response = self.client.get('/api/listings/')
+        self.assertNotIn('Server-Timing', response)
+        self.client.force_authenticate(self.host)
+        self.assertNotIn('Server-Timing', self.client.get('/api/listings/'))
+        self.client.force_authenticate(None)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            response = self.client.get(
+                '/api/listings/', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertIn('Server-Timing', response)
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get('/api/listings/'))
+        # every sampled request is still counted
+        self.assertIn(
+            'http_request_duration_seconds_count{view="listing-list",'
+            'method="GET"} 4', self.metrics())
+
+    def test_histograms_per_view(self):
+        for _ in range(2):
+            self.client.get('/api/listings/')
+        self.client.get('/api/no-such-page/')
+        text = self.metrics()
+        labels = 'view="listing-list",method="GET"'
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2',
+                      text)
+        self.assertIn(f'http_request_db_queries_count{{{labels}}} 2', text)
+        self.assertIn(
+            f'http_request_serializer_duration_seconds_count{{{labels}}} 2',
+            text)
+        self.assertIn(f'http_response_size_bytes_count{{{labels}}} 2', text)
+        self.assertIn('view="unresolved",method="GET"', text)
+
+    def test_buckets_are_cumulative(self):
+        for _ in range(3):
+            self.client.get('/api/listings/')
+        text = self.metrics()
+        counts = [
+            int(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+            if line.startswith('http_request_db_queries_bucket{'
+                               'view="listing-list"')
+        ]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[-1], 3)
+        self.assertIn(
+            'http_request_db_queries_bucket{view="listing-list",'
+            'method="GET",le="+Inf"} 3', text)
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_timed(self):
+        response = self.client.get('/api/listings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('listing-list', self.metrics())
+
+    def test_metrics_require_staff_without_token(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 403)
+        self.client.force_authenticate(self.host)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_bearer_token(self):
+        response = self.client.get(
+            '/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            '/api/metrics/', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds', response.content.decode())
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ListingViewSet, BookingViewSet
+from .views import ListingViewSet, BookingViewSet, RateRuleViewSet
 from .views import InitiatePaymentView, VerifyPaymentView
+from .views import ChapaWebhookView, ExportView, MetricsView
 
 router = DefaultRouter()
 router.register(r'listings', ListingViewSet)
 router.register(r'bookings', BookingViewSet)
+router.register(r'rate-rules', RateRuleViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -15,4 +17,11 @@ urlpatterns = [
     path(
         'verify-payment/',
         VerifyPaymentView.as_view(), name='verify-payment'),
+    path(
+        'chapa-webhook/',
+        ChapaWebhookView.as_view(), name='chapa-webhook'),
+    path(
+        'export/<slug:kind>.<slug:fmt>',
+        ExportView.as_view(), name='export'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
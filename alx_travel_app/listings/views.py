@@ -1,21 +1,251 @@
-from django.shortcuts import render
-import requests
+import hashlib
+import hmac
+import json
 from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, viewsets
-from .models import Listing, Booking
-from .models import Payment
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.permissions import IsAdminUser
+from .models import Listing, Booking, RateRule
+from .models import Payment, PaymentEvent
 from .serializers import ListingSerializer, BookingSerializer
+from .serializers import ListingListSerializer
+from .serializers import AvailabilitySearchSerializer
+from .serializers import ListingSearchSerializer
+from .serializers import ListingNearbySerializer, NearbySearchSerializer
+from .serializers import QuoteSerializer, RateRuleSerializer
+from .serializers import QuoteResultSerializer, StayQuoteSerializer
+from .serializers import CalendarSerializer
+from .filters import ListingFilterBackend
+from .pagination import SearchPagination
+from .cache import cached_response, listing_scope
+from .export import EXPORTS, FORMATS, export_filename, stream_export
+from .gateway import ChapaError, get_client
+from .geo import near
+from .imports import import_listings
+from .metrics import CONTENT_TYPE, has_metrics_token, render_metrics
+from .occupancy import booked_nights, booked_ranges
+from .pricing import quote_stays
+from .search import get_search_backend
+from .tasks import enqueue_payment_verification
+from .tasks import schedule_payment_event_processing
 
 
 class ListingViewSet(viewsets.ModelViewSet):
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
+    filter_backends = [ListingFilterBackend, OrderingFilter]
+    # each of these is indexed, so keyset pages stay index range scans
+    ordering_fields = ['created_at', 'price_per_night', 'rating_avg']
+    ordering = '-created_at'
+
+    def get_requested_fields(self):
+        """Projection from ?fields=a,b on reads, None for all fields"""
+        fields = self.request.query_params.get('fields')
+        if self.request.method != 'GET' or not fields:
+            return None
+        return [name for name in fields.split(',') if name]
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'available', 'search'):
+            return ListingListSerializer
+        if self.action == 'nearby':
+            return ListingNearbySerializer
+        return ListingSerializer
+
+    def get_serialized_fields(self):
+        requested = self.get_requested_fields()
+        if requested is not None:
+            return requested
+        return self.get_serializer_class().Meta.fields
+
+    def get_queryset(self):
+        # relations the serializer renders are loaded up front, so a page
+        # costs a fixed number of queries; everything else is skipped
+        return super().get_queryset().for_api(self.get_serialized_fields())
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request, 'list', ['collection'],
+            lambda: self.render_collection(
+                self.filter_queryset(self.get_queryset())))
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            instance = self.get_object()
+            return self.get_serializer(instance).data, instance.updated_at
+
+        try:
+            pk = Listing._meta.pk.get_prep_value(kwargs[self.lookup_field])
+        except (TypeError, ValueError):
+            raise NotFound()
+        return cached_response(
+            request, 'retrieve', [listing_scope(pk)], build)
+
+    @action(detail=False, methods=['get'])
+    def available(self, request):
+        """Listings free for ?check_in=&check_out=[&guests=]"""
+        def build():
+            params = AvailabilitySearchSerializer(data=request.query_params)
+            params.is_valid(raise_exception=True)
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.render_collection(queryset.available_between(
+                params.validated_data['check_in'],
+                params.validated_data['check_out'],
+                params.validated_data['guests'],
+            ))
+
+        return cached_response(
+            request, 'available', ['collection', 'availability'], build)
+
+    @action(detail=False, methods=['get'],
+            filter_backends=[ListingFilterBackend],
+            pagination_class=SearchPagination)
+    def search(self, request):
+        """Full-text search: ?q= matched against title, description and
+        location, most relevant first; the list filters still apply"""
+        def build():
+            params = ListingSearchSerializer(data=request.query_params)
+            params.is_valid(raise_exception=True)
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.render_collection(get_search_backend().search(
+                queryset, params.validated_data['q']))
+
+        return cached_response(request, 'search', ['collection'], build)
+
+    @action(detail=False, methods=['get'],
+            filter_backends=[ListingFilterBackend],
+            pagination_class=SearchPagination)
+    def nearby(self, request):
+        """Listings within ?radius= km (default 10) of ?lat=&lng=, and/or
+        inside ?bbox=, nearest first; the list filters still apply"""
+        def build():
+            params = NearbySearchSerializer(data=request.query_params)
+            params.is_valid(raise_exception=True)
+            data = params.validated_data
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.render_collection(near(
+                queryset, data['lat'], data['lng'],
+                radius=data.get('radius'), box=data.get('bbox')))
+
+        return cached_response(request, 'nearby', ['collection'], build)
+
+    @action(detail=True, methods=['get'])
+    def quote(self, request, pk=None):
+        """Price ?check_in=&check_out= night by night from the listing's
+        rate rules"""
+        params = QuoteSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        try:
+            listing_id = Listing._meta.pk.get_prep_value(pk)
+        except (TypeError, ValueError):
+            raise NotFound()
+        quote = quote_stays([(
+            listing_id, params.validated_data['check_in'],
+            params.validated_data['check_out'],
+        )], nightly=True)[0]
+        if quote.get('error') == 'Listing not found.':
+            raise NotFound()
+        return Response(QuoteResultSerializer(quote).data)
+
+    @action(detail=True, methods=['get'])
+    def calendar(self, request, pk=None):
+        """Booked nights between ?start= (default today) and ?end=
+        (default a year later), from the listing's occupancy bitmaps"""
+        params = CalendarSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        start = params.validated_data['start']
+        end = params.validated_data['end']
+        try:
+            listing_id = Listing._meta.pk.get_prep_value(pk)
+        except (TypeError, ValueError):
+            raise NotFound()
+        nights = booked_nights(listing_id, start, end)
+        if nights is None:
+            raise NotFound()
+        return Response({
+            'listing_id': listing_id,
+            'start': start,
+            'end': end,
+            'nights': nights,
+            'booked': booked_ranges(start, nights),
+        })
+
+    @action(detail=False, methods=['post'])
+    def quotes(self, request):
+        """Price up to QUOTE_MAX_STAYS stays, given as a JSON array of
+        {listing_id, check_in, check_out}, in one pass"""
+        if not isinstance(request.data, list):
+            return Response(
+                {"error": "Expected a list of stays"}, status=400)
+        if len(request.data) > settings.QUOTE_MAX_STAYS:
+            return Response({"error": (
+                f"At most {settings.QUOTE_MAX_STAYS} stays per request")},
+                status=400)
+        stays = StayQuoteSerializer(data=request.data, many=True)
+        stays.is_valid(raise_exception=True)
+        return Response(QuoteResultSerializer(quote_stays([
+            (stay['listing_id'], stay['check_in'], stay['check_out'])
+            for stay in stays.validated_data
+        ]), many=True).data)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Create up to LISTING_IMPORT_MAX_ROWS listings from a JSON array;
+        invalid rows are reported by index and the rest are created"""
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response(
+                {"error": "Expected a list of listings"}, status=400)
+        if len(rows) > settings.LISTING_IMPORT_MAX_ROWS:
+            return Response({"error": (
+                f"At most {settings.LISTING_IMPORT_MAX_ROWS} listings "
+                "per request")}, status=400)
+
+        result = import_listings(rows)
+        code = 201 if result['created'] or not rows else 400
+        return Response(result, status=code)
+
+    def render_collection(self, queryset):
+        """Serialized (optionally paginated) rows, without a Last-Modified:
+        deletions and rows leaving the result set do not show in the
+        newest updated_at, so collections are validated by ETag only"""
+        page = self.paginate_queryset(queryset)
+        rows = queryset if page is None else page
+        data = self.get_serializer(rows, many=True).data
+        if page is not None:
+            data = self.get_paginated_response(data).data
+        return data, None
+
+
+class RateRuleViewSet(viewsets.ModelViewSet):
+    """Nightly rate rules; ?listing_id= narrows them to one listing"""
+    queryset = RateRule.objects.all()
+    serializer_class = RateRuleSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        listing_id = self.request.query_params.get('listing_id')
+        if listing_id:
+            if not listing_id.isdecimal():
+                return queryset.none()
+            queryset = queryset.filter(listing_id=listing_id)
+        return queryset
 
 
 class BookingViewSet(viewsets.ModelViewSet):
-    queryset = Booking.objects.all()
+    queryset = Booking.objects.select_related('listing__host', 'user')
     serializer_class = BookingSerializer
 
 
@@ -25,11 +255,6 @@ class InitiatePaymentView(APIView):
         amount = request.data.get('amount')
         email = request.data.get('email')
 
-        chapa_url = 'https://api.chapa.co/v1/transaction/initialize'
-        headers = {
-            'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-            'Content-Type': 'application/json'
-        }
         payload = {
             "amount": amount,
             "currency": "ETB",
@@ -39,47 +264,121 @@ class InitiatePaymentView(APIView):
             "return_url": "http://yourdomain.com/payment-complete/"
         }
 
-        response = requests.post(chapa_url, json=payload, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json().get('data')
-            Payment.objects.create(
-                booking_reference=booking_ref,
-                amount=amount,
-                transaction_id=data['tx_ref'],
-                status="Pending"
-            )
-            return Response({"payment_url": data['checkout_url']}, status=200)
+        try:
+            data = get_client().initialize(payload)
+        except ChapaError:
+            return Response(
+                {"error": "Failed to initiate payment"}, status=500)
 
-        return Response({"error": "Failed to initiate payment"}, status=500)
+        booking_id = Payment.booking_id_for_reference(booking_ref)
+        Payment.objects.create(
+            booking=Booking.objects.filter(pk=booking_id).first()
+            if booking_id else None,
+            booking_reference=booking_ref,
+            amount=amount,
+            transaction_id=data['tx_ref'],
+            status="Pending"
+        )
+        return Response({"payment_url": data['checkout_url']}, status=200)
 
 
 class VerifyPaymentView(APIView):
     """An endpoint in the API to verify the payment status
-    with Chapa after a user completes a payment"""
+    with Chapa after a user completes a payment.
+
+    Verification runs in the `verify_payment` Celery task; the response
+    carries the payment's current status (202 while still Pending)."""
     def get(self, request):
         tx_ref = request.query_params.get('tx_ref')
 
-        verify_url = f"https://api.chapa.co/v1/transaction/verify/{tx_ref}"
-        headers = {
-            'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-        }
+        payment = Payment.objects.filter(transaction_id=tx_ref).first()
+        if payment is None:
+            return Response({"error": "Payment not found"}, status=404)
+
+        if payment.status == "Pending":
+            enqueue_payment_verification(tx_ref)
+            # eager workers (and fast ones) may already have settled it
+            payment.refresh_from_db(fields=['status'])
+
+        code = 202 if payment.status == "Pending" else 200
+        return Response({"status": payment.status}, status=code)
 
-        response = requests.get(verify_url, headers=headers)
 
-        if response.status_code == 200:
-            data = response.json().get('data')
-            status_text = data.get('status')
+class ChapaWebhookView(APIView):
+    """Receives Chapa payment webhooks.
 
-            payment = Payment.objects.filter(transaction_id=tx_ref).first()
-            if payment:
-                if status_text == "success":
-                    payment.status = "Completed"
-                    # Trigger email via Celery here
-                else:
-                    payment.status = "Failed"
-                payment.save()
+    The signature is checked against the raw body, the event is stored
+    (duplicates collapse onto the existing row) and the request returns
+    at once; `process_payment_events` applies events in batches."""
+    authentication_classes = []
+    signature_headers = ['X-Chapa-Signature', 'Chapa-Signature']
+
+    def post(self, request):
+        body = request.body
+        if not self.signature_is_valid(request, body):
+            return Response({"error": "Invalid signature"}, status=401)
 
-            return Response({"status": payment.status}, status=200)
+        try:
+            payload = json.loads(body)
+            tx_ref = str(payload['tx_ref'])
+        except (ValueError, KeyError, TypeError):
+            return Response({"error": "Invalid payload"}, status=400)
 
-        return Response({"error": "Payment verification failed"}, status=500)
+        event = str(payload.get('event', ''))
+        status_text = str(payload.get('status', ''))
+        PaymentEvent.objects.bulk_create([PaymentEvent(
+            event_id=PaymentEvent.make_event_id(tx_ref, event, status_text),
+            tx_ref=tx_ref,
+            event=event,
+            status=status_text,
+            payload=payload,
+        )], ignore_conflicts=True)
+        schedule_payment_event_processing()
+        return Response({"status": "accepted"}, status=200)
+
+    def signature_is_valid(self, request, body):
+        secret = settings.CHAPA_WEBHOOK_SECRET
+        if not secret:
+            return False
+        expected = hmac.new(
+            secret.encode(), body, hashlib.sha256).hexdigest()
+        return any(
+            hmac.compare_digest(expected, request.headers.get(header, ''))
+            for header in self.signature_headers
+        )
+
+
+class ExportView(APIView):
+    """Streams a full table dump as CSV or NDJSON (`?gzip=1` to compress).
+
+    Rows are read in chunks and written as they are encoded, so memory
+    stays flat and the first byte goes out before the table is read."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind, fmt):
+        if kind not in EXPORTS or fmt not in FORMATS:
+            raise Http404
+        gzip = request.query_params.get('gzip') in ('1', 'true')
+        response = StreamingHttpResponse(
+            stream_export(kind, fmt, gzip=gzip),
+            content_type='application/gzip' if gzip else FORMATS[fmt])
+        response['Content-Disposition'] = (
+            f'attachment; filename="{export_filename(kind, fmt, gzip)}"')
+        return response
+
+
+class MetricsView(APIView):
+    """Request histograms of this process in the Prometheus text format.
+
+    Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`;
+    without a token configured only staff users may read them."""
+    permission_classes = []
+
+    def get(self, request):
+        if settings.METRICS_TOKEN:
+            allowed = has_metrics_token(request)
+        else:
+            allowed = request.user.is_active and request.user.is_staff
+        if not allowed:
+            return Response({"error": "Forbidden"}, status=403)
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)